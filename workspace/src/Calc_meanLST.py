@@ -10,32 +10,82 @@ Geotiff形式のLSTデータを読み込み、平均値を計算するスクリ
 ・相対パス： workspace/data/geotiff/LST_{YEAR}/LST_{YEAR}_{MONTH}.tif
 例: workspace/data/geotiff/LST_2023/LST_2023_01.tif
 ・ LST値が0のピクセルは無視して平均値を計算
+・ streaming=True の場合は内部ブロック（block_windows）単位で読み込み、
+  件数・平均・分散・最小・最大を逐次更新する（メモリ使用量はブロックサイズで決まる）
+・ --city を指定した場合は研究対象都市の ROI と重なるブロックだけを読み込み、ROI 内の画素だけを集計する
 
 - 出力データの概要
 ・形式: CSV
 ・相対パス： workspace/data/csv/LST_mean_{YEAR}.csv
+・複数年をまとめて処理する場合（--start/--end または --years 指定時）は
+  年×月のファイルをプロセスプールで並列に処理し、縦持ち（Year, Month, ...）の1つのCSVに保存する
+  相対パス： workspace/data/csv/LST_mean_{START}_{END}.csv
+
+- 使い方
+python workspace/src/Calc_meanLST.py                       # 2023年のみ（従来通り）
+python workspace/src/Calc_meanLST.py --start 2001 --end 2024 --workers 8
 
 """
 
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import rasterio
 import pandas as pd
+from raster_stats import stream_raster_stats, LST_RANGE
+from instrumentation import stage
+
+def lst_file_path(year, month):
+    """指定された年・月のLSTデータ（GeoTIFF）の相対パスを返す関数"""
+    return f"workspace/data/geotiff/LST_{year}/LST_{year}_{month:02d}.tif"
+
+def stream_lst_stats(file_path, city=None):
+    """
+    GeoTIFFを内部ブロック単位で読み込み、有効画素（LST > 0）の統計量を逐次計算する関数
+    ブロックごとの統計量を raster_stats.StreamingStats で合成するため、シーン全体を読み込まない
+    :param file_path: LSTデータ（GeoTIFF）のパス
+    :param city: 指定した場合はその都市（シェープファイルの TinhThanh）の ROI 内だけを集計する
+    :return: count, mean, std, min, max を持つ辞書（有効画素がない場合は count=0, 他はNaN）
+    """
+    with stage('mean_lst', file=os.path.basename(file_path)) as st:
+        stats = stream_raster_stats(file_path, value_range=LST_RANGE, valid=lambda block: block > 0, city=city)
+        st.add(pixels=stats.count)
+    if stats.count == 0:
+        return {'count': 0, 'mean': np.nan, 'std': np.nan, 'min': np.nan, 'max': np.nan}
+    return {
+        'count': stats.count,
+        'mean': stats.mean,
+        'std': stats.std,
+        'min': stats.min,
+        'max': stats.max,
+    }
 
-def calculate_mean_lst(year):
+def calculate_mean_lst(year, streaming=False, city=None):
     """
     指定された年のLSTデータから平均値を計算し、CSVファイルに保存する関数
     :param year: 年（例: 2023）
+    :param streaming: True の場合はブロック単位で逐次計算し、件数・標準偏差・最小・最大も出力する
+    :param city: 指定した場合はその都市の ROI 内だけを集計する（ブロック単位の逐次計算を使う）
     """
     monthly_means = []
+    monthly_stats = []
 
     for month in range(1, 13):
         # ファイルパスの生成
-        file_path = f"workspace/data/geotiff/LST_{year}/LST_{year}_{month:02d}.tif"
+        file_path = lst_file_path(year, month)
         
         if not os.path.exists(file_path):
             print(f"ファイルが存在しません: {file_path}")
             monthly_means.append(np.nan)
+            monthly_stats.append({'count': 0, 'mean': np.nan, 'std': np.nan, 'min': np.nan, 'max': np.nan})
+            continue
+
+        if streaming or city:
+            # ブロック単位で逐次計算（シーン全体を読み込まない）
+            stats = stream_lst_stats(file_path, city=city)
+            monthly_means.append(stats['mean'])
+            monthly_stats.append(stats)
             continue
         
         # GeoTIFFファイルの読み込み
@@ -56,13 +106,84 @@ def calculate_mean_lst(year):
         'Month': [f"{month:02d}" for month in range(1, 13)],
         'Mean_LST': monthly_means
     })
+    if streaming or city:
+        df['Count'] = [stats['count'] for stats in monthly_stats]
+        df['Std_LST'] = [stats['std'] for stats in monthly_stats]
+        df['Min_LST'] = [stats['min'] for stats in monthly_stats]
+        df['Max_LST'] = [stats['max'] for stats in monthly_stats]
 
     # CSVファイルに保存
     output_path = f"workspace/data/csv/LST_mean_{year}.csv"
     df.to_csv(output_path, index=False)
     print(f"平均LST値を保存しました: {output_path}")
 
+def monthly_lst_record(year, month, city=None):
+    """
+    1か月分のLSTデータの統計量を縦持ちの1行（辞書）として返す関数
+    プロセスプールのワーカーから呼び出すため、モジュールのトップレベルに定義する
+    """
+    file_path = lst_file_path(year, month)
+    if os.path.exists(file_path):
+        stats = stream_lst_stats(file_path, city=city)
+    else:
+        stats = {'count': 0, 'mean': np.nan, 'std': np.nan, 'min': np.nan, 'max': np.nan}
+    return {
+        'Year': year,
+        'Month': f"{month:02d}",
+        'Mean_LST': stats['mean'],
+        'Count': stats['count'],
+        'Std_LST': stats['std'],
+        'Min_LST': stats['min'],
+        'Max_LST': stats['max'],
+    }
+
+def calculate_mean_lst_batch(years, max_workers=None, output_path=None, city=None):
+    """
+    複数年のLSTデータから月平均値を並列に計算し、縦持ちの1つのCSVファイルに保存する関数
+    年×月の各ファイルを1タスクとしてプロセスプールに割り当てる（各タスクはブロック単位で逐次計算）
+    :param years: 年のリスト（例: range(2001, 2025)）
+    :param max_workers: ワーカープロセス数（None の場合は CPU コア数）
+    :param output_path: 出力CSVのパス（None の場合は LST_mean_{START}_{END}.csv）
+    :param city: 指定した場合はその都市の ROI 内だけを集計する
+    :return: 縦持ちのDataFrame
+    """
+    years = sorted(set(years))
+    tasks = [(year, month) for year in years for month in range(1, 13)]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        years_arg, months_arg = zip(*tasks)
+        records = list(executor.map(monthly_lst_record, years_arg, months_arg, [city] * len(tasks)))
+
+    for record in records:
+        if record['Count'] == 0:
+            print(f"有効なデータがありません: {lst_file_path(record['Year'], int(record['Month']))}")
+
+    df = pd.DataFrame(records)
+
+    if output_path is None:
+        output_path = f"workspace/data/csv/LST_mean_{years[0]}_{years[-1]}.csv"
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    df.to_csv(output_path, index=False)
+    print(f"平均LST値を保存しました: {output_path}")
+    return df
+
 if __name__ == "__main__":
-    # 年を指定して関数を実行
-    year = 2023  # 例: 2023年のデータを処理
-    calculate_mean_lst(year)
\ No newline at end of file
+    ap = argparse.ArgumentParser(description="月ごとの平均LSTを計算してCSVに保存する")
+    ap.add_argument("--year", type=int, default=2023, help="単年で処理する年（従来の動作）")
+    ap.add_argument("--start", type=int, default=None, help="複数年処理の開始年")
+    ap.add_argument("--end", type=int, default=None, help="複数年処理の終了年（この年を含む）")
+    ap.add_argument("--years", type=int, nargs="+", default=None, help="処理する年を個別に指定（例: 2001 2023 2024）")
+    ap.add_argument("--workers", type=int, default=None, help="並列処理のワーカー数（既定: CPU コア数）")
+    ap.add_argument("--streaming", action="store_true", help="単年処理でもブロック単位の逐次計算を使う")
+    ap.add_argument("--city", type=str, default=None, help="ROI で切り出す都市（シェープファイルの TinhThanh, 例: 'Hà Nội'）")
+    args = ap.parse_args()
+
+    if args.years or args.start is not None:
+        if args.years:
+            years = args.years
+        else:
+            years = range(args.start, (args.end if args.end is not None else args.start) + 1)
+        calculate_mean_lst_batch(years, max_workers=args.workers, city=args.city)
+    else:
+        # 年を指定して関数を実行
+        calculate_mean_lst(args.year, streaming=args.streaming, city=args.city)
\ No newline at end of file
@@ -19,6 +19,8 @@ REGION = [105.80, 10.00, 106.00, 10.20]
 from datetime import datetime
 import ee
 
+from gee_export_queue import ExportQueue
+
 GGE_PROJECT = 'master-research-465403'  # Google Earth EngineプロジェクトID
 
 # 取得するデータの期間
@@ -61,8 +63,9 @@ for t in dates:
     dt = datetime.utcfromtimestamp(t / 1000)
     print(dt.strftime('%Y-%m-%d %H:%M:%S'))
 
-# GeoTIFFでエクスポート
-task = ee.batch.Export.image.toDrive(
+# GeoTIFFでエクスポート（キューで状態を確認しながら完了まで待つ）
+queue = ExportQueue(journal_path=f'workspace/data/cache/export_journal_{FILE_NAME_PREFIX}.json')
+queue.submit('Hanoi_MODIS_LST_Mesh', lambda: ee.batch.Export.image.toDrive(
     image=mean_lst,
     description='Hanoi_MODIS_LST_Mesh',
     folder=FOLDER_NAME,
@@ -71,8 +74,10 @@ task = ee.batch.Export.image.toDrive(
     scale=SCALE,
     crs=CRS,
     maxPixels=MAX_PIXELS
-)
-
-task.start()
-print("Export task started. Check your Google Drive's 'EarthEngine'フォルダ.")
+))
+queue.run()
+if queue.failed():
+    print("Export task failed:", queue.failed())
+else:
+    print("Export task completed. Check your Google Drive's 'EarthEngine'フォルダ.")
 
@@ -14,6 +14,8 @@ from datetime import datetime
 import ee
 import geemap
 
+from gee_export_queue import ExportQueue
+
 # ==== プロジェクト/初期化 ====
 GEE_PROJECT = 'master-research-465403'   # 必要に応じて変更
 try:
@@ -129,7 +131,8 @@ for k in sorted(stats.keys()):
 
 # === エクスポート（任意） ===
 if ENABLE_EXPORT:
-    task = ee.batch.Export.image.toDrive(
+    queue = ExportQueue(journal_path=f'workspace/data/cache/export_journal_{FILE_NAME_PREFIX}.json')
+    queue.submit(f'{FILE_NAME_PREFIX}_BT_C', lambda: ee.batch.Export.image.toDrive(
         image=img_bt.select('BT_C').reproject(crs=CRS, scale=SCALE),
         description=f'{FILE_NAME_PREFIX}_BT_C',
         folder=FOLDER_NAME,
@@ -138,6 +141,9 @@ if ENABLE_EXPORT:
         scale=SCALE,
         crs=CRS,
         maxPixels=MAX_PIXELS
-    )
-    task.start()
-    print('[Export] Started to Google Drive:', f'{FILE_NAME_PREFIX}_BT_C')
+    ))
+    queue.run()
+    if queue.failed():
+        print('[Export] Failed:', queue.failed())
+    else:
+        print('[Export] Completed to Google Drive:', f'{FILE_NAME_PREFIX}_BT_C')
@@ -15,30 +15,36 @@ https://developers.google.com/earth-engine/datasets/catalog/MODIS_061_MOD11A2
 データセットの利用可能時期
 2000-02-18 T00:00:00 ~ 
 
+- 取得方法
+領域平均LSTはサーバー側で各画像のプロパティとして計算し、
+(system:time_start, mean_LST_C) の表を reduceColumns で1回の getInfo でまとめて取得する。
+取得結果は ROI・コレクション・バンドごとに workspace/data/cache/time_series/ にCSVでキャッシュし、
+再描画や期間を広げた場合はキャッシュにない日付だけを取得する。
+キャッシュは Parquet ではなく CSV とする。environment.yml に Parquet のエンジン（pyarrow / fastparquet）が無く、
+時系列は 8日合成で1年あたり約46行 × 2列と小さいため、列指向の形式にしても読み書きはほとんど速くならない。
+取得済みの期間は行から復元できない（期間の端や雲で画像が無い期間がある）ため、別の JSON に [開始, 終了) として保存する。
+
 """
 
+import os
+import json
+import hashlib
 import ee
 import pandas as pd
 import matplotlib.pyplot as plt
 import geopandas as gpd
-from datetime import datetime
-
+from datetime import datetime, timezone
 
-# 認証・初期化
-try:
-    ee.Initialize()
-except Exception:
-    ee.Authenticate()
-    ee.Initialize()
 
-# ROI（関心領域）を定義
-roi = ee.Geometry.Rectangle([105.27, 20.55, 106.03, 21.40])
+COLLECTION_ID = "MODIS/061/MOD11A2"
+BAND = "LST_Day_1km"
+ROI_BOUNDS = [105.27, 20.55, 106.03, 21.40]
+START_DATE = "2021-01-01"
+END_DATE = "2023-08-31"
+CACHE_DIR = 'workspace/data/cache/time_series'
 
-# MODIS LSTコレクション（8日合成）
-collection = ee.ImageCollection("MODIS/061/MOD11A2") \
-    .select("LST_Day_1km") \
-    .filterDate("2021-01-01", "2023-08-31") \
-    .filterBounds(roi)
+# ROI（関心領域）を定義（ee.Initialize 後に設定）
+roi = None
 
 # LST値を摂氏に変換
 def convert_lst(img):
@@ -46,8 +52,6 @@ def convert_lst(img):
     lst = lst.rename('LST_C')
     return lst.copyProperties(img, ["system:time_start", "system:time_end"])
 
-LSTDay = collection.map(convert_lst)
-
 # 領域平均LSTを画像プロパティとして追加
 def add_mean_property(img):
     stats = img.reduceRegion(
@@ -59,40 +63,102 @@ def add_mean_property(img):
     mean = stats.get('LST_C')
     return img.set({'mean_LST_C': mean})
 
-LSTDay_mean = LSTDay.map(add_mean_property)
-
-# DOY（年内通日）と年ごとのLSTを抽出
-info = LSTDay_mean.toList(LSTDay_mean.size())
-dates = []
-years = []
-doys = []
-values = []
-
-for i in range(info.size().getInfo()):
-    img = ee.Image(info.get(i))
-    timestamp = img.get('system:time_start').getInfo()
-    if timestamp is not None:
-        dt = datetime.utcfromtimestamp(timestamp / 1000)
-        doy = dt.timetuple().tm_yday
-        year = dt.year
-        val = img.get('mean_LST_C').getInfo()
-        if val is not None:
-            dates.append(dt)
-            years.append(year)
-            doys.append(doy)
-            values.append(val)
-
-df = pd.DataFrame({'date': dates, 'year': years, 'doy': doys, 'LST_C': values})
-
-# 年ごとにDOYでプロット
-plt.figure(figsize=(12,6))
-for y in sorted(df['year'].unique()):
-    sub = df[df['year'] == y]
-    plt.plot(sub['doy'], sub['LST_C'], label=str(y))
-plt.xlabel('Day of Year (DOY)')
-plt.ylabel('Land Surface Temperature (°C)')
-plt.title('Seasonal Variation of Land Surface Temperature (2019-2023)')
-plt.legend()
-plt.tight_layout()
-plt.show()
-plt.savefig('hanoi_lst_time_series.png')
\ No newline at end of file
+def fetch_series(start, end):
+    """
+    期間内の (time_start, LST_C) を1回の getInfo で取得する
+    値が null の画像は除外される
+    """
+    # MODIS LSTコレクション（8日合成）
+    collection = ee.ImageCollection(COLLECTION_ID) \
+        .select(BAND) \
+        .filterDate(start, end) \
+        .filterBounds(roi)
+
+    LSTDay_mean = collection.map(convert_lst).map(add_mean_property)
+    rows = LSTDay_mean.reduceColumns(
+        reducer=ee.Reducer.toList(2),
+        selectors=['system:time_start', 'mean_LST_C']
+    ).get('list').getInfo()
+    return pd.DataFrame(rows, columns=['time_start', 'LST_C'])
+
+def cache_paths():
+    """ROI・コレクション・バンドごとのキャッシュファイル（データ, 取得済み期間）のパス"""
+    key = hashlib.sha1(json.dumps([COLLECTION_ID, BAND, ROI_BOUNDS]).encode('utf-8')).hexdigest()[:12]
+    base = os.path.join(CACHE_DIR, f"{COLLECTION_ID.replace('/', '_')}_{key}")
+    return base + '.csv', base + '.json'
+
+def load_series(start, end):
+    """
+    キャッシュを使って期間内の時系列を返す
+    キャッシュの取得済み期間 [cached_start, cached_end) の外側だけをサーバーから取得して追記する
+    """
+    data_path, range_path = cache_paths()
+    if os.path.exists(data_path) and os.path.exists(range_path):
+        cached = pd.read_csv(data_path)
+        with open(range_path, 'r') as f:
+            cached_start, cached_end = json.load(f)
+    else:
+        cached = pd.DataFrame(columns=['time_start', 'LST_C'])
+        cached_start = cached_end = None
+
+    missing = []
+    if cached_start is None:
+        missing.append((start, end))
+    else:
+        if start < cached_start:
+            missing.append((start, cached_start))
+        if end > cached_end:
+            missing.append((cached_end, end))
+
+    if missing:
+        frames = [f for f in [cached] + [fetch_series(s, e) for s, e in missing] if not f.empty]
+        if frames:
+            cached = pd.concat(frames, ignore_index=True)
+        cached = cached.drop_duplicates(subset='time_start').sort_values('time_start')
+        cached_start = min([start] + ([cached_start] if cached_start else []))
+        cached_end = max([end] + ([cached_end] if cached_end else []))
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        cached.to_csv(data_path, index=False)
+        with open(range_path, 'w') as f:
+            json.dump([cached_start, cached_end], f)
+        print(f"取得した期間: {missing}")
+
+    start_ms = datetime.strptime(start, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp() * 1000
+    end_ms = datetime.strptime(end, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp() * 1000
+    return cached[(cached['time_start'] >= start_ms) & (cached['time_start'] < end_ms)]
+
+def main():
+    global roi
+    # 認証・初期化
+    try:
+        ee.Initialize()
+    except Exception:
+        ee.Authenticate()
+        ee.Initialize()
+    roi = ee.Geometry.Rectangle(ROI_BOUNDS)
+
+    # DOY（年内通日）と年ごとのLSTを抽出
+    series = load_series(START_DATE, END_DATE)
+    dates = [datetime.utcfromtimestamp(t / 1000) for t in series['time_start']]
+    df = pd.DataFrame({
+        'date': dates,
+        'year': [dt.year for dt in dates],
+        'doy': [dt.timetuple().tm_yday for dt in dates],
+        'LST_C': series['LST_C'].to_numpy(),
+    })
+
+    # 年ごとにDOYでプロット
+    plt.figure(figsize=(12,6))
+    for y in sorted(df['year'].unique()):
+        sub = df[df['year'] == y]
+        plt.plot(sub['doy'], sub['LST_C'], label=str(y))
+    plt.xlabel('Day of Year (DOY)')
+    plt.ylabel('Land Surface Temperature (°C)')
+    plt.title('Seasonal Variation of Land Surface Temperature (2019-2023)')
+    plt.legend()
+    plt.tight_layout()
+    plt.show()
+    plt.savefig('hanoi_lst_time_series.png')
+
+if __name__ == "__main__":
+    main()
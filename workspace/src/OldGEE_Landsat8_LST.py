@@ -29,6 +29,8 @@ ROI = [105.80, 10.00, 106.00, 10.20]
 from datetime import datetime
 import ee
 
+from gee_export_queue import ExportQueue
+
 GGE_PROJECT = 'master-research-465403'  # Google Earth EngineプロジェクトID
 
 ### 
@@ -103,7 +105,9 @@ for t in dates:
 
 
 # Earth EngineのタスクとしてGeoTIFFでエクスポート（Google Driveに保存）
-task = ee.batch.Export.image.toDrive(
+# キューで状態を確認しながら完了まで待つ（失敗時は再試行、状態はジャーナルに保存）
+queue = ExportQueue(journal_path=f'workspace/data/cache/export_journal_{FILE_NAME_PREFIX}.json')
+queue.submit('Hanoi_LST_Mesh', lambda: ee.batch.Export.image.toDrive(
     image=mean_lst, # エクスポートする画像
     description='Hanoi_LST_Mesh', # タスクの説明。Earth Engineの「Tasks」タブで表示される名前
     folder=FOLDER_NAME, # Google Drive内の保存先フォルダ名
@@ -112,8 +116,11 @@ task = ee.batch.Export.image.toDrive(
     scale=SCALE,   # 出力画像の解像度（メートル単位）
     crs=CRS,
     maxPixels=MAX_PIXELS 
-)
+))
 
 
-task.start()
-print("Export task started. Check your Google Drive's 'EarthEngine'フォルダ.")
+queue.run()
+if queue.failed():
+    print("Export task failed:", queue.failed())
+else:
+    print("Export task completed. Check your Google Drive's 'EarthEngine'フォルダ.")
@@ -0,0 +1,299 @@
+"""
+ローカル処理ステージのベンチマーク（合成ラスタを使用）
+
+Landsat と同じ形式の合成 GeoTIFF を指定サイズで作成し、各ステージの
+処理時間・スループット（Mpx/s）・ピークメモリを計測して JSON に保存する。
+コミット間で JSON を比較すれば、本番のバッチを流す前に性能の劣化に気づける。
+
+- 合成データ（--workdir 以下, 既定は一時フォルダ）
+workspace/data/geotiff/LST_{YEAR}/LST_{YEAR}_{MM}.tif  月別 LST（float32, 12か月, 0 = 欠損）
+reflectance/L8_{time}_Hanoi_Reflectance.tif           反射バンド（float32, SR_B1〜SR_B7 の7バンド）
+level1/{シーンID}_B10.TIF, {シーンID}_MTL.txt          Band10（uint16）と MTL
+
+- ステージ
+mean_lst            Calc_meanLST.calculate_mean_lst（全体読み込み）
+mean_lst_streaming  Calc_meanLST.calculate_mean_lst(streaming=True)（ブロック単位）
+ref_indices         calc_ref_bands.process_scene（NDVI/NDWI/NDBI の計算・保存）
+bt_direct           rowLandsat8_getLST.calc_TOA + radiance_to_btK（配列演算のみ）
+bt_lut              rowLandsat8_getLST.dn_to_btC(method='lut')（配列演算のみ）
+bt_scene            rowLandsat8_getLST.convert_scene（読み込み・変換・保存）
+
+- 計測方法
+各ステージは新しいプロセス（spawn）で実行し、
+・seconds     : repeats 回のうち最短の実行時間
+・mpx_per_s   : 処理した画素数 / seconds（100万画素/秒）
+・peak_rss_mb : プロセスの最大常駐メモリ（ru_maxrss）
+・peak_alloc_mb: 1回の実行中の Python/NumPy の確保量のピーク（tracemalloc）
+を記録する。
+
+- 使い方
+python workspace/src/benchmark_stages.py --size 2048
+python workspace/src/benchmark_stages.py --size 4096 --stages ref_indices bt_lut --compare workspace/data/benchmark/bench_abc1234.json
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+import contextlib
+import multiprocessing
+from datetime import datetime, timezone
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+OUTPUT_FOLDER = 'workspace/data/benchmark'
+DEFAULT_SIZE = 2048
+DEFAULT_REPEATS = 3
+YEAR = 2023
+REGRESSION_THRESHOLD = 0.10  # スループットがこの割合以上下がったら劣化とみなす
+
+SCENE_ID = 'LC08_L1TP_127045_20230707_20230718_02_T1'
+REFLECTANCE_NAME = 'L8_20230707_032145_Hanoi_Reflectance.tif'
+MTL_CONSTANTS = {
+    'RADIANCE_MULT_BAND_10': 3.3420E-04,
+    'RADIANCE_ADD_BAND_10': 0.10000,
+    'K1_CONSTANT_BAND_10': 774.8853,
+    'K2_CONSTANT_BAND_10': 1321.0789,
+}
+
+# --------------------
+# 合成データ
+# --------------------
+def _profile(size, count, dtype, nodata):
+    return dict(driver='GTiff', width=size, height=size, count=count, dtype=dtype, nodata=nodata,
+                crs='EPSG:32648', transform=from_origin(560000, 2350000, 30, 30),
+                tiled=True, blockxsize=256, blockysize=256)
+
+
+def make_monthly_lst(workdir, size, year=YEAR, seed=0):
+    """月別 LST（Calc_meanLST.lst_file_path と同じ配置）"""
+    rng = np.random.default_rng(seed)
+    folder = os.path.join(workdir, f'workspace/data/geotiff/LST_{year}')
+    os.makedirs(folder, exist_ok=True)
+    os.makedirs(os.path.join(workdir, 'workspace/data/csv'), exist_ok=True)
+    for month in range(1, 13):
+        data = rng.normal(30, 5, (size, size)).astype(np.float32)
+        data[rng.random((size, size)) < 0.2] = 0
+        with rasterio.open(os.path.join(folder, f'LST_{year}_{month:02d}.tif'), 'w',
+                           **_profile(size, 1, 'float32', 0)) as dst:
+            dst.write(data, 1)
+
+
+def make_reflectance(workdir, size, seed=1):
+    """反射バンド（gee_landsat8_get_data のエクスポートと同じ SR_B1〜SR_B7）"""
+    rng = np.random.default_rng(seed)
+    folder = os.path.join(workdir, 'reflectance')
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, REFLECTANCE_NAME)
+    with rasterio.open(path, 'w', **_profile(size, 7, 'float32', None)) as dst:
+        for band in range(1, 8):
+            dst.write(rng.uniform(0.0, 0.5, (size, size)).astype(np.float32), band)
+            dst.set_band_description(band, f'SR_B{band}')
+    return path
+
+
+def make_level1(workdir, size, seed=2):
+    """Band10（uint16, 0 = 欠損）と MTL"""
+    rng = np.random.default_rng(seed)
+    folder = os.path.join(workdir, 'level1')
+    os.makedirs(folder, exist_ok=True)
+    b10 = os.path.join(folder, f'{SCENE_ID}_B10.TIF')
+    data = rng.integers(20000, 40000, (size, size), dtype=np.uint16)
+    data[:size // 16] = 0
+    with rasterio.open(b10, 'w', **_profile(size, 1, 'uint16', 0)) as dst:
+        dst.write(data, 1)
+    mtl = os.path.join(folder, f'{SCENE_ID}_MTL.txt')
+    with open(mtl, 'w') as f:
+        f.write('GROUP = LEVEL1_RADIOMETRIC_RESCALING\n')
+        for key, value in MTL_CONSTANTS.items():
+            f.write(f'    {key} = {value}\n')
+        f.write('END_GROUP = LEVEL1_RADIOMETRIC_RESCALING\nEND\n')
+    return b10, mtl
+
+
+def make_synthetic(workdir, size):
+    make_monthly_lst(workdir, size)
+    make_reflectance(workdir, size)
+    make_level1(workdir, size)
+
+# --------------------
+# ステージ（準備して (実行する関数, 画素数) を返す）
+# --------------------
+def setup_mean_lst(workdir, size, streaming=False):
+    from Calc_meanLST import calculate_mean_lst
+    return (lambda: calculate_mean_lst(YEAR, streaming=streaming)), 12 * size * size
+
+
+def setup_ref_indices(workdir, size):
+    from calc_ref_bands import process_scene
+    out = os.path.join(workdir, 'indexes')
+    os.makedirs(out, exist_ok=True)
+    path = os.path.join(workdir, 'reflectance', REFLECTANCE_NAME)
+    return (lambda: process_scene(path, out)), size * size
+
+
+def _level1(workdir):
+    from rowLandsat8_getLST import read_bt_constants
+    folder = os.path.join(workdir, 'level1')
+    b10 = os.path.join(folder, f'{SCENE_ID}_B10.TIF')
+    constants = read_bt_constants(os.path.join(folder, f'{SCENE_ID}_MTL.txt'))
+    return b10, constants
+
+
+def setup_bt_direct(workdir, size):
+    from rowLandsat8_getLST import calc_TOA, radiance_to_btK
+    b10, (MULT, ADD, K1, K2) = _level1(workdir)
+    with rasterio.open(b10) as src:
+        dn = src.read(1)
+    return (lambda: radiance_to_btK(calc_TOA(dn, MULT, ADD), K1, K2) - 273.15), size * size
+
+
+def setup_bt_lut(workdir, size):
+    from rowLandsat8_getLST import dn_to_btC
+    b10, constants = _level1(workdir)
+    with rasterio.open(b10) as src:
+        dn, nodata = src.read(1), src.nodata
+    return (lambda: dn_to_btC(dn, nodata, *constants, method='lut')), size * size
+
+
+def setup_bt_scene(workdir, size):
+    from rowLandsat8_getLST import convert_scene
+    b10, constants = _level1(workdir)
+    out = os.path.join(workdir, 'level1', f'{SCENE_ID}_BT_C.tif')
+    return (lambda: convert_scene(b10, out, constants, method='lut')), size * size
+
+
+STAGES = {
+    'mean_lst': setup_mean_lst,
+    'mean_lst_streaming': lambda workdir, size: setup_mean_lst(workdir, size, streaming=True),
+    'ref_indices': setup_ref_indices,
+    'bt_direct': setup_bt_direct,
+    'bt_lut': setup_bt_lut,
+    'bt_scene': setup_bt_scene,
+}
+
+# --------------------
+# 計測
+# --------------------
+def measure_stage(name, workdir, size, repeats):
+    """1ステージを計測する（spawn した子プロセスで実行される）"""
+    os.chdir(workdir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn, pixels = STAGES[name](workdir, size)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        fn()
+        _, peak_alloc = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    seconds = min(times)
+    return {
+        'pixels': pixels,
+        'seconds': seconds,
+        'seconds_all': times,
+        'mpx_per_s': pixels / seconds / 1e6,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_alloc_mb': peak_alloc / 2 ** 20,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(stages, size, repeats, workdir):
+    ctx = multiprocessing.get_context('spawn')
+    results = {}
+    for name in stages:
+        with ctx.Pool(1) as pool:
+            results[name] = pool.apply(measure_stage, (name, workdir, size, repeats))
+        r = results[name]
+        print(f"{name:20s} {r['seconds']:8.3f} s  {r['mpx_per_s']:8.1f} Mpx/s  "
+              f"RSS {r['peak_rss_mb']:8.1f} MB  alloc {r['peak_alloc_mb']:8.1f} MB")
+    return results
+
+
+def compare(results, baseline_path, threshold=REGRESSION_THRESHOLD):
+    """
+    以前の結果と比較して表示する
+    :return: スループットが threshold 以上下がったステージ名のリスト
+    """
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    print(f"比較対象: {baseline_path}（commit {baseline.get('commit')}, size {baseline.get('size')}）")
+    regressions = []
+    for name, r in results.items():
+        old = baseline.get('results', {}).get(name)
+        if old is None:
+            continue
+        ratio = r['mpx_per_s'] / old['mpx_per_s']
+        mark = ''
+        if ratio < 1 - threshold:
+            mark = '  <-- 劣化'
+            regressions.append(name)
+        print(f"{name:20s} {old['mpx_per_s']:8.1f} -> {r['mpx_per_s']:8.1f} Mpx/s ({ratio:5.2f}x){mark}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="ローカル処理ステージのベンチマーク")
+    ap.add_argument("--size", type=int, default=DEFAULT_SIZE, help="合成ラスタの一辺の画素数")
+    ap.add_argument("--repeats", type=int, default=DEFAULT_REPEATS, help="各ステージの繰り返し回数")
+    ap.add_argument("--stages", type=str, nargs='+', default=list(STAGES), choices=list(STAGES))
+    ap.add_argument("--workdir", type=str, default=None, help="合成データのフォルダ（既定: 一時フォルダ）")
+    ap.add_argument("--out", type=str, default=None, help="結果の JSON（既定: workspace/data/benchmark/bench_{commit}.json）")
+    ap.add_argument("--compare", type=str, default=None, help="比較する以前の結果の JSON")
+    args = ap.parse_args()
+
+    # spawn した子プロセスからもこのフォルダのモジュールを import できるようにする
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [src_dir, os.environ.get('PYTHONPATH')]))
+
+    commit = git_commit()
+    out_path = args.out or os.path.join(OUTPUT_FOLDER, f"bench_{commit or 'local'}.json")
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = os.path.abspath(args.workdir or tmp)
+        print(f"合成データを作成します: {args.size} x {args.size}（{workdir}）")
+        make_synthetic(workdir, args.size)
+        results = run_benchmarks(args.stages, args.size, args.repeats, workdir)
+
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'size': args.size,
+        'repeats': args.repeats,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'rasterio': rasterio.__version__,
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    with open(out_path, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"保存しました: {out_path}")
+
+    if args.compare:
+        regressions = compare(results, args.compare)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,13 +6,53 @@ Landsat8のバンドから各種指標を計算し、GeoTIFFで保存するス
 - NDWI (Normalized Difference Water Index)
 - NDBI (Normalized Difference Built-up Index)
 
+指標は INDEX_DEFINITIONS に (バンドA, バンドB) として定義し、
+(A - B) / (A + B + 1e-10)（normalized_difference）を行ブロック単位で一度に計算する（融合カーネル）。
+必要なバンド（SR_B3〜SR_B6）だけを float32 で読み込み、事前確保した出力配列へ直接書き込む。
+指標を追加する場合は INDEX_DEFINITIONS に1行追加すればよい。
+統計量（最小・最大・平均・標準偏差・パーセンタイル）は行ブロックを計算した直後に
+raster_stats.StreamingStats へ取り込み、指標配列を再走査しない。
+--city を指定した場合は研究対象都市の ROI ウィンドウだけを読み込み、ROI 外の画素は NaN とする。
+指標GeoTIFFは raster_io.write_cog で Cloud Optimized GeoTIFF（タイル・圧縮・オーバービュー付き）として保存する。
+--quantize を指定した場合は、指標ごとの float32 の3ファイルの代わりに、int16 に量子化した3バンドの1ファイル
+（{シーン}_Indexes.tif, scale 0.0001, 誤差 約 0.00005, nodata -32768）を保存する（読み込みは raster_io.read_band）。
+有効画素の圧縮（既定, --no-compact で無効）: 行ブロックごとに有効画素のマスク（使用する全バンドが正の反射率で、
+nodata・NaN・雲（raw DN のシーンの QA_PIXEL）・ROI 外でない）を作り、有効画素だけを詰めた1次元配列で
+指標と統計量を計算して、NaN で埋めた出力配列へ書き戻す。欠損・縁の画素で比が発散した値（NDBI = -226 など）が
+統計量に入らず、雲の多いシーンの計算量は晴天画素数に比例する。
+入力には raw DN のエクスポート（gee_landsat8_get_data の EXPORT_MODE = 'raw', L8_*_L2raw.tif）も使える。
+その場合は landsat_qa.Level2Scene で行ブロックごとにスケール変換・クラウドマスクしながら読み込み、
+出力名は反射バンドGeoTIFFと同じ（L8_*_Reflectance_{指標}.tif）にする。
+raw DN のシーンには LST の GeoTIFF がエクスポートされないため、同じシーンから LST（°C）も
+LST_FOLDER に L8_*_LST.tif として保存する（landsat_qa.mask_and_scale_scene。temporal_composite・lst_cube・
+zonal_stats はそのまま読める）。
+
+シーンはプロセスプールで並列に処理し、各ワーカーの統計量はメインプロセスの
+1つのライターが受け取った順に index_statistics_{YEAR}.csv へ書き出す。
+ワーカー数は CPU コア数と空きメモリ（1シーンあたりの必要量から推定）の小さい方とする。
+
+- 使い方
+python workspace/src/calc_ref_bands.py              # ワーカー数は自動決定
+python workspace/src/calc_ref_bands.py --workers 4
+python workspace/src/calc_ref_bands.py --city DaNang   # L8_*_DaNang_Reflectance.tif だけを ROI で切り出して処理
+python workspace/src/calc_ref_bands.py --quantize      # L8_*_Reflectance_Indexes.tif（int16, 3バンド）で保存
 
 """
 import os
+import csv
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import rasterio
 import numpy as np
 import pandas as pd
 from glob import glob
+from rasterio.windows import Window
+from raster_stats import StreamingStats, INDEX_RANGE, DEFAULT_PERCENTILES
+from roi_window import roi_for_dataset, roi_profile
+from regions import get_region
+from instrumentation import stage
+from raster_io import write_cog, write_quantized
+from landsat_qa import Level2Scene, is_level2_raw, mask_and_scale_scene, ST_BAND
 
 # -------------------------------
 # パラメータ設定
@@ -20,85 +60,335 @@ from glob import glob
 YEAR = 2023
 INPUT_FOLDER = f'workspace/data/geotiff/Landsat8/reflectance/{YEAR}'
 OUTPUT_FOLDER = f'workspace/data/geotiff/Landsat8/indexes/{YEAR}'
+# raw DN のシーンから作る LST GeoTIFF の出力フォルダ（temporal_composite.LST_FOLDER 以下）
+LST_FOLDER = f'workspace/data/geotiff/Landsat8/LST/{YEAR}'
 CSV_OUTPUT = f'workspace/data/csv/index_statistics_{YEAR}.csv'
+# 量子化した保存形式のファイル名の接尾辞（{シーン}_Indexes.tif）
+QUANTIZED_SUFFIX = 'Indexes'
+# raw DN のエクスポートのファイル名の接尾辞（gee_landsat8_get_data.export_raw_to_drive）
+RAW_SUFFIX = '_L2raw.tif'
+
+# 反射バンドGeoTIFF内のバンド番号（SR_B1〜SR_B7 の順で格納されている）
+BAND_NUMBERS = {
+    'SR_B2': 2,  # Blue
+    'SR_B3': 3,  # Green
+    'SR_B4': 4,  # Red
+    'SR_B5': 5,  # NIR
+    'SR_B6': 6,  # SWIR1
+}
+
+# 正規化差分指標の定義： 指標名 -> (バンドA, バンドB) で (A - B) / (A + B + 1e-10)
+INDEX_DEFINITIONS = {
+    'NDVI': ('SR_B5', 'SR_B4'),  # 正規化植生指数 (NIR - Red)
+    'NDWI': ('SR_B3', 'SR_B5'),  # 正規化水分指数 (Green - NIR)
+    'NDBI': ('SR_B6', 'SR_B5'),  # 正規化建物指数 (SWIR1 - NIR)
+}
+
+# 1回に読み込む行数（メモリ使用量はおおよそ 行数 × 列数 × 使用バンド数 × 4byte）
+CHUNK_ROWS = 1024
+
+# 有効画素だけを詰めて計算するか（False の場合は全画素で計算する従来の方法）
+COMPACT_VALID_PIXELS = True
+
+# 統計CSVに出力する統計量
+STAT_COLUMNS = ['min', 'max', 'mean', 'std'] + [f'p{q}' for q in DEFAULT_PERCENTILES]
+
+# ワーカー数の決定に使う空きメモリの割合
+MEMORY_FRACTION = 0.7
 
 # -------------------------------
 # 作成する指標関数
 # -------------------------------
 
-def calculate_ndvi(red, nir):
-    # 正規化植生指数
-    ndvi = (nir - red) / (nir + red + 1e-10)
-    return ndvi
+def normalized_difference(a, b, out, work):
+    """
+    INDEX_DEFINITIONS の全指標に共通の正規化差分 (A - B) / (A + B + 1e-10) を out に計算する関数
+    :param a, b: バンドA・バンドBの float32 配列
+    :param out: 出力先の配列（a と同じ形状）
+    :param work: 分母に使う作業配列（a と同じ形状）
+    """
+    np.subtract(a, b, out=out)
+    np.add(a, b, out=work)
+    work += 1e-10
+    np.divide(out, work, out=out)
+    return out
+
+def valid_pixels(chunk, nodata=None):
+    """
+    行ブロックの有効画素のマスクを返す関数
+    使用する全バンドが正の反射率（NaN・0 以下でない）で、nodata でない画素を True とする
+    :param chunk: (バンド, 行, 列) の float32 配列
+    """
+    valid = chunk[0] > 0
+    for band in chunk[1:]:
+        valid &= band > 0
+    if nodata is not None and not np.isnan(nodata) and nodata > 0:
+        for band in chunk:
+            valid &= band != nodata
+    return valid
 
-def calculate_ndwi(green, nir):
-    # 正規化水分指数
-    ndwi = (green - nir) / (green + nir + 1e-10)
-    return ndwi
+def compute_indices_fused(src, index_names=None, chunk_rows=CHUNK_ROWS, stats=None, window=None, mask=None,
+                          compact=COMPACT_VALID_PIXELS):
+    """
+    開いている反射バンドGeoTIFFから、複数の正規化差分指標を1パスで計算する関数
+    行ブロックごとに必要なバンドだけを float32 で読み込み、
+    各指標の事前確保した出力配列（float32）へ out= 指定で直接書き込む
+    :param src: rasterio のデータセット、または landsat_qa.Level2Scene（raw DN のシーン）
+    :param index_names: 計算する指標名のリスト（None の場合は INDEX_DEFINITIONS の全指標）
+    :param chunk_rows: 1回に読み込む行数
+    :param stats: 指標名 -> StreamingStats の辞書（指定した場合は行ブロックごとに統計量を更新する）
+    :param window: 読み込むウィンドウ（None の場合は全体）
+    :param mask: ウィンドウと同じ形状の真偽配列（False の画素は NaN とし、統計量から除く）
+    :param compact: True の場合は有効画素（valid_pixels）だけを詰めて計算し、それ以外の画素は NaN とする
+    :return: 指標名 -> float32 の2次元配列 の辞書
+    """
+    if index_names is None:
+        index_names = list(INDEX_DEFINITIONS)
 
-def calculate_ndbi(swir, nir):
-    # 正規化建物指数
-    ndbi = (swir - nir) / (swir + nir + 1e-10)
-    return ndbi
+    band_names = sorted({b for name in index_names for b in INDEX_DEFINITIONS[name]},
+                        key=lambda b: BAND_NUMBERS[b])
+    band_pos = {b: i for i, b in enumerate(band_names)}
+    indexes = [BAND_NUMBERS[b] for b in band_names]
+
+    if window is None:
+        window = Window(0, 0, src.width, src.height)
+    col_off, row_off = int(window.col_off), int(window.row_off)
+    height, width = int(window.height), int(window.width)
+    outputs = {name: np.empty((height, width), dtype=np.float32) for name in index_names}
+    denom = np.empty((min(chunk_rows, height), width), dtype=np.float32)
+    if compact:
+        # 有効画素を詰める作業配列（バンド, 画素）と分子の作業配列
+        packed = np.empty((len(band_names), min(chunk_rows, height) * width), dtype=np.float32)
+        numer = np.empty(min(chunk_rows, height) * width, dtype=np.float32)
+        nodata = getattr(src, 'nodata', None)
+
+    for row in range(0, height, chunk_rows):
+        rows = min(chunk_rows, height - row)
+        chunk_window = Window(col_off, row_off + row, width, rows)
+        if isinstance(src, Level2Scene):
+            chunk = src.read_bands(band_names, window=chunk_window)
+        else:
+            chunk = src.read(indexes, window=chunk_window, out_dtype=np.float32)
+        if compact:
+            valid = valid_pixels(chunk, nodata)
+            if mask is not None:
+                valid &= mask[row:row + rows]
+            idx = np.flatnonzero(valid)
+            n = idx.size
+            flat = chunk.reshape(len(band_names), -1)
+            for i in range(len(band_names)):
+                np.take(flat[i], idx, out=packed[i, :n])
+            d = denom.reshape(-1)[:n]
+            num = numer[:n]
+            for name in index_names:
+                a_name, b_name = INDEX_DEFINITIONS[name]
+                normalized_difference(packed[band_pos[a_name], :n], packed[band_pos[b_name], :n], num, d)
+                out = outputs[name][row:row + rows].reshape(-1)
+                out.fill(np.nan)
+                out[idx] = num
+                if stats is not None:
+                    stats[name].update(num)
+            continue
+
+        outside = None if mask is None else ~mask[row:row + rows]
+        d = denom[:rows]
+        for name in index_names:
+            a_name, b_name = INDEX_DEFINITIONS[name]
+            out = normalized_difference(chunk[band_pos[a_name]], chunk[band_pos[b_name]],
+                                        outputs[name][row:row + rows], d)
+            if outside is not None:
+                out[outside] = np.nan
+            if stats is not None:
+                stats[name].update(out)
+
+    return outputs
 
 # -------------------------------
 # 画像ごとの処理
 # -------------------------------
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-records = []
 
-for path in sorted(glob(os.path.join(INPUT_FOLDER, '*.tif'))):
-    with rasterio.open(path) as src:
-        profile = src.profile
-        bands = src.read()
-        print(np.nanmin(bands), np.nanmax(bands))
-        print (f'バンド名の確認: {src.descriptions} ')
-
-        band_dict = {
-            'SR_B2': bands[1],  # Blue
-            'SR_B3': bands[2],  # Green
-            'SR_B4': bands[3],  # Red
-            'SR_B5': bands[4],  # NIR
-            'SR_B6': bands[5],  # SWIR1
-        }
-
-
-        # 必要なバンドが揃っているか確認
-        if all(b is not None for b in band_dict.values()):
-            ndvi = calculate_ndvi(band_dict['SR_B4'], band_dict['SR_B5'])
-            ndwi = calculate_ndwi(band_dict['SR_B3'], band_dict['SR_B5'])
-            ndbi = calculate_ndbi(band_dict['SR_B6'], band_dict['SR_B5'])
-
-            index_stack = np.stack([ndvi, ndwi, ndbi])
-            index_names = ['NDVI', 'NDWI', 'NDBI']
-
-            for i, name in enumerate(index_names):
-                output_path = os.path.join(OUTPUT_FOLDER, os.path.basename(path).replace('.tif', f'_{name}.tif'))
-                profile.update(dtype=rasterio.float32, count=1)
-                with rasterio.open(output_path, 'w', **profile) as dst:
-                    dst.write(index_stack[i].astype(np.float32), 1)
-
-            # 統計量
-            stats = {
-                'filename': os.path.basename(path),
-                'NDVI_min': float(np.nanmin(ndvi)),
-                'NDVI_max': float(np.nanmax(ndvi)),
-                'NDVI_mean': float(np.nanmean(ndvi)),
-                'NDWI_min': float(np.nanmin(ndwi)),
-                'NDWI_max': float(np.nanmax(ndwi)),
-                'NDWI_mean': float(np.nanmean(ndwi)),
-                'NDBI_min': float(np.nanmin(ndbi)),
-                'NDBI_max': float(np.nanmax(ndbi)),
-                'NDBI_mean': float(np.nanmean(ndbi)),
-            }
-            records.append(stats)
-            print(f"{path}内の指標計算と保存が完了しました。")
-        else:
-            print(f"{path}内のファイルに必要なバンドが揃っていません。")
+def open_scene(path):
+    """反射バンドGeoTIFF（rasterio のデータセット）または raw DN のシーン（Level2Scene）を開く関数"""
+    return Level2Scene(path) if is_level2_raw(path) else rasterio.open(path)
+
+def output_name(path, suffix):
+    """出力ファイル名（raw DN のシーンも反射バンドGeoTIFFと同じ L8_*_Reflectance_{suffix}.tif にする）"""
+    name = os.path.basename(path)
+    if name.endswith(RAW_SUFFIX):
+        name = name[:-len(RAW_SUFFIX)] + '_Reflectance.tif'
+    return name.replace('.tif', f'_{suffix}.tif')
+
+def lst_output_path(path, lst_folder=LST_FOLDER):
+    """raw DN のシーンから作る LST GeoTIFF のパス（L8_*_L2raw.tif -> L8_*_LST.tif）"""
+    return os.path.join(lst_folder, os.path.basename(path)[:-len(RAW_SUFFIX)] + '_LST.tif')
+
+def process_scene(path, output_folder=OUTPUT_FOLDER, city=None, quantize=False, compact=COMPACT_VALID_PIXELS,
+                  lst_folder=LST_FOLDER):
+    """
+    1シーンの反射バンドGeoTIFFから指標を計算してGeoTIFFで保存し、統計量を返す関数
+    :param path: 反射バンドGeoTIFF（または raw DN のシーン L8_*_L2raw.tif）のパス
+    :param output_folder: 指標GeoTIFFの出力フォルダ
+    :param city: 指定した場合はその都市の ROI ウィンドウだけを処理する
+    :param quantize: True の場合は全指標を int16 に量子化して1ファイル（{シーン}_Indexes.tif）に保存する
+    :param compact: True の場合は有効画素だけを詰めて計算する（compute_indices_fused）
+    :param lst_folder: raw DN のシーンの場合に LST GeoTIFF を保存するフォルダ（None の場合は保存しない）
+    :return: 統計量の辞書（必要なバンドが揃っていない場合は None）
+    """
+    with stage('ref_indices', scene=os.path.basename(path)) as st:
+        if lst_folder and path.endswith(RAW_SUFFIX) and is_level2_raw(path):
+            with stage('ref_indices.lst'):
+                mask_and_scale_scene(path, lst_output_path(path, lst_folder), bands=[ST_BAND], city=city,
+                                     quantize=quantize)
+        with open_scene(path) as src:
+            print (f'バンド名の確認: {src.descriptions} ')
+
+            # 必要なバンドが揃っているか確認
+            if src.count < max(BAND_NUMBERS.values()):
+                print(f"{path}内のファイルに必要なバンドが揃っていません。")
+                return None
+
+            profile = src.profile
+            index_stats = {name: StreamingStats(INDEX_RANGE) for name in INDEX_DEFINITIONS}
+            with stage('ref_indices.compute'):
+                if city:
+                    roi = roi_for_dataset(src, city)
+                    profile = roi_profile(profile, roi)
+                    indices = compute_indices_fused(src, stats=index_stats, window=roi.window, mask=roi.mask,
+                                                    compact=compact)
+                else:
+                    indices = compute_indices_fused(src, stats=index_stats, compact=compact)
+        st.add(pixels=profile['height'] * profile['width'])
+
+        profile.update(dtype=rasterio.float32, count=1)
+        stats = {'filename': os.path.basename(path)}
+        with stage('ref_indices.write'):
+            if quantize:
+                output_path = os.path.join(output_folder, output_name(path, QUANTIZED_SUFFIX))
+                write_quantized(output_path, indices, profile)
+            for name, data in indices.items():
+                if not quantize:
+                    output_path = os.path.join(output_folder, output_name(path, name))
+                    write_cog(output_path, data, profile, descriptions=[name])
+
+                # 統計量（計算時に逐次集計済み）
+                summary = index_stats[name].to_dict(prefix=f'{name}_')
+                stats.update({f'{name}_{col}': summary[f'{name}_{col}'] for col in STAT_COLUMNS})
+
+    print(f"{path}内の指標計算と保存が完了しました。")
+    return stats
 
 # -------------------------------
-# 統計CSV出力
+# 並列実行
 # -------------------------------
-os.makedirs(os.path.dirname(CSV_OUTPUT), exist_ok=True)
-df = pd.DataFrame(records)
-df.to_csv(CSV_OUTPUT, index=False)
+
+def available_memory_bytes():
+    """空きメモリ量（byte）を返す関数。取得できない場合は None"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def scene_memory_bytes(path, chunk_rows=CHUNK_ROWS):
+    """1シーンの処理に必要なメモリ量（byte）の概算を返す関数"""
+    with rasterio.open(path) as src:
+        height, width = src.height, src.width
+    n_bands = len({b for bands in INDEX_DEFINITIONS.values() for b in bands})
+    outputs = height * width * 4 * len(INDEX_DEFINITIONS)
+    chunk = min(chunk_rows, height) * width * 4 * (n_bands + 1)
+    return outputs + chunk
+
+def decide_workers(paths):
+    """CPU コア数と空きメモリから並列処理のワーカー数を決める関数"""
+    workers = min(os.cpu_count() or 1, len(paths))
+    available = available_memory_bytes()
+    if available is not None and paths:
+        per_scene = max(scene_memory_bytes(p) for p in paths)
+        workers = min(workers, int(available * MEMORY_FRACTION // per_scene))
+    return max(1, workers)
+
+def scene_paths(input_folder=INPUT_FOLDER, slug=None):
+    """
+    反射バンドGeoTIFFのパス
+    slug を指定した場合はその都市のエクスポート L8_*_{slug}_Reflectance.tif と L8_*_{slug}_L2raw.tif のみ
+    """
+    if not slug:
+        return sorted(glob(os.path.join(input_folder, '*.tif')))
+    return sorted(glob(os.path.join(input_folder, f'L8_*_{slug}_Reflectance.tif')) +
+                  glob(os.path.join(input_folder, f'L8_*_{slug}{RAW_SUFFIX}')))
+
+def stats_fieldnames():
+    """統計CSVの列名を返す関数"""
+    return ['filename'] + [f'{name}_{stat}' for name in INDEX_DEFINITIONS for stat in STAT_COLUMNS]
+
+def run_parallel(paths, csv_output=CSV_OUTPUT, output_folder=OUTPUT_FOLDER, max_workers=None, city=None,
+                 quantize=False, compact=COMPACT_VALID_PIXELS, lst_folder=LST_FOLDER):
+    """
+    複数シーンをプロセスプールで並列に処理し、統計量を1つのCSVへ逐次書き込む関数
+    :param paths: 反射バンドGeoTIFFのパスのリスト
+    :param csv_output: 統計CSVの出力パス
+    :param output_folder: 指標GeoTIFFの出力フォルダ
+    :param max_workers: ワーカー数（None の場合は CPU コア数と空きメモリから自動決定）
+    :param city: 指定した場合はその都市の ROI ウィンドウだけを処理する
+    :param quantize: True の場合は指標を int16 の1ファイルに保存する
+    :param compact: True の場合は有効画素だけを詰めて計算する
+    :param lst_folder: raw DN のシーンから作る LST GeoTIFF の出力フォルダ
+    :return: 統計量の辞書のリスト（ファイル名順）
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    os.makedirs(os.path.dirname(csv_output), exist_ok=True)
+    if max_workers is None:
+        max_workers = decide_workers(paths)
+    print(f"{len(paths)}シーンを{max_workers}プロセスで処理します。")
+
+    records = []
+    with open(csv_output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=stats_fieldnames())
+        writer.writeheader()
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(process_scene, path, output_folder, city, quantize, compact, lst_folder): path
+                       for path in paths}
+            for future in as_completed(futures):
+                try:
+                    stats = future.result()
+                except Exception as e:
+                    print(f"{futures[future]}の処理でエラーが発生しました: {e}")
+                    continue
+                if stats is None:
+                    continue
+                writer.writerow(stats)
+                f.flush()
+                records.append(stats)
+
+    # 完了順に書き込んだCSVをファイル名順に並べ替える
+    records.sort(key=lambda r: r['filename'])
+    pd.DataFrame(records, columns=stats_fieldnames()).to_csv(csv_output, index=False)
+    return records
+
+def main():
+    ap = argparse.ArgumentParser(description="反射バンドGeoTIFFから NDVI/NDWI/NDBI を計算する")
+    ap.add_argument("--workers", type=int, default=None, help="ワーカー数（既定: CPU コア数と空きメモリから自動決定）")
+    ap.add_argument("--city", type=str, default=None,
+                    help="ROI で切り出す都市（regions.py の slug またはシェープファイルの TinhThanh, 例: 'Hà Nội'）")
+    ap.add_argument("--quantize", action="store_true",
+                    help="指標を int16 に量子化して1シーン1ファイル（_Indexes.tif）で保存する")
+    ap.add_argument("--no-compact", dest="compact", action="store_false",
+                    help="有効画素を詰めずに全画素で計算する（欠損・0 以下の反射率の画素も指標・統計量に含める）")
+    args = ap.parse_args()
+
+    if args.city:
+        region = get_region(args.city)
+        run_parallel(scene_paths(INPUT_FOLDER, region.slug), max_workers=args.workers, city=region.name,
+                     quantize=args.quantize, compact=args.compact)
+    else:
+        run_parallel(scene_paths(INPUT_FOLDER), max_workers=args.workers, quantize=args.quantize,
+                     compact=args.compact)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1106 @@
+"""
+Earth Engine API（ee）の一部をローカルの GeoTIFF で再現するオフラインバックエンド
+
+GEE スクリプト（GEE_Landsat8_LST.py, GEE_landsat8_BT.py, GEE.MOD11A2_LST.py,
+gee_landsat8_get_data.py, LST_time_series_analysis.py, OldGEE_Landsat8_LST.py）を
+書き換えずに、キャッシュ済みのシーンに対してローカルディスクの速度で実行・計測するためのもの。
+クォータを消費せずにオーケストレーション部分（エクスポートキューなど）の負荷試験もできる。
+
+- 使い方
+python workspace/src/ee_local.py --data workspace/data/ee_local --exports workspace/data/ee_exports \\
+    workspace/src/gee_landsat8_get_data.py
+  指定したスクリプトを __main__ として実行する。その間 import ee はこのモジュールを返す
+  （geemap が無い環境では空のモジュールで代用する）。
+
+- ローカルデータの配置
+<data>/<コレクションID>/*.tif   例: <data>/LANDSAT/LC08/C02/T1_L2/LC08_127045_20230707.tif
+・1ファイル = 1画像。バンド名は GeoTIFF のバンド説明（無ければ B1, B2, ...）
+・画像プロパティは GeoTIFF のメタデータタグと、同名の .json（あればこちらを優先）から読む
+・system:index が無ければファイル名、system:time_start が無ければファイル名中の YYYYMMDD から決める
+<data>/<コレクションID>.shp などのベクタは FeatureCollection として読む。
+FAO/GAUL/2015/level2 は研究対象都市の行政区画シェープファイルで代用する（ADM2_NAME → TinhThanh）。
+
+- 対応している API
+ImageCollection: filterDate / filterBounds / filter / map / select / size / toList / first / sort / limit
+                 aggregate_array / reduceColumns(toList) / mean / median / max / min
+Image: select / rename / multiply / add / subtract / divide / log / abs / bitwiseAnd / eq / neq / gt / gte / lt / lte
+       And / Or / updateMask / unmask / mask / addBands / clip / reproject / copyProperties / set / get / date
+       toDictionary / reduceRegion(count / mean / minMax / percentile / combine) / toUint16 / toInt16 / toFloat
+       Image.cat
+その他: Number / Date / List / Dictionary / String / Filter / Reducer / Geometry / FeatureCollection
+        Algorithms.If / batch.Export.image.toDrive（ローカルに GeoTIFF を書き出す） / data.getTaskStatus
+
+- GEE との違い
+・画素値の計算はアクセスされるまで遅延評価し、プロパティ・メタデータは即時評価する
+・reduceRegion の scale / maxPixels / bestEffort と reproject は無視し、画像のネイティブ解像度で計算する
+・エクスポートは start() の時点で同期的に書き出し、状態は COMPLETED / FAILED のどちらかになる
+・エクスポートした GeoTIFF には画像プロパティ（名前に ':' を含む system:* を除く）をタグとして書き込む
+"""
+
+import os
+import re
+import sys
+import json
+import glob
+import runpy
+import types
+import argparse
+import warnings
+import itertools
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import numpy as np
+import rasterio
+from rasterio.features import geometry_mask
+from rasterio.warp import transform_bounds, transform_geom
+
+from roi_window import ROI_SHP_PATH, compute_roi, grid_key
+from raster_io import open_cog
+
+DATA_ROOT = 'workspace/data/ee_local'
+EXPORT_ROOT = 'workspace/data/ee_exports'
+
+# ローカルで代用するベクタデータ: コレクションID -> (パス, 属性名の読み替え)
+LOCAL_VECTORS = {
+    'FAO/GAUL/2015/level2': (ROI_SHP_PATH, {'ADM2_NAME': 'TinhThanh', 'ADM1_NAME': 'TinhThanh'}),
+}
+
+WGS84 = 'EPSG:4326'
+
+
+def configure(data_root=None, export_root=None):
+    """ローカルデータ・エクスポート先のフォルダを設定する"""
+    global DATA_ROOT, EXPORT_ROOT
+    if data_root is not None:
+        DATA_ROOT = data_root
+    if export_root is not None:
+        EXPORT_ROOT = export_root
+
+
+def Initialize(*args, **kwargs):
+    """ローカルでは何もしない"""
+
+
+def Authenticate(*args, **kwargs):
+    """ローカルでは何もしない"""
+
+
+# --------------------
+# 値オブジェクト
+# --------------------
+def _unwrap(value):
+    """ComputedObject 相当のオブジェクトを Python の値に戻す"""
+    if isinstance(value, _Value):
+        return _unwrap(value._value)
+    if isinstance(value, (list, tuple)):
+        return [_unwrap(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _unwrap(v) for k, v in value.items()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _wrap(value):
+    """Python の値を対応する ComputedObject 相当のオブジェクトに包む"""
+    if isinstance(value, (_Value, Image, ImageCollection, Geometry, FeatureCollection)):
+        return value
+    if isinstance(value, dict):
+        return Dictionary(value)
+    if isinstance(value, (list, tuple)):
+        return List(value)
+    if isinstance(value, str):
+        return String(value)
+    return Number(value)
+
+
+def _info(value):
+    if isinstance(value, (Image, ImageCollection, Geometry, FeatureCollection)):
+        return value.getInfo()
+    if isinstance(value, _Value):
+        return _info(value._value)
+    if isinstance(value, (list, tuple)):
+        return [_info(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _info(v) for k, v in value.items()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class _Value:
+    def __init__(self, value):
+        self._value = _unwrap(value) if not isinstance(value, (Image, ImageCollection)) else value
+
+    def getInfo(self):
+        return _info(self._value)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._value!r})"
+
+
+class String(_Value):
+    pass
+
+
+class Number(_Value):
+    def _op(self, other, fn):
+        if isinstance(other, Image):
+            return Image(self)._binary(other, fn)
+        a, b = self._value, _unwrap(other)
+        if a is None or b is None:
+            return Number(None)
+        return Number(fn(np.float64(a), np.float64(b)).item())
+
+    def add(self, other):
+        return self._op(other, np.add)
+
+    def subtract(self, other):
+        return self._op(other, np.subtract)
+
+    def multiply(self, other):
+        return self._op(other, np.multiply)
+
+    def divide(self, other):
+        return self._op(other, _safe_divide)
+
+    def gt(self, other):
+        return self._op(other, lambda a, b: np.int64(a > b))
+
+    def lt(self, other):
+        return self._op(other, lambda a, b: np.int64(a < b))
+
+    def eq(self, other):
+        return self._op(other, lambda a, b: np.int64(a == b))
+
+    def abs(self):
+        return Number(None if self._value is None else abs(self._value))
+
+    def log(self):
+        return Number(None if self._value is None else float(np.log(self._value)))
+
+    def round(self):
+        return Number(None if self._value is None else round(self._value))
+
+
+class List(_Value):
+    def get(self, index):
+        return _wrap(self._value[_unwrap(index)])
+
+    def size(self):
+        return Number(len(self._value))
+
+    def length(self):
+        return self.size()
+
+
+class Dictionary(_Value):
+    def get(self, key, defaultValue=None):
+        value = self._value.get(_unwrap(key), defaultValue)
+        return _wrap(value)
+
+    def keys(self):
+        return List(list(self._value.keys()))
+
+
+def _to_millis(value):
+    value = _unwrap(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp() * 1000)
+    if isinstance(value, str):
+        fmt = '%Y-%m-%dT%H:%M:%S' if 'T' in value else '%Y-%m-%d'
+        return _to_millis(datetime.strptime(value, fmt))
+    return int(value)
+
+
+# Joda 形式 -> strftime 形式
+_JODA = [('YYYY', '%Y'), ('yyyy', '%Y'), ('MM', '%m'), ('dd', '%d'), ('HH', '%H'), ('mm', '%M'), ('ss', '%S')]
+_UNIT_MS = {'second': 1000, 'minute': 60000, 'hour': 3600000, 'day': 86400000, 'week': 604800000}
+
+
+class Date(_Value):
+    def __init__(self, value, tz=None):
+        super().__init__(_to_millis(value))
+
+    def millis(self):
+        return Number(self._value)
+
+    def format(self, fmt=None, timeZone=None):
+        dt = datetime.fromtimestamp(self._value / 1000, tz=timezone.utc)
+        if fmt is None:
+            return String(dt.strftime('%Y-%m-%dT%H:%M:%S'))
+        for joda, py in _JODA:
+            fmt = fmt.replace(joda, py)
+        return String(dt.strftime(fmt))
+
+    def difference(self, other, unit):
+        return Number((self._value - _to_millis(other)) / _UNIT_MS[unit.rstrip('s')])
+
+    def advance(self, delta, unit):
+        return Date(self._value + int(_unwrap(delta) * _UNIT_MS[unit.rstrip('s')]))
+
+
+class Algorithms:
+    @staticmethod
+    def If(condition, trueCase, falseCase):
+        return _wrap(trueCase if _unwrap(condition) else falseCase)
+
+
+# --------------------
+# ジオメトリ・ベクタ
+# --------------------
+class Geometry:
+    """GeoJSON ジオメトリ（EPSG:4326）"""
+
+    def __init__(self, geo_json, proj=None, geodesic=None):
+        if isinstance(geo_json, Geometry):
+            geo_json = geo_json.geo_json
+        self.geo_json = dict(geo_json)
+
+    @staticmethod
+    def Rectangle(coords, proj=None, geodesic=None):
+        coords = _unwrap(coords)
+        if len(coords) == 2:
+            (x1, y1), (x2, y2) = coords
+        else:
+            x1, y1, x2, y2 = coords
+        ring = [[x1, y1], [x2, y1], [x2, y2], [x1, y2], [x1, y1]]
+        return Geometry({'type': 'Polygon', 'coordinates': [ring]})
+
+    def bounds_wgs84(self):
+        xs, ys = [], []
+        for x, y in _iter_coords(self.geo_json['coordinates']):
+            xs.append(x)
+            ys.append(y)
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def geometry(self):
+        return self
+
+    def getInfo(self):
+        return self.geo_json
+
+
+def _iter_coords(coords):
+    if isinstance(coords[0], (int, float)):
+        yield coords[0], coords[1]
+        return
+    for c in coords:
+        yield from _iter_coords(c)
+
+
+def _as_geometry(geom):
+    if geom is None:
+        return None
+    if isinstance(geom, (FeatureCollection, Feature)):
+        return geom.geometry()
+    if isinstance(geom, Geometry):
+        return geom
+    return Geometry(_unwrap(geom))
+
+
+def _union(geometries):
+    polygons = []
+    for g in geometries:
+        gj = g.geo_json
+        if gj['type'] == 'Polygon':
+            polygons.append(gj['coordinates'])
+        elif gj['type'] == 'MultiPolygon':
+            polygons.extend(gj['coordinates'])
+    if len(polygons) == 1:
+        return Geometry({'type': 'Polygon', 'coordinates': polygons[0]})
+    return Geometry({'type': 'MultiPolygon', 'coordinates': polygons})
+
+
+class Feature:
+    def __init__(self, geometry, properties=None):
+        self._geometry = _as_geometry(geometry)
+        self.props = dict(properties or {})
+
+    def geometry(self):
+        return self._geometry
+
+    def get(self, prop):
+        return _wrap(self.props.get(prop))
+
+
+class FeatureCollection:
+    def __init__(self, source):
+        if isinstance(source, str):
+            self.features = _load_vector(source)
+        else:
+            self.features = list(source)
+
+    def filter(self, flt):
+        return FeatureCollection([f for f in self.features if flt(f.props)])
+
+    def filterBounds(self, geom):
+        return self
+
+    def geometry(self):
+        return _union([f.geometry() for f in self.features])
+
+    def first(self):
+        return self.features[0]
+
+    def size(self):
+        return Number(len(self.features))
+
+    def aggregate_array(self, prop):
+        return List([f.props.get(prop) for f in self.features])
+
+    def getInfo(self):
+        return {'type': 'FeatureCollection',
+                'features': [{'type': 'Feature', 'geometry': f.geometry().geo_json, 'properties': f.props}
+                             for f in self.features]}
+
+
+def _load_vector(collection_id):
+    import geopandas as gpd
+
+    if collection_id in LOCAL_VECTORS:
+        path, aliases = LOCAL_VECTORS[collection_id]
+    else:
+        path, aliases = os.path.join(DATA_ROOT, collection_id + '.shp'), {}
+    df = gpd.read_file(path).to_crs(WGS84)
+    features = []
+    for rec in df.to_dict('records'):
+        geom = rec.pop('geometry')
+        for alias, field in aliases.items():
+            rec.setdefault(alias, rec.get(field))
+        features.append(Feature(Geometry(geom.__geo_interface__), rec))
+    return features
+
+
+# --------------------
+# フィルタ・リデューサ
+# --------------------
+def _fold(value):
+    """文字列比較用にダイアクリティカルマークを除く（'Hà Nội' == 'Ha Noi'）"""
+    if not isinstance(value, str):
+        return value
+    value = value.replace('đ', 'd').replace('Đ', 'D')
+    return ''.join(c for c in unicodedata.normalize('NFD', value) if not unicodedata.combining(c))
+
+
+class Filter:
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def __call__(self, props):
+        return self.predicate(props)
+
+    @staticmethod
+    def _compare(name, value, op):
+        value = _fold(_unwrap(value))
+
+        def predicate(props):
+            v = _fold(props.get(name))
+            return v is not None and op(v, value)
+        return Filter(predicate)
+
+    @staticmethod
+    def eq(name, value):
+        return Filter._compare(name, value, lambda a, b: a == b)
+
+    @staticmethod
+    def neq(name, value):
+        return Filter._compare(name, value, lambda a, b: a != b)
+
+    @staticmethod
+    def lt(name, value):
+        return Filter._compare(name, value, lambda a, b: a < b)
+
+    @staticmethod
+    def lte(name, value):
+        return Filter._compare(name, value, lambda a, b: a <= b)
+
+    @staticmethod
+    def gt(name, value):
+        return Filter._compare(name, value, lambda a, b: a > b)
+
+    @staticmethod
+    def gte(name, value):
+        return Filter._compare(name, value, lambda a, b: a >= b)
+
+    @staticmethod
+    def And(*filters):
+        return Filter(lambda props: all(f(props) for f in filters))
+
+    @staticmethod
+    def Or(*filters):
+        return Filter(lambda props: any(f(props) for f in filters))
+
+    @staticmethod
+    def date(start, end=None):
+        start_ms = _to_millis(start)
+        end_ms = _to_millis(end) if end is not None else None
+        return Filter(lambda props: start_ms <= props.get('system:time_start', 0)
+                      and (end_ms is None or props.get('system:time_start', 0) < end_ms))
+
+
+def _empty_or(fn):
+    return lambda v: fn(v) if v.size else None
+
+
+class Reducer:
+    """出力名と1次元配列 -> 値 の関数の組のリスト"""
+
+    def __init__(self, outputs, list_columns=None):
+        self.outputs = outputs
+        self.list_columns = list_columns
+
+    @staticmethod
+    def count():
+        return Reducer([('count', lambda v: int(v.size))])
+
+    @staticmethod
+    def mean():
+        return Reducer([('mean', _empty_or(lambda v: float(v.mean())))])
+
+    @staticmethod
+    def sum():
+        return Reducer([('sum', lambda v: float(v.sum()))])
+
+    @staticmethod
+    def minMax():
+        return Reducer([('min', _empty_or(lambda v: float(v.min()))),
+                        ('max', _empty_or(lambda v: float(v.max())))])
+
+    @staticmethod
+    def stdDev():
+        return Reducer([('stdDev', _empty_or(lambda v: float(v.std())))])
+
+    @staticmethod
+    def percentile(percentiles, outputNames=None):
+        percentiles = _unwrap(percentiles)
+        names = outputNames or [f'p{p:g}' for p in percentiles]
+        return Reducer([(name, _empty_or(lambda v, p=p: float(np.percentile(v, p))))
+                        for name, p in zip(names, percentiles)])
+
+    @staticmethod
+    def toList(numLists=None):
+        return Reducer([('list', None)], list_columns=numLists or 1)
+
+    def combine(self, reducer2, outputPrefix='', sharedInputs=False):
+        return Reducer(self.outputs + [(outputPrefix + name, fn) for name, fn in reducer2.outputs])
+
+    def reduce_band(self, band, values):
+        """1バンド分の値を集計し、reduceRegion の出力キー -> 値 の辞書を返す"""
+        if len(self.outputs) == 1:
+            return {band: self.outputs[0][1](values)}
+        return {f'{band}_{name}': fn(values) for name, fn in self.outputs}
+
+
+# --------------------
+# 画像
+# --------------------
+def _safe_divide(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.true_divide(a, b)
+
+
+def _as_int(a):
+    return a if np.issubdtype(np.asarray(a).dtype, np.integer) else np.asarray(a).astype(np.int64)
+
+
+class Grid:
+    """画像のラスタグリッド（CRS・変換行列・サイズ）"""
+
+    def __init__(self, crs, transform, width, height):
+        self.crs = crs
+        self.transform = transform
+        self.width = width
+        self.height = height
+
+    def key(self):
+        return grid_key(self.crs, self.transform, self.width, self.height)
+
+    def bounds_wgs84(self):
+        left, top = self.transform * (0, 0)
+        right, bottom = self.transform * (self.width, self.height)
+        return transform_bounds(self.crs, WGS84, min(left, right), min(top, bottom),
+                                max(left, right), max(top, bottom))
+
+
+_INSIDE_CACHE = {}
+
+
+def _inside(geometry, grid):
+    """ジオメトリ内の画素を True とする真偽配列（グリッド・ジオメトリごとにキャッシュ）"""
+    key = (grid.key(), json.dumps(geometry.geo_json, sort_keys=True, default=str))
+    if key not in _INSIDE_CACHE:
+        geom = transform_geom(WGS84, grid.crs, geometry.geo_json)
+        _INSIDE_CACHE[key] = geometry_mask([geom], out_shape=(grid.height, grid.width),
+                                           transform=grid.transform, invert=True, all_touched=True)
+    return _INSIDE_CACHE[key]
+
+
+class Image:
+    """
+    画像: バンド名・プロパティ・グリッドは即時に保持し、
+    画素（バンド名 -> (値, 有効画素の真偽配列)）は最初にアクセスされたときに計算する
+    """
+
+    def __init__(self, source=None, *, band_names=None, thunk=None, props=None, grid=None):
+        if isinstance(source, (String, List, Dictionary)):
+            source = source._value
+        if isinstance(source, Number):
+            source = source._value
+        if isinstance(source, Image):
+            band_names, thunk, props, grid = source.band_names, source._thunk, source.props, source.grid
+        elif isinstance(source, (int, float)):
+            value = float(source)
+            band_names = ['constant']
+            thunk = lambda: OrderedDict(constant=(np.asarray(value), np.asarray(True)))
+        elif isinstance(source, str):
+            raise ValueError(f"ローカルバックエンドでは画像アセットIDを直接読めません: {source}")
+        self.band_names = list(band_names or [])
+        self._thunk = thunk or (lambda: OrderedDict())
+        self._cache = None
+        self.props = dict(props or {})
+        self.grid = grid
+
+    def _derive(self, band_names, thunk, grid=None, props=None):
+        return Image(band_names=band_names, thunk=thunk,
+                     props=self.props if props is None else props,
+                     grid=grid if grid is not None else self.grid)
+
+    def _bands(self):
+        if self._cache is None:
+            self._cache = self._thunk()
+        return self._cache
+
+    # --- バンド操作 ---
+    def select(self, *args):
+        if len(args) == 2 and all(isinstance(a, (list, tuple)) for a in args):
+            selectors, new_names = args
+        elif len(args) == 1 and isinstance(args[0], (list, tuple)):
+            selectors, new_names = args[0], None
+        else:
+            selectors, new_names = args, None
+        names = []
+        for pattern in _unwrap(selectors):
+            if isinstance(pattern, int):
+                names.append(self.band_names[pattern])
+                continue
+            matched = [b for b in self.band_names if re.fullmatch(pattern, b)]
+            if not matched:
+                raise ValueError(f"バンドがありません: {pattern}（{self.band_names}）")
+            names.extend(b for b in matched if b not in names)
+        out_names = list(new_names) if new_names else names
+
+        def thunk():
+            bands = self._bands()
+            return OrderedDict((new, bands[old]) for old, new in zip(names, out_names))
+        return self._derive(out_names, thunk)
+
+    def rename(self, *names):
+        names = list(names[0]) if len(names) == 1 and isinstance(names[0], (list, tuple)) else list(names)
+
+        def thunk():
+            return OrderedDict(zip(names, self._bands().values()))
+        return self._derive(names, thunk)
+
+    def addBands(self, srcImg, names=None, overwrite=False):
+        src = srcImg.select(names) if names else srcImg
+        out_names = list(self.band_names)
+        mapping = []
+        for name in src.band_names:
+            new = name
+            if name in out_names and not overwrite:
+                new = f'{name}_1'
+            if new not in out_names:
+                out_names.append(new)
+            mapping.append((name, new))
+
+        def thunk():
+            bands = OrderedDict(self._bands())
+            src_bands = src._bands()
+            for name, new in mapping:
+                bands[new] = src_bands[name]
+            return OrderedDict((n, bands[n]) for n in out_names)
+        return self._derive(out_names, thunk, grid=self.grid or src.grid)
+
+    @staticmethod
+    def cat(*images):
+        images = list(images[0]) if len(images) == 1 and isinstance(images[0], (list, tuple)) else list(images)
+        out = Image(images[0])
+        for im in images[1:]:
+            out = out.addBands(Image(im))
+        return out
+
+    # --- 画素演算 ---
+    def _binary(self, other, fn):
+        return self._combine(other, lambda a, b: (fn(a[0], b[0]), np.logical_and(a[1], b[1])))
+
+    def _combine(self, other, fn):
+        """バンドを位置で対応させて (値, 有効) の組どうしを結合する（1バンド側は全バンドに適用）"""
+        other = other if isinstance(other, Image) else Image(_unwrap(other))
+        left, right = self.band_names, other.band_names
+        if len(left) != len(right) and 1 not in (len(left), len(right)):
+            raise ValueError(f"バンド数が一致しません: {left} と {right}")
+        n = max(len(left), len(right))
+        out_names = left if len(left) == n else right
+        pairs = [(left[min(i, len(left) - 1)], right[min(i, len(right) - 1)]) for i in range(n)]
+
+        def thunk():
+            a_bands, b_bands = self._bands(), other._bands()
+            out = OrderedDict()
+            for name, (a, b) in zip(out_names, pairs):
+                out[name] = fn(a_bands[a], b_bands[b])
+            return out
+        return self._derive(out_names, thunk, grid=self.grid or other.grid)
+
+    def _unary(self, fn):
+        def thunk():
+            return OrderedDict((n, (fn(v), m)) for n, (v, m) in self._bands().items())
+        return self._derive(self.band_names, thunk)
+
+    def add(self, other):
+        return self._binary(other, np.add)
+
+    def subtract(self, other):
+        return self._binary(other, np.subtract)
+
+    def multiply(self, other):
+        return self._binary(other, np.multiply)
+
+    def divide(self, other):
+        return self._binary(other, _safe_divide)
+
+    def bitwiseAnd(self, other):
+        return self._binary(other, lambda a, b: np.bitwise_and(_as_int(a), _as_int(b)))
+
+    def eq(self, other):
+        return self._binary(other, lambda a, b: (a == b).astype(np.uint8))
+
+    def neq(self, other):
+        return self._binary(other, lambda a, b: (a != b).astype(np.uint8))
+
+    def gt(self, other):
+        return self._binary(other, lambda a, b: (a > b).astype(np.uint8))
+
+    def gte(self, other):
+        return self._binary(other, lambda a, b: (a >= b).astype(np.uint8))
+
+    def lt(self, other):
+        return self._binary(other, lambda a, b: (a < b).astype(np.uint8))
+
+    def lte(self, other):
+        return self._binary(other, lambda a, b: (a <= b).astype(np.uint8))
+
+    def And(self, other):
+        return self._binary(other, lambda a, b: np.logical_and(a != 0, b != 0).astype(np.uint8))
+
+    def Or(self, other):
+        return self._binary(other, lambda a, b: np.logical_or(a != 0, b != 0).astype(np.uint8))
+
+    def log(self):
+        def log(v):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.log(v)
+        return self._unary(log)
+
+    def abs(self):
+        return self._unary(np.abs)
+
+    def toFloat(self):
+        return self._unary(lambda v: np.asarray(v).astype(np.float32))
+
+    def toDouble(self):
+        return self._unary(lambda v: np.asarray(v).astype(np.float64))
+
+    def toUint16(self):
+        return self._unary(lambda v: np.clip(np.asarray(v), 0, 65535).astype(np.uint16))
+
+    def toInt16(self):
+        return self._unary(lambda v: np.clip(np.asarray(v), -32768, 32767).astype(np.int16))
+
+    # --- マスク ---
+    def updateMask(self, mask):
+        return self._combine(mask, lambda a, b: (a[0], a[1] & np.logical_and(b[1], b[0] != 0)))
+
+    def unmask(self, value=0, sameFootprint=True):
+        value = _unwrap(value)
+
+        def thunk():
+            out = OrderedDict()
+            for n, (v, m) in self._bands().items():
+                out[n] = (np.where(m, v, value), np.ones_like(m, dtype=bool))
+            return out
+        return self._derive(self.band_names, thunk)
+
+    def mask(self):
+        def thunk():
+            return OrderedDict((n, (np.asarray(m).astype(np.uint8), np.ones_like(m, dtype=bool)))
+                               for n, (v, m) in self._bands().items())
+        return self._derive(self.band_names, thunk)
+
+    def clip(self, geometry):
+        geometry = _as_geometry(geometry)
+        grid = self.grid
+
+        def thunk():
+            inside = _inside(geometry, grid)
+            return OrderedDict((n, (v, np.logical_and(m, inside))) for n, (v, m) in self._bands().items())
+        return self._derive(self.band_names, thunk)
+
+    def clipToCollection(self, collection):
+        return self.clip(collection)
+
+    def reproject(self, crs=None, crsTransform=None, scale=None):
+        # ローカルではネイティブのグリッドのまま扱う
+        return self
+
+    # --- プロパティ ---
+    def set(self, *args):
+        props = dict(self.props)
+        if len(args) == 1:
+            props.update(_unwrap(args[0]))
+        else:
+            for k, v in zip(args[::2], args[1::2]):
+                props[k] = _unwrap(v)
+        return self._derive(self.band_names, self._bands, props=props)
+
+    def get(self, prop):
+        return _wrap(self.props.get(_unwrap(prop)))
+
+    def date(self):
+        return Date(self.props['system:time_start'])
+
+    def copyProperties(self, source=None, properties=None, exclude=None):
+        props = dict(self.props)
+        src = dict(source.props) if source is not None else {}
+        if properties is not None:
+            src = {k: src[k] for k in properties if k in src}
+        for k in exclude or []:
+            src.pop(k, None)
+        props.update(src)
+        return self._derive(self.band_names, self._bands, props=props)
+
+    def toDictionary(self, properties=None):
+        if properties is None:
+            return Dictionary(dict(self.props))
+        return Dictionary({k: self.props[k] for k in properties if k in self.props})
+
+    def bandNames(self):
+        return List(list(self.band_names))
+
+    # --- 集計 ---
+    def reduceRegion(self, reducer, geometry=None, scale=None, crs=None, crsTransform=None,
+                     bestEffort=False, maxPixels=None, tileScale=None):
+        geometry = _as_geometry(geometry)
+        inside = _inside(geometry, self.grid) if geometry is not None and self.grid is not None else None
+        result = {}
+        for name, (v, m) in self._bands().items():
+            valid = np.broadcast_to(m, np.shape(v)) if np.ndim(v) else np.asarray(m)
+            if inside is not None:
+                valid = np.logical_and(valid, inside)
+            values = np.asarray(v)[valid].astype(np.float64) if np.ndim(v) else np.asarray([float(v)])
+            result.update(reducer.reduce_band(name, values))
+        return Dictionary(result)
+
+    def getInfo(self):
+        return {'type': 'Image', 'bands': [{'id': b} for b in self.band_names], 'properties': self.props}
+
+
+def _parse_tag(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            pass
+    return value
+
+
+def _scene_image(path):
+    """GeoTIFF 1ファイルを画像として読み込む（画素は遅延読み込み）"""
+    with rasterio.open(path) as src:
+        names = [d or f'B{i + 1}' for i, d in enumerate(src.descriptions)]
+        grid = Grid(src.crs, src.transform, src.width, src.height)
+        nodata = src.nodata
+        props = {k: _parse_tag(v) for k, v in src.tags().items()}
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    sidecar = os.path.splitext(path)[0] + '.json'
+    if os.path.exists(sidecar):
+        with open(sidecar, 'r') as f:
+            props.update(json.load(f))
+    props.setdefault('system:index', stem)
+    if 'system:time_start' not in props:
+        m = re.search(r'(\d{8})', stem)
+        props['system:time_start'] = _to_millis(datetime.strptime(m.group(1), '%Y%m%d')) if m else 0
+
+    def thunk():
+        with rasterio.open(path) as src:
+            data = src.read()
+        bands = OrderedDict()
+        for name, band in zip(names, data):
+            valid = np.ones(band.shape, dtype=bool)
+            if nodata is not None:
+                valid &= ~np.isnan(band) if np.isnan(nodata) else band != nodata
+            if band.dtype.kind == 'f':
+                valid &= ~np.isnan(band)
+            bands[name] = (band, valid)
+        return bands
+    return Image(band_names=names, thunk=thunk, props=props, grid=grid)
+
+
+# --------------------
+# 画像コレクション
+# --------------------
+class ImageCollection:
+    def __init__(self, source):
+        if isinstance(source, ImageCollection):
+            self.images = list(source.images)
+        elif isinstance(source, str):
+            folder = os.path.join(DATA_ROOT, source)
+            paths = sorted(glob.glob(os.path.join(folder, '*.tif')))
+            if not paths:
+                print(f"[ee_local] ローカルデータがありません: {folder}")
+            self.images = [_scene_image(p) for p in paths]
+        else:
+            self.images = [Image(im) for im in _unwrap(source)]
+
+    def _with(self, images):
+        return ImageCollection(images)
+
+    def filter(self, flt):
+        return self._with([im for im in self.images if flt(im.props)])
+
+    def filterDate(self, start, end=None):
+        return self.filter(Filter.date(start, end))
+
+    def filterBounds(self, geometry):
+        x0, y0, x1, y1 = _as_geometry(geometry).bounds_wgs84()
+        out = []
+        for im in self.images:
+            if im.grid is None:
+                out.append(im)
+                continue
+            left, bottom, right, top = im.grid.bounds_wgs84()
+            if left <= x1 and right >= x0 and bottom <= y1 and top >= y0:
+                out.append(im)
+        return self._with(out)
+
+    def map(self, fn):
+        return self._with([fn(im) for im in self.images])
+
+    def select(self, *args):
+        return self.map(lambda im: im.select(*args))
+
+    def sort(self, prop, ascending=True):
+        return self._with(sorted(self.images, key=lambda im: im.props.get(prop), reverse=not ascending))
+
+    def limit(self, n, prop=None, ascending=True):
+        images = self.sort(prop, ascending).images if prop else self.images
+        return self._with(images[:n])
+
+    def first(self):
+        return self.images[0] if self.images else None
+
+    def size(self):
+        return Number(len(self.images))
+
+    def toList(self, count, offset=0):
+        count = _unwrap(count)
+        return List(self.images[offset:offset + count])
+
+    def aggregate_array(self, prop):
+        return List([im.props[prop] for im in self.images if prop in im.props])
+
+    def reduceColumns(self, reducer, selectors, weightSelectors=None):
+        rows = []
+        for im in self.images:
+            row = [im.props.get(s) for s in selectors]
+            if all(v is not None for v in row):
+                rows.append(row if len(selectors) > 1 else row[0])
+        return Dictionary({'list': rows})
+
+    def _composite(self, fn):
+        if not self.images:
+            raise ValueError("空のコレクションは合成できません")
+        first = self.images[0]
+        names = first.band_names
+
+        def thunk():
+            out = OrderedDict()
+            for name in names:
+                stack = []
+                for im in self.images:
+                    v, m = im._bands()[name]
+                    stack.append(np.where(m, np.asarray(v, dtype=np.float64), np.nan))
+                stack = np.stack(stack)
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    value = fn(stack)
+                out[name] = (value, ~np.isnan(value))
+            return out
+        return Image(band_names=names, thunk=thunk, props={}, grid=first.grid)
+
+    def mean(self):
+        return self._composite(lambda s: np.nanmean(s, axis=0))
+
+    def median(self):
+        return self._composite(lambda s: np.nanmedian(s, axis=0))
+
+    def max(self):
+        return self._composite(lambda s: np.nanmax(s, axis=0))
+
+    def min(self):
+        return self._composite(lambda s: np.nanmin(s, axis=0))
+
+    def getInfo(self):
+        return {'type': 'ImageCollection', 'features': [im.getInfo() for im in self.images]}
+
+
+# --------------------
+# エクスポート・タスク
+# --------------------
+_TASK_IDS = itertools.count(1)
+_TASKS = {}
+
+
+class _Task:
+    def __init__(self, image, config):
+        self.image = image
+        self.config = config
+        self.id = None
+        self.state = 'UNSUBMITTED'
+        self.error = None
+
+    def start(self):
+        self.id = f'LOCAL_{next(_TASK_IDS):06d}'
+        _TASKS[self.id] = self
+        try:
+            _write_image(self.image, self.config)
+            self.state = 'COMPLETED'
+        except Exception as e:
+            self.state = 'FAILED'
+            self.error = str(e)
+
+    def status(self):
+        status = {'id': self.id, 'state': self.state, 'description': self.config.get('description')}
+        if self.error:
+            status['error_message'] = self.error
+        return status
+
+    def active(self):
+        return False
+
+
+def _write_image(image, config):
+    """画像を GeoTIFF として <EXPORT_ROOT>/<folder>/<fileNamePrefix>.tif に書き出す"""
+    region = _as_geometry(config.get('region'))
+    grid = image.grid
+    if grid is None:
+        raise ValueError("グリッドを持たない画像はエクスポートできません")
+    bands = image._bands()
+
+    window = None
+    inside = None
+    if region is not None:
+        roi = compute_roi(region.geo_json, WGS84, grid.crs, grid.transform, grid.width, grid.height)
+        window, inside, transform = roi.window, roi.mask, roi.transform
+    else:
+        transform = grid.transform
+
+    arrays = []
+    for name, (v, m) in bands.items():
+        v = np.broadcast_to(v, (grid.height, grid.width))
+        m = np.broadcast_to(m, (grid.height, grid.width))
+        if window is not None:
+            rows, cols = window.toslices()
+            v, m = v[rows, cols], m[rows, cols] & inside
+        arrays.append((v, m))
+
+    dtype = np.result_type(*[v.dtype for v, _ in arrays])
+    if dtype.kind == 'f':
+        nodata = np.nan
+    else:
+        nodata = np.iinfo(dtype).max if dtype.kind == 'u' else np.iinfo(dtype).min
+
+    height, width = arrays[0][0].shape
+    folder = os.path.join(EXPORT_ROOT, config.get('folder') or '')
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{config.get('fileNamePrefix') or config.get('description')}.tif")
+    profile = dict(driver='GTiff', width=width, height=height, count=len(arrays), dtype=dtype.name,
+                   crs=grid.crs, transform=transform, nodata=nodata, tiled=True, compress='deflate')
+    cloud_optimized = (config.get('formatOptions') or {}).get('cloudOptimized', False)
+    with (open_cog(path, profile) if cloud_optimized else rasterio.open(path, 'w', **profile)) as dst:
+        for i, ((v, m), name) in enumerate(zip(arrays, bands.keys()), start=1):
+            dst.write(np.where(m, v, nodata).astype(dtype), i)
+            dst.set_band_description(i, name)
+        # GDAL は ':' も名前と値の区切りとして扱うため、system:index などのプロパティはタグにしない
+        dst.update_tags(**{k: v for k, v in image.props.items()
+                           if isinstance(v, (int, float, str)) and ':' not in k})
+    return path
+
+
+class batch:
+    Task = _Task
+
+    class Export:
+        class image:
+            @staticmethod
+            def toDrive(image, description='myExportImageTask', folder=None, fileNamePrefix=None,
+                        **kwargs):
+                config = dict(kwargs, description=description, folder=folder, fileNamePrefix=fileNamePrefix)
+                return _Task(image, config)
+
+            toCloudStorage = toDrive
+
+            @staticmethod
+            def toAsset(image, description='myExportImageTask', assetId=None, **kwargs):
+                config = dict(kwargs, description=description, fileNamePrefix=assetId)
+                return _Task(image, config)
+
+
+class data:
+    @staticmethod
+    def getTaskStatus(task_ids):
+        if isinstance(task_ids, str):
+            task_ids = [task_ids]
+        return [_TASKS[t].status() if t in _TASKS else {'id': t, 'state': 'UNKNOWN'} for t in task_ids]
+
+
+# --------------------
+# 実行
+# --------------------
+def install(data_root=None, export_root=None):
+    """
+    このモジュールを ee として登録する（以降の import ee はこのモジュールを返す）
+    geemap が無い環境では空のモジュールを登録する
+    """
+    configure(data_root, export_root)
+    module = sys.modules[__name__]
+    sys.modules['ee'] = module
+    try:
+        import geemap  # noqa: F401
+    except Exception:
+        sys.modules['geemap'] = types.ModuleType('geemap')
+    return module
+
+
+def main():
+    ap = argparse.ArgumentParser(description="GEE スクリプトをローカルの GeoTIFF に対して実行する")
+    ap.add_argument("--data", type=str, default=DATA_ROOT, help="ローカルデータのフォルダ")
+    ap.add_argument("--exports", type=str, default=EXPORT_ROOT, help="エクスポート先のフォルダ")
+    ap.add_argument("script", type=str, help="実行する GEE スクリプト")
+    ap.add_argument("args", nargs=argparse.REMAINDER, help="スクリプトに渡す引数")
+    args = ap.parse_args()
+
+    install(args.data, args.exports)
+    sys.argv = [args.script] + args.args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    runpy.run_path(args.script, run_name='__main__')
+
+
+if __name__ == "__main__":
+    import ee_local
+    ee_local.main()
@@ -0,0 +1,177 @@
+"""
+Earth Engine のエクスポートタスクを管理するキュー
+
+・同時に実行するタスク数を max_running 以下に抑えて順に開始する
+・実行中タスクの状態は ee.data.getTaskStatus でまとめて1回の通信で取得し、
+  状態が変わらない間はポーリング間隔を倍々に延ばす（上限 max_poll_interval 秒）
+・FAILED のタスクは max_retries 回まで作り直して再投入する。開始時のエラー（認証・割り当て超過など）は
+  ポーリングと同じく待ち時間を倍々に延ばしてから（上限 max_poll_interval 秒）再投入する
+・CANCELLED / CANCEL_REQUESTED（ユーザーが意図して取り消したタスク）は再投入しない
+・各タスクの状態を JSON のジャーナルに保存し、中断後の再実行では
+  完了済み・取り消し済みのタスクは再投入せず、実行中だったタスクは task_id で状態確認を再開する
+  （取り消したタスクをやり直す場合はジャーナルからその項目を削除する）
+
+- 使用例
+queue = ExportQueue('workspace/data/cache/export_journal_2023.json')
+queue.submit('L8_20230707_032305_Hanoi_LST', lambda: ee.batch.Export.image.toDrive(...))
+queue.run()
+"""
+
+import os
+import json
+import time
+
+import ee
+
+DONE_STATES = ('COMPLETED', 'SUCCEEDED')
+FAILED_STATES = ('FAILED',)
+CANCELLED_STATES = ('CANCELLED', 'CANCEL_REQUESTED')
+
+
+class ExportQueue:
+    """
+    エクスポートタスクの同時実行数制御・ポーリング・再試行・ジャーナル保存を行うクラス
+    :param journal_path: ジャーナル（JSON）のパス。None の場合は保存しない
+    :param max_running: 同時に実行するタスク数の上限
+    :param max_retries: 失敗したタスクを再投入する回数
+    :param poll_interval: ポーリング間隔の初期値（秒）
+    :param max_poll_interval: ポーリング間隔の上限（秒）
+    """
+
+    def __init__(self, journal_path=None, max_running=3, max_retries=2,
+                 poll_interval=10, max_poll_interval=120):
+        self.journal_path = journal_path
+        self.max_running = max_running
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.factories = {}
+        self.pending = []
+        self.journal = {}
+        if journal_path and os.path.exists(journal_path):
+            with open(journal_path, 'r') as f:
+                self.journal = json.load(f)
+
+    def submit(self, description, task_factory):
+        """
+        タスクを登録する（開始は run() で行う）
+        :param description: タスク名（ジャーナルのキー）
+        :param task_factory: 未開始の ee.batch.Task を返す関数（再試行のたびに呼び出す）
+        :return: 登録した場合は True、ジャーナル上で完了済み・取り消し済みの場合は False
+        """
+        entry = self.journal.get(description)
+        if entry is not None and entry['state'] in DONE_STATES:
+            print(f"[Export] 完了済みのためスキップ: {description}")
+            return False
+        if entry is not None and entry['state'] in CANCELLED_STATES:
+            print(f"[Export] 取り消し済みのためスキップ: {description}")
+            return False
+        self.factories[description] = task_factory
+        if entry is None or entry.get('task_id') is None or entry['state'] in FAILED_STATES:
+            self.journal[description] = {'state': 'QUEUED', 'task_id': None, 'attempts': 0, 'error': None}
+            self.pending.append(description)
+        # それ以外（前回の実行中タスク）は task_id で状態確認を再開する
+        self._save()
+        return True
+
+    def _save(self):
+        if not self.journal_path:
+            return
+        os.makedirs(os.path.dirname(self.journal_path) or '.', exist_ok=True)
+        tmp = self.journal_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.journal, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.journal_path)
+
+    def _running(self):
+        return [d for d in self.factories
+                if self.journal[d]['task_id'] is not None
+                and self.journal[d]['state'] not in DONE_STATES + FAILED_STATES + CANCELLED_STATES]
+
+    def _ready(self):
+        """開始できる（再試行の待ち時間を過ぎた）待機中のタスク"""
+        now = time.time()
+        return [d for d in self.pending if self.journal[d].get('retry_at', 0) <= now]
+
+    def _start(self, description):
+        entry = self.journal[description]
+        entry['attempts'] += 1
+        try:
+            task = self.factories[description]()
+            task.start()
+        except Exception as e:
+            entry.update(state='FAILED', task_id=None, error=str(e))
+            print(f"[Export] 開始エラー: {description}: {e}")
+            # ポーリングと同じく待ち時間を倍々に延ばす（すぐに再試行して上限回数を使い切らない）
+            self._retry_or_give_up(description,
+                                   min(self.poll_interval * 2 ** (entry['attempts'] - 1), self.max_poll_interval))
+            return
+        entry.update(state='READY', task_id=task.id, error=None, retry_at=0)
+        print(f"[Export] 開始: {description} ({task.id})")
+
+    def _retry_or_give_up(self, description, delay=0):
+        """:param delay: 再投入までの待ち時間（秒）"""
+        entry = self.journal[description]
+        if entry['attempts'] <= self.max_retries:
+            entry['state'] = 'QUEUED'
+            entry['task_id'] = None
+            entry['retry_at'] = time.time() + delay
+            self.pending.append(description)
+        else:
+            print(f"[Export] 失敗（再試行上限）: {description}: {entry['error']}")
+
+    def _poll(self, running):
+        """実行中タスクの状態をまとめて取得し、変化があれば True を返す"""
+        statuses = ee.data.getTaskStatus([self.journal[d]['task_id'] for d in running])
+        changed = False
+        for description, status in zip(running, statuses):
+            entry = self.journal[description]
+            state = status.get('state', entry['state'])
+            if state == entry['state']:
+                continue
+            changed = True
+            entry['state'] = state
+            if state in DONE_STATES:
+                print(f"[Export] 完了: {description}")
+            elif state in FAILED_STATES:
+                entry['error'] = status.get('error_message')
+                print(f"[Export] 失敗: {description}: {entry['error']}")
+                self._retry_or_give_up(description)
+            elif state in CANCELLED_STATES:
+                print(f"[Export] 取り消されました（再投入しません）: {description}")
+        return changed
+
+    def run(self):
+        """
+        全タスクが完了または失敗するまで開始・ポーリングを繰り返す
+        :return: タスク名 -> ジャーナルの項目 の辞書（今回登録したタスクのみ）
+        """
+        interval = self.poll_interval
+        while True:
+            running = self._running()
+            for description in self._ready():
+                if len(running) >= self.max_running:
+                    break
+                self.pending.remove(description)
+                self._start(description)
+                running = self._running()
+            self._save()
+            if not running and not self.pending:
+                break
+
+            if not running:
+                # 開始エラーの再試行待ちのタスクだけが残っている
+                time.sleep(max(0.0, min(self.journal[d].get('retry_at', 0) for d in self.pending) - time.time()))
+                continue
+            time.sleep(interval)
+            if self._poll(running):
+                interval = self.poll_interval
+            else:
+                interval = min(interval * 2, self.max_poll_interval)
+            self._save()
+
+        return {d: self.journal[d] for d in self.factories}
+
+    def failed(self):
+        """完了しなかったタスク名のリスト"""
+        return [d for d in self.factories if self.journal[d]['state'] not in DONE_STATES]
@@ -13,6 +13,36 @@ LST（地表面温度）および
 有効ピクセル率はST_B10を使用して計算している
 有効ピクセルの割合はバンドにより異なる可能性がある
 例： SR_B4（赤色）は、ST_B10より雲の影響を受けやすい
+
+メタデータの取得方法（CONFIG['BATCH_METADATA']）
+- True : 有効ピクセル数の計算をコレクション全体にサーバー側で map し（count を1回の reduceRegion で2バンド分）、
+         全画像の日付・時刻・全体ピクセル数・有効ピクセル率を1回の getInfo でまとめて取得してから
+         エクスポート対象を決める（1年あたりの往復は 約6×画像数 → 1回）
+         結果は scene_catalog.SceneCatalog（SQLite）にシーンID単位で追記・更新し、
+         次回以降はカタログ内の最新観測時刻（high-water mark）より新しいシーンだけを問い合わせる
+         （問い合わせで確認した最新の観測時刻はシーンが0件の都市のカタログにも記録するため、
+         画像のない都市があっても全期間を問い合わせ直さない）
+         （カタログにあってエクスポートが完了していないシーン（中断・失敗）は問い合わせの前に再投入する）
+- False: 従来通り画像ごとに getInfo を呼び、image_metadata_{YEAR}.csv を作り直す
+
+エクスポートは gee_export_queue.ExportQueue に登録し、同時実行数 CONFIG['MAX_RUNNING_EXPORTS'] で
+状態をポーリングしながら実行する。状態は CONFIG['EXPORT_JOURNAL'] に保存され、
+中断した年を再実行しても完了済みのエクスポートは再投入しない。
+
+対象都市は CONFIG['REGIONS']（regions.REGIONS の slug, 既定はハノイのみ）で指定する。
+複数都市の場合もコレクションの問い合わせは全都市の ROI の和集合に対して1回だけ行い、
+都市ごとの有効ピクセル率も同じ1回の getInfo で取得する。エクスポートは1つのキューを共有し、
+名前は L8_{time}_{slug}_LST / L8_{time}_{slug}_Reflectance、カタログは都市ごと（Region.catalog_path, ハノイは従来のカタログ）。
+
+エクスポートの形式（CONFIG['EXPORT_MODE']）
+- 'scaled': 従来通りサーバー側でスケール変換（apply_scale_factors）した float の LST / 反射バンドを別々にエクスポートする
+- 'raw'   : スケール変換せず、元の uint16 の SR_B1〜SR_B7, ST_B10, QA_PIXEL を1シーン1ファイル
+            （L8_{time}_{slug}_L2raw, CONFIG['EXPORT_FOLDER_RAW']）でエクスポートする（エクスポート・ダウンロード量は 1/2〜1/4）
+            クラウドマスクもかけず、スケール係数（SR_SCALE / SR_OFFSET / ST_SCALE / ST_OFFSET）はエクスポート名ごとに
+            scene_catalog.SCALE_FACTORS_PATH に記録する（Drive へのエクスポートでは画像プロパティが GeoTIFF のタグに残らない）。
+            ローカルでは landsat_qa.Level2Scene がブロックごとにスケール変換・クラウドマスクして読む
+            （calc_ref_bands.py はそのまま入力にできる。LST の GeoTIFF は landsat_qa.py --bands ST_B10 で作る）
+            有効ピクセル率はどちらの形式でもサーバー側のクラウドマスク後の ST_B10 で計算する。
 """
 
 import ee
@@ -21,6 +51,11 @@ import pandas as pd
 import geopandas as gpd
 import os
 
+from gee_export_queue import ExportQueue, DONE_STATES
+from scene_catalog import SceneCatalog, CATALOG_PATH, record_scale_factors
+from regions import get_region, select_regions, DEFAULT_REGION
+from instrumentation import stage, instrumented, instrument_ee
+
 # --------------------------------------
 # 設定値（定数管理）
 # --------------------------------------
@@ -32,33 +67,62 @@ CONFIG = {
     'EXPORT_SCALE': 30,
     'EXPORT_FOLDER_LST': 'Landsat8_LST',
     'EXPORT_FOLDER_REF': 'Landsat8_反射バンド',
+    'EXPORT_FOLDER_RAW': 'Landsat8_L2raw',
+    'EXPORT_MODE': 'scaled',  # 'scaled' または 'raw'
+    'RAW_BANDS': ['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7', 'ST_B10', 'QA_PIXEL'],
     'ROI_SHP_PATH': 'workspace/data/SHP/研究対象領域/研究対象都市_行政区画.shp',
-    'REFLECTANCE_BANDS': ['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7']
+    'REFLECTANCE_BANDS': ['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7'],
+    'BATCH_METADATA': True,
+    'MAX_RUNNING_EXPORTS': 3,
+    'EXPORT_RETRIES': 2,
+    'CATALOG_PATH': CATALOG_PATH,
+    'REGIONS': [DEFAULT_REGION],
 }
 
 START_DATE = f"{CONFIG['YEAR']}-01-01"
 END_DATE = f"{CONFIG['YEAR']}-12-31"
 CSV_OUTPUT = f'image_metadata_{CONFIG["YEAR"]}.csv'
+CONFIG['EXPORT_JOURNAL'] = f"workspace/data/cache/export_journal_{CONFIG['YEAR']}.json"
+ROI = None  # main() で設定
+EXPORT_QUEUE = None  # main() で設定
+
+L2_COLLECTION = 'LANDSAT/LC08/C02/T1_L2'
+# raw DN エクスポートに記録するスケール係数（apply_scale_factors と同じ値）
+RAW_SCALE_FACTORS = {'SR_SCALE': 0.0000275, 'SR_OFFSET': -0.2, 'ST_SCALE': 0.00341802, 'ST_OFFSET': 149.0}
+
+# 一括取得するメタデータの列（サーバー側で画像プロパティとして付与する）
+METADATA_COLUMNS = ['system:index', 'system:time_start', 'date_str', 'time_csv', 'time_id', 'total_pixels', 'valid_ratio']
+
 # --------------------------------------
 # Earth Engine初期化
 # --------------------------------------
-try:
-    ee.Initialize(project=CONFIG['GGE_PROJECT'])
-except Exception as e:
-    print(f"EE初期化エラー: {e}")
-    ee.Authenticate()
-    ee.Initialize(project=CONFIG['GGE_PROJECT'])
+def initialize_ee():
+    try:
+        ee.Initialize(project=CONFIG['GGE_PROJECT'])
+    except Exception as e:
+        print(f"EE初期化エラー: {e}")
+        ee.Authenticate()
+        ee.Initialize(project=CONFIG['GGE_PROJECT'])
 
 # --------------------------------------
 # ROI取得
 # --------------------------------------
-try:
+def load_roi(region=DEFAULT_REGION):
+    try:
+        boundary_df = gpd.read_file(CONFIG['ROI_SHP_PATH'])
+        geom = boundary_df[boundary_df['TinhThanh'] == get_region(region).name].iloc[0].geometry
+        return ee.Geometry(geom.__geo_interface__)
+    except Exception as e:
+        print(f"ROI取得エラー: {e}")
+        raise
+
+def load_roi_union(regions):
+    """複数都市の ROI の和集合（コレクションの問い合わせを1回にするため）"""
     boundary_df = gpd.read_file(CONFIG['ROI_SHP_PATH'])
-    hanoi_geom = boundary_df[boundary_df['TinhThanh'] == 'Hà Nội'].iloc[0].geometry
-    ROI = ee.Geometry(hanoi_geom.__geo_interface__)
-except Exception as e:
-    print(f"ROI取得エラー: {e}")
-    raise
+    names = [get_region(r).name for r in regions]
+    geometry = boundary_df[boundary_df['TinhThanh'].isin(names)].geometry
+    geom = geometry.union_all() if hasattr(geometry, 'union_all') else geometry.unary_union
+    return ee.Geometry(geom.__geo_interface__)
 
 # --------------------------------------
 # 関数定義
@@ -95,37 +159,149 @@ def get_valid_pixel_ratio(image):
         print(f"有効ピクセル率計算エラー: {e}")
         return 0, 0
 
-def export_lst_to_drive(image, time):
-    try:
-        task = ee.batch.Export.image.toDrive(
-            image=image,
-            description=f'L8_{time}_Hanoi_LST',
-            folder=f"{CONFIG['EXPORT_FOLDER_LST']}/{CONFIG['YEAR']}",
-            fileNamePrefix=f'L8_{time}_Hanoi_LST',
-            scale=CONFIG['EXPORT_SCALE'],
-            region=ROI,
-            maxPixels=1e13,
-            fileFormat='GeoTIFF'
-        )
-        task.start()
-    except Exception as e:
-        print(f"LSTエクスポートエラー: {e}")
+def add_pixel_counts(image, roi, scale, suffix=''):
+    """
+    全体ピクセル数と有効ピクセル数を1回の reduceRegion（count）で求め、
+    日付・時刻とともに画像プロパティとして付与する（サーバー側で実行）
+    :param suffix: ピクセル数・有効ピクセル率のプロパティ名に付ける接尾辞（都市ごとに付与する場合）
+    """
+    st = image.select('ST_B10')
+    counts = ee.Image.cat([st.unmask(1).rename('total'), st.rename('valid')]).reduceRegion(
+        reducer=ee.Reducer.count(),
+        geometry=roi,
+        scale=scale,
+        maxPixels=1e13
+    )
+    total = ee.Number(counts.get('total'))
+    valid = ee.Number(counts.get('valid'))
+    valid_ratio = ee.Algorithms.If(total.gt(0), valid.divide(total), 0)
+    date = ee.Date(image.get('system:time_start'))
+    return image.set({
+        'date_str': date.format('YYYY-MM-dd'),
+        'time_csv': date.format('HH:mm:ss'),
+        'time_id': date.format('YYYYMMdd_HHmmss'),
+        f'total_pixels{suffix}': total,
+        f'valid_ratio{suffix}': valid_ratio,
+    })
 
-def export_reflectance_to_drive(image, time):
+def fetch_collection_metadata(collection, roi, scale):
+    """
+    コレクション全画像のメタデータを1回の getInfo で取得する
+    :return: METADATA_COLUMNS をキーとする辞書のリスト（コレクションの順）
+    """
+    annotated = collection.map(lambda image: add_pixel_counts(image, roi, scale))
+    rows = annotated.reduceColumns(
+        reducer=ee.Reducer.toList(len(METADATA_COLUMNS)),
+        selectors=METADATA_COLUMNS
+    ).get('list').getInfo()
+    return [dict(zip(METADATA_COLUMNS, row)) for row in rows]
+
+def fetch_regions_metadata(collection, rois, scale):
+    """
+    複数都市について、コレクション全画像のメタデータを1回の getInfo で取得する
+    :param rois: slug -> ee.Geometry の辞書
+    :return: slug -> METADATA_COLUMNS をキーとする辞書のリスト（その都市に画素がある画像のみ）
+    """
+    def annotate(image):
+        for slug, roi in rois.items():
+            image = add_pixel_counts(image, roi, scale, suffix=f'__{slug}')
+        return image
+
+    base = METADATA_COLUMNS[:5]
+    selectors = base + [f'{col}__{slug}' for slug in rois for col in ('total_pixels', 'valid_ratio')]
+    rows = collection.map(annotate).reduceColumns(
+        reducer=ee.Reducer.toList(len(selectors)),
+        selectors=selectors
+    ).get('list').getInfo()
+
+    result = {slug: [] for slug in rois}
+    for row in rows:
+        values = dict(zip(selectors, row))
+        for slug in rois:
+            total = values[f'total_pixels__{slug}']
+            if not total:
+                continue
+            record = {col: values[col] for col in base}
+            record['total_pixels'] = total
+            record['valid_ratio'] = values[f'valid_ratio__{slug}']
+            result[slug].append(record)
+    return result
+
+def submit_export(description, task_factory):
+    """
+    エクスポートタスクをキューに登録する（キュー未設定時はその場で開始する）
+    """
+    if EXPORT_QUEUE is not None:
+        return EXPORT_QUEUE.submit(description, task_factory)
     try:
-        task = ee.batch.Export.image.toDrive(
-            image=image,
-            description=f'L8_{time}_Hanoi_Reflectance',
-            folder=f"{CONFIG['EXPORT_FOLDER_REF']}/{CONFIG['YEAR']}",
-            fileNamePrefix=f'L8_{time}_Hanoi_Reflectance',
-            scale=CONFIG['EXPORT_SCALE'],
-            region=ROI,
-            maxPixels=1e13,
-            fileFormat='GeoTIFF'
-        )
-        task.start()
+        task_factory().start()
+        return True
     except Exception as e:
-        print(f"反射バンドエクスポートエラー: {e}")
+        print(f"エクスポートエラー: {description}: {e}")
+        return False
+
+def export_lst_to_drive(image, time, roi=None, slug=DEFAULT_REGION):
+    description = f'L8_{time}_{slug}_LST'
+    return submit_export(description, lambda: ee.batch.Export.image.toDrive(
+        image=image,
+        description=description,
+        folder=f"{CONFIG['EXPORT_FOLDER_LST']}/{CONFIG['YEAR']}",
+        fileNamePrefix=description,
+        scale=CONFIG['EXPORT_SCALE'],
+        region=roi or ROI,
+        maxPixels=1e13,
+        fileFormat='GeoTIFF',
+        formatOptions={'cloudOptimized': True}
+    ))
+
+def export_reflectance_to_drive(image, time, roi=None, slug=DEFAULT_REGION):
+    description = f'L8_{time}_{slug}_Reflectance'
+    return submit_export(description, lambda: ee.batch.Export.image.toDrive(
+        image=image,
+        description=description,
+        folder=f"{CONFIG['EXPORT_FOLDER_REF']}/{CONFIG['YEAR']}",
+        fileNamePrefix=description,
+        scale=CONFIG['EXPORT_SCALE'],
+        region=roi or ROI,
+        maxPixels=1e13,
+        fileFormat='GeoTIFF',
+        formatOptions={'cloudOptimized': True}
+    ))
+
+def export_raw_to_drive(image, time, roi=None, slug=DEFAULT_REGION):
+    """
+    スケール変換・クラウドマスク前の uint16 の SR / ST / QA_PIXEL を1ファイルでエクスポートする
+    スケール係数はエクスポート名で scene_catalog.SCALE_FACTORS_PATH に記録する（landsat_qa.Level2Scene が読む）
+    """
+    description = f'L8_{time}_{slug}_L2raw'
+    record_scale_factors(description, RAW_SCALE_FACTORS)
+    return submit_export(description, lambda: ee.batch.Export.image.toDrive(
+        image=image.select(CONFIG['RAW_BANDS']).toUint16().set(RAW_SCALE_FACTORS).clip(roi or ROI),
+        description=description,
+        folder=f"{CONFIG['EXPORT_FOLDER_RAW']}/{CONFIG['YEAR']}",
+        fileNamePrefix=description,
+        scale=CONFIG['EXPORT_SCALE'],
+        region=roi or ROI,
+        maxPixels=1e13,
+        fileFormat='GeoTIFF',
+        formatOptions={'cloudOptimized': True}
+    ))
+
+def raw_scene_image(scene_id):
+    """クラウドマスク・スケール変換前の Level-2 画像（scene_id は system:index）"""
+    return ee.Image(ee.ImageCollection(L2_COLLECTION).filter(ee.Filter.eq('system:index', scene_id)).first())
+
+def export_scene(image, scene_id, time, roi=None, slug=DEFAULT_REGION):
+    """CONFIG['EXPORT_MODE'] に応じて1シーン分のエクスポートを登録する"""
+    if CONFIG['EXPORT_MODE'] == 'raw':
+        export_raw_to_drive(raw_scene_image(scene_id), time, roi, slug)
+        return
+    export_lst_to_drive(image.select('LST_Celsius').clip(roi or ROI), time, roi, slug)
+    export_reflectance_to_drive(image.select(CONFIG['REFLECTANCE_BANDS']).clip(roi or ROI), time, roi, slug)
+
+def export_kinds():
+    """1シーン分のエクスポート名の接尾辞"""
+    return ('L2raw',) if CONFIG['EXPORT_MODE'] == 'raw' else ('LST', 'Reflectance')
 
 def create_metadata(date_str, total, valid_ratio, exported, time_csv):
     return {
@@ -143,39 +319,201 @@ def export_image_task(image, date_str, metadata_list):
     exported = False
 
     if valid_ratio >= CONFIG['CLOUD_THRESHOLD'] and total >= CONFIG['TOTAL_PIXEL_THRESHOLD']:
-        lst_img = image.select('LST_Celsius').clip(ROI)
-        reflectance_img = image.select(CONFIG['REFLECTANCE_BANDS']).clip(ROI)
         time = ee.Date(image.get('system:time_start')).format('YYYYMMdd_HHmmss').getInfo()
-        export_lst_to_drive(lst_img, time)
-        export_reflectance_to_drive(reflectance_img, time)
+        export_scene(image, image.get('system:index'), time)
         exported = True
 
     time_csv = ee.Date(image.get('system:time_start')).format('HH:mm:ss').getInfo()
     metadata_list.append(create_metadata(date_str, total, valid_ratio, exported, time_csv))
 
+def export_images_batched(collection):
+    """
+    メタデータを一括取得してからエクスポート対象を決める（getInfo は1回）
+    :return: シーンカタログに書き込む行（辞書）のリスト
+    """
+    metadata = fetch_collection_metadata(collection, ROI, CONFIG['EXPORT_SCALE'])
+    return export_metadata_rows(collection, metadata, ROI, DEFAULT_REGION)
+
+def export_metadata_rows(collection, metadata, roi, slug):
+    """
+    取得済みのメタデータから1都市分のエクスポート対象を決めてキューに登録する
+    :return: シーンカタログに書き込む行（辞書）のリスト
+    """
+    rows = []
+    for row in metadata:
+        total = row['total_pixels'] or 0
+        valid_ratio = row['valid_ratio'] or 0
+        exported = False
+        if valid_ratio >= CONFIG['CLOUD_THRESHOLD'] and total >= CONFIG['TOTAL_PIXEL_THRESHOLD']:
+            image = collection.filter(ee.Filter.eq('system:index', row['system:index'])).first()
+            image = ee.Image(image)
+            try:
+                export_scene(image, row['system:index'], row['time_id'], roi, slug)
+                exported = True
+            except Exception as e:
+                print(f"画像処理エラー: {e}")
+        rows.append({
+            'scene_id': row['system:index'],
+            'time_start': row['system:time_start'],
+            'date': row['date_str'],
+            'time': row['time_csv'],
+            'time_id': row['time_id'],
+            'total_pixels': int(total),
+            'valid_ratio': round(valid_ratio, 3),
+            'exported': exported,
+            'export_status': 'QUEUED' if exported else None,
+        })
+    return rows
+
+def resubmit_exports(collection, rows, roi, slug):
+    """
+    カタログ上でエクスポートが完了していないシーンを再投入する（ジャーナルで完了済みのものはキューがスキップする）
+    :param rows: SceneCatalog.pending_exports() の行（辞書）のリスト
+    """
+    for row in rows:
+        image = ee.Image(collection.filter(ee.Filter.eq('system:index', row['scene_id'])).first())
+        try:
+            export_scene(image, row['scene_id'], row['time_id'], roi, slug)
+        except Exception as e:
+            print(f"画像処理エラー: {e}")
+
+def export_status(time_id, slug=DEFAULT_REGION):
+    """1シーン分のエクスポート（LST・反射バンド両方、または raw DN）の状態をジャーナルから求める"""
+    states = [EXPORT_QUEUE.journal.get(f'L8_{time_id}_{slug}_{kind}', {}).get('state')
+              for kind in export_kinds()]
+    for state in states:
+        if state not in DONE_STATES:
+            return state
+    return 'COMPLETED'
+
+def export_images_per_image(collection, metadata_list):
+    """
+    画像ごとに getInfo を呼んでエクスポート対象を決める（従来の方法）
+    """
+    image_list = collection.toList(collection.size())
+
+    for i in range(collection.size().getInfo()):
+        img = ee.Image(image_list.get(i))
+        date = ee.Date(img.get('system:time_start')).format('YYYY-MM-dd').getInfo()
+        try:
+            export_image_task(img, date, metadata_list)
+        except Exception as e:
+            print(f"画像処理エラー: {e}")
+
+def build_collection(start, end, roi=None):
+    """対象期間の Landsat 8 Level-2 コレクション（雲マスク済み。EXPORT_MODE が 'scaled' の場合はスケール変換済み）"""
+    collection = ee.ImageCollection(L2_COLLECTION) \
+        .filterBounds(roi or ROI) \
+        .filterDate(start, end) \
+        .map(cloud_mask)
+    if CONFIG['EXPORT_MODE'] == 'raw':
+        return collection
+    return collection.map(apply_scale_factors)
+
 # --------------------------------------
 # メイン処理
 # --------------------------------------
-os.makedirs(CONFIG['EXPORT_FOLDER_LST'], exist_ok=True)
-os.makedirs(CONFIG['EXPORT_FOLDER_REF'], exist_ok=True)
+def setup():
+    """Earth Engine の初期化と ROI・エクスポートキューの設定"""
+    global ROI, EXPORT_QUEUE
+    initialize_ee()
+    instrument_ee(ee)
+    ROI = load_roi()
+    EXPORT_QUEUE = ExportQueue(
+        journal_path=CONFIG['EXPORT_JOURNAL'],
+        max_running=CONFIG['MAX_RUNNING_EXPORTS'],
+        max_retries=CONFIG['EXPORT_RETRIES']
+    )
 
-collection = ee.ImageCollection('LANDSAT/LC08/C02/T1_L2') \
-    .filterBounds(ROI) \
-    .filterDate(START_DATE, END_DATE) \
-    .map(cloud_mask) \
-    .map(apply_scale_factors)
+    os.makedirs(CONFIG['EXPORT_FOLDER_LST'], exist_ok=True)
+    os.makedirs(CONFIG['EXPORT_FOLDER_REF'], exist_ok=True)
+    if CONFIG['EXPORT_MODE'] == 'raw':
+        os.makedirs(CONFIG['EXPORT_FOLDER_RAW'], exist_ok=True)
 
-image_list = collection.toList(collection.size())
-metadata = []
+def main():
+    setup()
 
-for i in range(collection.size().getInfo()):
-    img = ee.Image(image_list.get(i))
-    date = ee.Date(img.get('system:time_start')).format('YYYY-MM-dd').getInfo()
-    try:
-        export_image_task(img, date, metadata)
-    except Exception as e:
-        print(f"画像処理エラー: {e}")
+    if not CONFIG['BATCH_METADATA']:
+        collection = build_collection(START_DATE, END_DATE)
+        metadata = []
+        export_images_per_image(collection, metadata)
+        df = pd.DataFrame(metadata)
+        df = df.drop_duplicates(subset=['日時', '観測時刻'])
+        df.to_csv(CSV_OUTPUT, index=False)
+        EXPORT_QUEUE.run()
+        return
+
+    run_regions(select_regions(CONFIG['REGIONS']), START_DATE, END_DATE)
+
+@instrumented('harvest')
+def run_regions(regions, start=START_DATE, end=END_DATE):
+    """
+    複数都市の収集・エクスポートをまとめて行う
+    コレクションの問い合わせとメタデータの getInfo は全都市で1回、エクスポートは1つのキューで実行する
+    :param regions: regions.Region のリスト
+    :return: slug -> カタログに追加した行のリスト
+    """
+    if EXPORT_QUEUE is None:
+        setup()
+    regions = [get_region(r) for r in regions]
+    rois = {r.slug: load_roi(r) for r in regions}
+    union = rois[regions[0].slug] if len(regions) == 1 else load_roi_union(regions)
+    catalogs = {r.slug: r.catalog_path(CONFIG['CATALOG_PATH']) for r in regions}
+
+    # 前回までにカタログに追加したがエクスポートが完了していないシーン（中断・失敗）を再投入する
+    # （high-water mark はカタログへの追加時点で進むため、ここで拾わないと二度と問い合わせない）
+    resumed = {}
+    for region in regions:
+        with SceneCatalog(catalogs[region.slug]) as catalog:
+            resumed[region.slug] = catalog.pending_exports(start, end, DONE_STATES).to_dict('records')
+    if any(resumed.values()):
+        full_collection = build_collection(start, end, union)
+        for region in regions:
+            if resumed[region.slug]:
+                print(f"{region.label}: 未完了のエクスポートを再投入します: {len(resumed[region.slug])}シーン")
+                with stage('harvest.resubmit', region=region.slug):
+                    resubmit_exports(full_collection, resumed[region.slug], rois[region.slug], region.slug)
+
+    # 都市ごとのカタログの最新観測時刻のうち最も古いものより新しいシーンだけを問い合わせる
+    high_water_marks = {}
+    for region in regions:
+        with SceneCatalog(catalogs[region.slug]) as catalog:
+            high_water_marks[region.slug] = catalog.high_water_mark(start, end)
+    marks = list(high_water_marks.values())
+    if all(m is not None for m in marks):
+        print(f"カタログの最新観測時刻以降のみ取得します: {min(marks)}")
+        collection = build_collection(ee.Date(min(marks) + 1), end, union)
+    else:
+        collection = build_collection(start, end, union)
+
+    with stage('harvest.metadata', regions=list(rois)):
+        metadata = fetch_regions_metadata(collection, rois, CONFIG['EXPORT_SCALE'])
+    # 今回の問い合わせで確認できた最新の観測時刻（全都市の ROI の和集合に対する問い合わせのため全都市で共通）
+    times = [row['system:time_start'] for rows in metadata.values() for row in rows]
+    harvested_until = max(times) if times else None
+    added = {}
+    for region in regions:
+        mark = high_water_marks[region.slug]
+        region_rows = [row for row in metadata[region.slug] if mark is None or row['system:time_start'] > mark]
+        with stage('harvest.submit', region=region.slug):
+            added[region.slug] = export_metadata_rows(collection, region_rows, rois[region.slug], region.slug)
+        with SceneCatalog(catalogs[region.slug]) as catalog:
+            catalog.upsert(added[region.slug])
+            if harvested_until is not None:
+                catalog.set_harvested_until(start, end, harvested_until)
+        print(f"{region.label}: {len(added[region.slug])}シーンをカタログに追加しました: {catalogs[region.slug]}")
+
+    # エクスポートの完了を待ち、状態を各都市のカタログに反映する
+    with stage('harvest.exports'):
+        EXPORT_QUEUE.run()
+    for region in regions:
+        with SceneCatalog(catalogs[region.slug]) as catalog:
+            for row in added[region.slug] + resumed[region.slug]:
+                if row['exported']:
+                    catalog.set_export_status(row['scene_id'], export_status(row['time_id'], region.slug))
+    for description in EXPORT_QUEUE.failed():
+        print(f"エクスポート失敗: {description}")
+    return added
 
-df = pd.DataFrame(metadata)
-df = df.drop_duplicates(subset=['日時', '観測時刻'])
-df.to_csv(CSV_OUTPUT, index=False)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
\ No newline at end of file
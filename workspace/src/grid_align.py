@@ -0,0 +1,314 @@
+"""
+異なるセンサーのラスタ（MODIS 1 km / EPSG:4326 と Landsat 30 m / UTM など）を同じグリッドに揃えるモジュール
+
+シーンごとに再投影（warp）する代わりに、元グリッド -> 先グリッドの画素の対応（添字の配列と重み）を
+グリッドの組ごとに1回だけ計算してキャッシュし、各シーンには添字による取り出しと np.bincount だけを行う。
+何年分のシーンを重ねても座標変換は1回で済む。
+
+- 方法（method）
+average  : 細かいグリッド -> 粗いグリッド（Landsat 30 m -> MODIS 1 km）。元の画素の中心が入る先の画素ごとに
+           有効画素（NaN でない）の平均を取る（ブロック平均）。np.bincount（weights 指定）で全画素を一度に集計する
+nearest  : 先の画素の中心に最も近い元の画素の値（粗いグリッド -> 細かいグリッド, または分類値）
+bilinear : 先の画素の中心を囲む元の4画素の双線形補間（NaN の画素は除いて重みを正規化する）
+auto     : 元の画素が先の画素より小さければ average、そうでなければ bilinear
+
+- キャッシュ
+プロセス内と workspace/data/cache/align/{元グリッド}_{先グリッド}_{method}.npz
+（グリッドのキーは roi_window.grid_key と同じ CRS・変換行列・大きさのハッシュ）
+
+- 使い方
+python workspace/src/grid_align.py --template L8_20230707_032145_Hanoi_LST.tif --method average \\
+    --out workspace/data/geotiff/aligned hanoi_modis_lst_*.tif             # Landsat を MODIS に揃える場合は逆
+python workspace/src/grid_align.py --template hanoi_modis_lst_202501.tif --method average \\
+    --out workspace/data/geotiff/aligned workspace/data/geotiff/Landsat8/LST/2023/*.tif
+"""
+
+import os
+import argparse
+from glob import glob
+
+import numpy as np
+import rasterio
+from rasterio.transform import rowcol
+from rasterio.warp import transform as transform_coords, transform_bounds
+
+from roi_window import grid_key
+from raster_io import read_band, write_cog
+from instrumentation import stage
+
+ALIGN_CACHE_DIR = 'workspace/data/cache/align'
+METHODS = ['auto', 'average', 'nearest', 'bilinear']
+# 座標変換を行う行ブロックの行数（メモリは 行数 × 列数 × 8byte × 数個）
+CHUNK_ROWS = 512
+
+
+class Grid:
+    """ラスタグリッド（CRS・変換行列・大きさ）"""
+
+    def __init__(self, crs, transform, width, height):
+        self.crs = crs
+        self.transform = transform
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def from_dataset(cls, src):
+        return cls(src.crs, src.transform, src.width, src.height)
+
+    @classmethod
+    def from_path(cls, path):
+        with rasterio.open(path) as src:
+            return cls.from_dataset(src)
+
+    @property
+    def key(self):
+        return grid_key(self.crs, self.transform, self.width, self.height)
+
+    @property
+    def size(self):
+        return self.width * self.height
+
+    def pixel_area(self, crs):
+        """1画素の面積の概算（crs の単位）"""
+        left, bottom, right, top = transform_bounds(self.crs, crs, *self.bounds)
+        return abs((right - left) * (top - bottom)) / self.size
+
+    @property
+    def bounds(self):
+        left, top = self.transform * (0, 0)
+        right, bottom = self.transform * (self.width, self.height)
+        return min(left, right), min(top, bottom), max(left, right), max(top, bottom)
+
+    def centers(self, row, rows):
+        """row 行目から rows 行分の画素の中心座標 (x, y)（1次元配列）"""
+        cols, rr = np.meshgrid(np.arange(self.width) + 0.5, np.arange(row, row + rows) + 0.5)
+        a, b, c, d, e, f = tuple(self.transform)[:6]
+        return a * cols + b * rr + c, d * cols + e * rr + f
+
+
+def _to_crs(xs, ys, src_crs, dst_crs):
+    if src_crs == dst_crs:
+        return xs.ravel(), ys.ravel()
+    x, y = transform_coords(src_crs, dst_crs, xs.ravel(), ys.ravel())
+    return np.asarray(x), np.asarray(y)
+
+
+def _index_dtype(n):
+    return np.int32 if n < 2 ** 31 else np.int64
+
+
+class GridMapping:
+    """
+    元グリッド -> 先グリッドの画素の対応
+    average  : src_index（先のグリッドに入る元の画素）, dst_index（その先の画素）, total（先の画素ごとの元の画素数）
+    nearest  : index（先の画素ごとの元の画素, -1 = 範囲外）
+    bilinear : index（先の画素ごとの元の4画素）, weight（4画素の重み）, inside（範囲内か）
+    """
+
+    def __init__(self, method, src_shape, dst_shape, **arrays):
+        self.method = method
+        self.src_shape = tuple(src_shape)
+        self.dst_shape = tuple(dst_shape)
+        self.arrays = arrays
+
+    @classmethod
+    def build(cls, src, dst, method):
+        """元グリッド src から先グリッド dst への対応を計算する（座標変換はここでだけ行う）"""
+        if method == 'auto':
+            method = 'average' if src.pixel_area(dst.crs) < dst.pixel_area(dst.crs) else 'bilinear'
+        if method == 'average':
+            arrays = cls._build_average(src, dst)
+        elif method == 'nearest':
+            arrays = cls._build_nearest(src, dst)
+        elif method == 'bilinear':
+            arrays = cls._build_bilinear(src, dst)
+        else:
+            raise ValueError(f"不明な方法: {method}（{', '.join(METHODS)}）")
+        return cls(method, (src.height, src.width), (dst.height, dst.width), **arrays)
+
+    @staticmethod
+    def _build_average(src, dst):
+        itype = _index_dtype(max(src.size, dst.size))
+        src_parts, dst_parts = [], []
+        for row in range(0, src.height, CHUNK_ROWS):
+            rows = min(CHUNK_ROWS, src.height - row)
+            xs, ys = _to_crs(*src.centers(row, rows), src.crs, dst.crs)
+            r, c = rowcol(dst.transform, xs, ys, op=np.floor)
+            r, c = np.asarray(r), np.asarray(c)
+            inside = (r >= 0) & (r < dst.height) & (c >= 0) & (c < dst.width)
+            flat = np.flatnonzero(inside)
+            src_parts.append((flat + row * src.width).astype(itype))
+            dst_parts.append((r[inside] * dst.width + c[inside]).astype(itype))
+        src_index = np.concatenate(src_parts)
+        dst_index = np.concatenate(dst_parts)
+        total = np.bincount(dst_index, minlength=dst.size).astype(np.int32)
+        return dict(src_index=src_index, dst_index=dst_index, total=total)
+
+    @staticmethod
+    def _source_positions(src, dst, row, rows):
+        """先の画素の中心の、元グリッドでの (行, 列) の実数座標"""
+        xs, ys = _to_crs(*dst.centers(row, rows), dst.crs, src.crs)
+        inv = ~src.transform
+        cols = inv.a * xs + inv.b * ys + inv.c
+        rws = inv.d * xs + inv.e * ys + inv.f
+        return rws, cols
+
+    @classmethod
+    def _build_nearest(cls, src, dst):
+        index = np.empty(dst.size, dtype=_index_dtype(src.size))
+        for row in range(0, dst.height, CHUNK_ROWS):
+            rows = min(CHUNK_ROWS, dst.height - row)
+            r, c = cls._source_positions(src, dst, row, rows)
+            r, c = np.floor(r).astype(np.int64), np.floor(c).astype(np.int64)
+            inside = (r >= 0) & (r < src.height) & (c >= 0) & (c < src.width)
+            index[row * dst.width:(row + rows) * dst.width] = np.where(inside, r * src.width + c, -1)
+        return dict(index=index)
+
+    @classmethod
+    def _build_bilinear(cls, src, dst):
+        index = np.empty((dst.size, 4), dtype=_index_dtype(src.size))
+        weight = np.empty((dst.size, 4), dtype=np.float32)
+        inside = np.empty(dst.size, dtype=bool)
+        for row in range(0, dst.height, CHUNK_ROWS):
+            rows = min(CHUNK_ROWS, dst.height - row)
+            r, c = cls._source_positions(src, dst, row, rows)
+            part = slice(row * dst.width, (row + rows) * dst.width)
+            inside[part] = (r >= 0) & (r < src.height) & (c >= 0) & (c < src.width)
+            # 画素の中心を基準にした座標（端では最も近い画素の値になる）
+            r = np.clip(r - 0.5, 0, src.height - 1)
+            c = np.clip(c - 0.5, 0, src.width - 1)
+            r0, c0 = np.floor(r).astype(np.int64), np.floor(c).astype(np.int64)
+            r1, c1 = np.minimum(r0 + 1, src.height - 1), np.minimum(c0 + 1, src.width - 1)
+            fr, fc = (r - r0).astype(np.float32), (c - c0).astype(np.float32)
+            index[part] = np.stack([r0 * src.width + c0, r0 * src.width + c1,
+                                    r1 * src.width + c0, r1 * src.width + c1], axis=1)
+            weight[part] = np.stack([(1 - fr) * (1 - fc), (1 - fr) * fc, fr * (1 - fc), fr * fc], axis=1)
+        return dict(index=index, weight=weight, inside=inside)
+
+    # --- 保存・読み込み ---
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, method=self.method, src_shape=self.src_shape, dst_shape=self.dst_shape, **self.arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            arrays = {k: z[k] for k in z.files if k not in ('method', 'src_shape', 'dst_shape')}
+            return cls(str(z['method']), z['src_shape'], z['dst_shape'], **arrays)
+
+    # --- 適用 ---
+    def apply(self, data, min_valid=0.0):
+        """
+        元グリッドの配列を先グリッドに揃える
+        :param data: 元グリッドの float 配列（NaN = 欠損）。(行, 列) または (シーン, 行, 列)
+        :param min_valid: average の場合、先の画素に入る元の画素のうち有効画素の割合がこれ未満なら NaN
+        :return: 先グリッドの float32 配列（範囲外・有効画素なしは NaN）
+        """
+        data = np.asarray(data)
+        if data.shape[-2:] != self.src_shape:
+            raise ValueError(f"元グリッドの大きさが一致しません: {data.shape[-2:]} != {self.src_shape}")
+        if data.ndim == 3:
+            return np.stack([self.apply(d, min_valid) for d in data])
+        flat = data.reshape(-1)
+        n = self.dst_shape[0] * self.dst_shape[1]
+
+        if self.method == 'average':
+            a = self.arrays
+            values = flat[a['src_index']].astype(np.float64)
+            valid = ~np.isnan(values)
+            count = np.bincount(a['dst_index'], weights=valid, minlength=n)
+            total = np.bincount(a['dst_index'], weights=np.where(valid, values, 0.0), minlength=n)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out = (total / count).astype(np.float32)
+                if min_valid > 0:
+                    out[count < min_valid * a['total']] = np.nan
+            out[count == 0] = np.nan
+        elif self.method == 'nearest':
+            index = self.arrays['index']
+            out = flat[np.maximum(index, 0)].astype(np.float32)
+            out[index < 0] = np.nan
+        else:
+            a = self.arrays
+            values = flat[a['index']].astype(np.float32)
+            w = np.where(np.isnan(values), np.float32(0), a['weight'])
+            wsum = w.sum(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out = np.nansum(values * w, axis=1) / wsum
+            out[(wsum == 0) | ~a['inside']] = np.nan
+        return out.reshape(self.dst_shape)
+
+
+_MAPPINGS = {}
+
+
+def mapping_for(src, dst, method='auto', cache_dir=ALIGN_CACHE_DIR):
+    """
+    元グリッド -> 先グリッドの GridMapping を返す（プロセス内・ディスクにキャッシュ）
+    :param src, dst: Grid
+    :param cache_dir: ディスクキャッシュのフォルダ（None の場合はディスクに保存しない）
+    """
+    key = f"{src.key}_{dst.key}_{method}"
+    if key in _MAPPINGS:
+        return _MAPPINGS[key]
+    cache_path = os.path.join(cache_dir, f"{key}.npz") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        mapping = GridMapping.load(cache_path)
+    else:
+        with stage('align.build', method=method):
+            mapping = GridMapping.build(src, dst, method)
+        if cache_path:
+            mapping.save(cache_path)
+    _MAPPINGS[key] = mapping
+    return mapping
+
+
+def align(path, template, method='auto', band=1, min_valid=0.0, cache_dir=ALIGN_CACHE_DIR):
+    """
+    GeoTIFF 1バンドを template のグリッドに揃える
+    :param template: 先グリッドの GeoTIFF のパス、または Grid
+    :param band: バンド番号またはバンド名（int16 に量子化したファイルは値に戻して読む）
+    :return: 先グリッドの float32 配列
+    """
+    dst = template if isinstance(template, Grid) else Grid.from_path(template)
+    with stage('align', scene=os.path.basename(path)) as st, rasterio.open(path) as src:
+        mapping = mapping_for(Grid.from_dataset(src), dst, method, cache_dir)
+        st.add(pixels=dst.size)
+        return mapping.apply(read_band(src, band), min_valid)
+
+
+def align_files(paths, template, out_folder, method='auto', band=1, min_valid=0.0, cache_dir=ALIGN_CACHE_DIR):
+    """
+    複数の GeoTIFF を template のグリッドに揃えて out_folder に保存する（同じ元グリッドの対応は1回だけ計算）
+    :return: 出力パスのリスト
+    """
+    with rasterio.open(template) as t:
+        dst = Grid.from_dataset(t)
+        profile = t.profile
+    outputs = []
+    for path in paths:
+        data = align(path, dst, method, band, min_valid, cache_dir)
+        out_path = os.path.join(out_folder, os.path.basename(path).replace('.tif', '_aligned.tif'))
+        write_cog(out_path, data, profile, dtype='float32', nodata=np.nan)
+        outputs.append(out_path)
+    return outputs
+
+
+def main():
+    ap = argparse.ArgumentParser(description="ラスタを別のグリッドに揃える（対応はグリッドの組ごとにキャッシュ）")
+    ap.add_argument("inputs", type=str, nargs='+', help="揃える GeoTIFF（glob パターン可）")
+    ap.add_argument("--template", type=str, required=True, help="先グリッドの GeoTIFF")
+    ap.add_argument("--method", type=str, default='auto', choices=METHODS, help="集約・補間の方法")
+    ap.add_argument("--band", type=str, default='1', help="バンド番号またはバンド名")
+    ap.add_argument("--min-valid", type=float, default=0.0,
+                    help="average の場合に必要な有効画素の割合（例: 0.5）")
+    ap.add_argument("--out", type=str, default='workspace/data/geotiff/aligned', help="出力フォルダ")
+    args = ap.parse_args()
+
+    paths = sorted(p for pattern in args.inputs for p in (glob(pattern) or [pattern]))
+    band = int(args.band) if args.band.isdigit() else args.band
+    outputs = align_files(paths, args.template, args.out, args.method, band, args.min_valid)
+    print(f"{len(outputs)}ファイルを保存しました: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
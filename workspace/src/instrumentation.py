@@ -0,0 +1,298 @@
+"""
+処理ステージごとの時間・I/O・メモリを記録する計測モジュール
+
+年間の処理が遅いときに、時間が getInfo の往復・ラスタの読み書き・NumPy の計算のどこにかかったかを
+ステージ単位・シーン単位で確認するためのもの。
+
+・stage(name, **fields) で囲んだ範囲ごとに、経過時間・CPU 時間・読み込み/書き込みバイト数・画素数・
+  Earth Engine の往復回数・常駐メモリの増加量を記録し、JSON Lines でログに1行ずつ追記する
+・常駐メモリ（RSS）はステージの開始・終了、内側のステージの開始・終了、ラスタの読み書きのたびに測り、
+  ステージ中の最大値と開始時の差を rss_growth_mb とする（process_peak_rss_mb はプロセス全体の最大値 ru_maxrss）
+・ラスタの読み書きバイト数は rasterio の read / write を包んで自動で数える
+・Earth Engine の往復回数は instrument_ee(ee) で getInfo 相当の呼び出し・タスクの開始・状態の問い合わせを包んで数える
+・ステージは入れ子にでき、内側のステージの数値は外側のステージにも加算される
+・ワーカープロセスも同じログファイルに追記し、summary() はログ全体（同じ実行ID）を集計する
+・無効のときの stage() は何もしない（本番でも有効のままにできるよう、有効時の負荷もステージあたり数十μs）
+
+- 有効化
+環境変数 LST_PROFILE=1（ログは workspace/data/logs/profile_{実行ID}.jsonl）または LST_PROFILE=<ログのパス>
+プログラムからは enable(path)。有効な場合は終了時に summary() を表示する。
+
+- 使用例
+with stage('ref_indices', scene=name) as st:
+    data = src.read(...)          # 読み込みバイト数は自動で加算
+    st.add(pixels=data.size)
+"""
+
+import os
+import json
+import time
+import atexit
+import resource
+import threading
+import functools
+import contextlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+LOG_FOLDER = 'workspace/data/logs'
+ENV_PROFILE = 'LST_PROFILE'
+ENV_RUN_ID = 'LST_PROFILE_RUN'
+ENV_OWNER = 'LST_PROFILE_OWNER'
+COUNTERS = ('bytes_read', 'bytes_written', 'pixels', 'round_trips')
+
+_state = {'enabled': False, 'log_path': None, 'run_id': None, 'owner_pid': None}
+_local = threading.local()
+
+
+class Stage:
+    """計測中のステージ"""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.rss_start = self.rss_peak = None
+
+    def add(self, **counts):
+        """このステージ（と外側のステージ）にカウンタを加算する"""
+        for stack_stage in _stack():
+            for key, value in counts.items():
+                stack_stage.counts[key] = stack_stage.counts.get(key, 0) + value
+
+
+class _NullStage:
+    def add(self, **counts):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def is_enabled():
+    return _state['enabled']
+
+
+def add(**counts):
+    """現在のステージ（と外側のステージ）にカウンタを加算する（計測していない場合は何もしない）"""
+    if _state['enabled'] and _stack():
+        _stack()[-1].add(**counts)
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _sample_rss():
+    """現在の RSS で計測中の全ステージの最大値を更新する"""
+    rss = _rss_mb()
+    if rss is None:
+        return
+    for stack_stage in _stack():
+        if stack_stage.rss_peak is None or rss > stack_stage.rss_peak:
+            stack_stage.rss_peak = rss
+
+
+def _write(record):
+    with open(_state['log_path'], 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    """
+    範囲を1つのステージとして計測する
+    :param name: ステージ名（例: 'ref_indices', 'harvest.metadata'）
+    :param fields: ログに残す属性（例: scene='L8_...'）
+    """
+    if not _state['enabled']:
+        yield _NULL_STAGE
+        return
+    stack = _stack()
+    current = Stage(name, fields)
+    path = '/'.join([s.name for s in stack] + [name])
+    stack.append(current)
+    current.rss_start = _rss_mb()
+    _sample_rss()
+    started = datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+        _sample_rss()
+        stack.pop()
+        record = OrderedDict(event='stage', run_id=_state['run_id'], pid=os.getpid(), name=name, path=path,
+                             started=started, wall_s=round(wall, 6), cpu_s=round(cpu, 6))
+        record.update(current.counts)
+        record['rss_mb'] = _rss_mb()
+        record['rss_peak_mb'] = current.rss_peak
+        record['rss_growth_mb'] = (round(current.rss_peak - current.rss_start, 3)
+                                   if current.rss_start is not None else None)
+        record['process_peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        if fields:
+            record['fields'] = fields
+        if error:
+            record['error'] = error
+        _write(record)
+
+
+def instrumented(name=None):
+    """関数全体を1つのステージとして計測するデコレータ"""
+    def decorator(fn):
+        stage_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --------------------
+# ラスタ I/O・Earth Engine の計測
+# --------------------
+def _wrap_method(cls, method, counter, size_of):
+    original = getattr(cls, method)
+    if getattr(original, '_instrumented', False):
+        return
+
+    def wrapper(self, *args, **kwargs):
+        result = original(self, *args, **kwargs)
+        if _state['enabled'] and _stack():
+            add(**{counter: size_of(args, kwargs, result)})
+            _sample_rss()
+        return result
+    wrapper._instrumented = True
+    setattr(cls, method, wrapper)
+
+
+def _nbytes(value):
+    return int(getattr(value, 'nbytes', 0) or 0)
+
+
+def instrument_rasterio():
+    """rasterio の read / write を包み、読み書きしたバイト数を現在のステージに加算する"""
+    from rasterio import io
+
+    for cls in (io.DatasetReader, io.DatasetWriter, io.BufferedDatasetWriter):
+        _wrap_method(cls, 'read', 'bytes_read', lambda a, k, r: _nbytes(r))
+    for cls in (io.DatasetWriter, io.BufferedDatasetWriter):
+        _wrap_method(cls, 'write', 'bytes_written', lambda a, k, r: _nbytes(a[0] if a else k.get('arr')))
+
+
+def _count_calls(owner, name):
+    original = getattr(owner, name, None)
+    if original is None or getattr(original, '_instrumented', False):
+        return
+
+    def wrapper(*args, **kwargs):
+        add(round_trips=1)
+        return original(*args, **kwargs)
+    wrapper._instrumented = True
+    setattr(owner, name, wrapper)
+
+
+def instrument_ee(ee):
+    """
+    Earth Engine のサーバーとの往復（値の取得・タスクの開始・タスク状態の問い合わせ）を数える
+    ee_local（オフラインのエミュレーション）の場合は各オブジェクトの getInfo を数える
+    """
+    if hasattr(ee.data, 'computeValue'):
+        _count_calls(ee.data, 'computeValue')
+    else:
+        for obj in list(vars(ee).values()):
+            if isinstance(obj, type) and 'getInfo' in vars(obj):
+                _count_calls(obj, 'getInfo')
+    _count_calls(ee.data, 'getTaskStatus')
+    _count_calls(ee.batch.Task, 'start')
+
+# --------------------
+# 有効化・集計
+# --------------------
+def enable(log_path=None, run_id=None):
+    """
+    計測を有効にする（子プロセスにも環境変数で引き継ぐ）
+    :param log_path: JSON Lines のログのパス（None の場合は workspace/data/logs/profile_{実行ID}.jsonl）
+    """
+    run_id = run_id or os.environ.get(ENV_RUN_ID) or datetime.now().strftime('%Y%m%d_%H%M%S') + f'_{os.getpid()}'
+    log_path = log_path or os.path.join(LOG_FOLDER, f'profile_{run_id}.jsonl')
+    os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+    _state.update(enabled=True, log_path=log_path, run_id=run_id)
+    os.environ[ENV_PROFILE] = log_path
+    os.environ[ENV_RUN_ID] = run_id
+    instrument_rasterio()
+    # 集計を表示するのは最初に有効にしたプロセスだけ（spawn で起動したワーカーは環境変数で判別する）
+    owner = int(os.environ.setdefault(ENV_OWNER, str(os.getpid())))
+    if _state['owner_pid'] is None and owner == os.getpid():
+        _state['owner_pid'] = owner
+        atexit.register(_print_summary_at_exit)
+
+
+def summary(log_path=None, run_id=None):
+    """
+    ログ（同じ実行IDの全プロセス分）をステージ名ごとに集計する
+    :return: ステージ名 -> {calls, wall_s, cpu_s, bytes_read, bytes_written, pixels, round_trips,
+                            rss_growth_mb（1回あたりの最大）, process_peak_rss_mb}
+    """
+    log_path = log_path or _state['log_path']
+    run_id = run_id or _state['run_id']
+    totals = OrderedDict()
+    if not log_path or not os.path.exists(log_path):
+        return totals
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('event') != 'stage' or (run_id and record.get('run_id') != run_id):
+                continue
+            t = totals.setdefault(record['name'], dict(calls=0, wall_s=0.0, cpu_s=0.0, rss_growth_mb=0.0,
+                                                       process_peak_rss_mb=0.0, **dict.fromkeys(COUNTERS, 0)))
+            t['calls'] += 1
+            t['wall_s'] += record['wall_s']
+            t['cpu_s'] += record['cpu_s']
+            for key in COUNTERS:
+                t[key] += record.get(key, 0)
+            t['rss_growth_mb'] = max(t['rss_growth_mb'], record.get('rss_growth_mb') or 0)
+            t['process_peak_rss_mb'] = max(t['process_peak_rss_mb'], record.get('process_peak_rss_mb') or 0)
+    return totals
+
+
+def format_summary(totals):
+    lines = [f"{'stage':28s} {'calls':>6s} {'wall s':>9s} {'cpu s':>9s} {'read MB':>9s} {'write MB':>9s} "
+             f"{'Mpx':>8s} {'trips':>6s} {'RSS+ MB':>8s} {'peak MB':>8s}"]
+    for name, t in totals.items():
+        lines.append(f"{name:28s} {t['calls']:6d} {t['wall_s']:9.3f} {t['cpu_s']:9.3f} "
+                     f"{t['bytes_read'] / 2 ** 20:9.1f} {t['bytes_written'] / 2 ** 20:9.1f} "
+                     f"{t['pixels'] / 1e6:8.2f} {t['round_trips']:6d} {t['rss_growth_mb']:8.1f} "
+                     f"{t['process_peak_rss_mb']:8.1f}")
+    return '\n'.join(lines)
+
+
+def _print_summary_at_exit():
+    if not _state['enabled'] or os.getpid() != _state['owner_pid']:
+        return
+    totals = summary()
+    if not totals:
+        return
+    _write({'event': 'summary', 'run_id': _state['run_id'], 'stages': totals})
+    print(f"\n[profile] {_state['log_path']}")
+    print(format_summary(totals))
+
+
+if os.environ.get(ENV_PROFILE):
+    value = os.environ[ENV_PROFILE]
+    enable(None if value in ('1', 'true', 'True') else value)
@@ -0,0 +1,370 @@
+"""
+Landsat Collection 2 Level-2 の QA_PIXEL 判定とスケール変換をローカルの NumPy で行うモジュール
+
+GEE スクリプトの mask_clouds / cloud_mask / apply_scale_factors / compute_lst_and_reflectance / calc_lst
+と同じ処理を、ダウンロード済みの Level-2 タイルに対して行う。
+
+・QA_PIXEL は 65536 要素のルックアップテーブル（uint16 -> 真偽）で一度に判定する（ビット演算を画素ごとに繰り返さない）
+  テーブルはビットの組み合わせごとに1回だけ作る
+・マスクするビットの組は MASK_PRESETS に各スクリプトと同じものを定義している
+・SR / ST のスケール変換は float32 の出力配列に in-place で行う
+・シーン全体は行ブロックごとに処理するため、メモリは行ブロックの大きさで決まる
+
+- QA_PIXEL のビット（Collection 2）
+0: Fill, 1: Dilated Cloud, 2: Cirrus, 3: Cloud, 4: Cloud Shadow, 5: Snow
+Fill の画素は GEE ではデータセットのマスクで除かれるため、ここでも既定でマスクする。
+
+- スケール係数
+SR_B*: DN * 0.0000275 - 0.2
+ST_B10: DN * 0.00341802 + 149.0（K）、摂氏は - 273.15
+DN = 0 は欠損値（GEE ではマスク済み）として NaN にする。
+GeoTIFF のタグに SR_SCALE / SR_OFFSET / ST_SCALE / ST_OFFSET があればそちらを、無ければエクスポート時に
+記録した係数（scene_catalog.SCALE_FACTORS_PATH, エクスポート名 = ファイル名）を使う（scale_factors）。
+
+- raw DN のシーンの遅延読み込み（Level2Scene）
+gee_landsat8_get_data の EXPORT_MODE = 'raw' のエクスポート（L8_{time}_{slug}_L2raw.tif, uint16 の
+SR_B1〜SR_B7, ST_B10, QA_PIXEL）を、ステージが必要とするバンド・ウィンドウだけ読み込んだ時点でスケール変換・マスクする。
+with Level2Scene(path) as l2:
+    red = l2.read('SR_B4', window)          # 反射率（float32, 雲・欠損は NaN）
+    lst = l2.read('LST_Celsius', window)    # 地表面温度（°C）
+
+- 使い方
+python workspace/src/landsat_qa.py <シーンのフォルダ or GeoTIFF> --preset gee_landsat8_get_data --out <出力GeoTIFF>
+python workspace/src/landsat_qa.py <シーン> --out <出力GeoTIFF> --quantize   # int16（raster_io.QUANTIZATION）で保存
+"""
+
+import os
+import re
+import argparse
+from functools import lru_cache
+from glob import glob
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from roi_window import roi_for_dataset, roi_profile
+from scene_catalog import load_scale_factors
+from raster_io import open_cog, quantize as quantize_int16, quantization, quantized_profile, set_quantization
+
+# QA_PIXEL のビット番号
+QA_FILL = 0
+QA_DILATED_CLOUD = 1
+QA_CIRRUS = 2
+QA_CLOUD = 3
+QA_CLOUD_SHADOW = 4
+QA_SNOW = 5
+
+# 各スクリプトのクラウドマスクと同じビットの組
+MASK_PRESETS = {
+    'GEE_Landsat8_LST': (QA_CLOUD, QA_CLOUD_SHADOW, QA_SNOW),            # mask_clouds
+    'OldGEE_Landsat8_LST': (QA_CLOUD, QA_CLOUD_SHADOW, QA_SNOW),         # mask_clouds
+    'GEE_landsat8_BT': (QA_CIRRUS, QA_CLOUD, QA_CLOUD_SHADOW, QA_SNOW),  # mask_clouds
+    'gee_landsat8_get_data': (QA_CIRRUS, QA_CLOUD, QA_CLOUD_SHADOW),     # cloud_mask
+}
+DEFAULT_PRESET = 'gee_landsat8_get_data'
+
+# Level-2 のスケール係数
+SR_SCALE = 0.0000275
+SR_OFFSET = -0.2
+ST_SCALE = 0.00341802
+ST_OFFSET = 149.0
+KELVIN_OFFSET = 273.15
+L2_NODATA = 0
+RAW_FACTOR_KEYS = ('SR_SCALE', 'SR_OFFSET', 'ST_SCALE', 'ST_OFFSET')
+
+SR_BANDS = ['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7']
+ST_BAND = 'ST_B10'
+QA_BAND = 'QA_PIXEL'
+LST_BAND_NAME = 'LST_Celsius'  # gee_landsat8_get_data.apply_scale_factors と同じ名前
+
+CHUNK_ROWS = 1024
+
+
+@lru_cache(maxsize=None)
+def build_qa_lut(bits, mask_fill=True):
+    """
+    QA_PIXEL の値 (0〜65535) -> 晴天（マスクしない）なら True のルックアップテーブルを作る
+    :param bits: マスクするビット番号のタプル
+    :param mask_fill: Fill ビットの立った画素もマスクするか
+    :return: 長さ 65536 の bool 配列（読み取り専用）
+    """
+    flags = 0
+    for bit in bits:
+        flags |= 1 << bit
+    if mask_fill:
+        flags |= 1 << QA_FILL
+    values = np.arange(65536, dtype=np.uint32)
+    lut = (values & flags) == 0
+    lut.setflags(write=False)
+    return lut
+
+
+def preset_bits(preset):
+    if preset not in MASK_PRESETS:
+        raise ValueError(f"不明なプリセット: {preset}（{', '.join(MASK_PRESETS)}）")
+    return MASK_PRESETS[preset]
+
+
+def clear_mask(qa, preset=DEFAULT_PRESET, bits=None, mask_fill=True, out=None):
+    """
+    QA_PIXEL から晴天画素のマスクを求める
+    :param qa: QA_PIXEL の配列（uint16）
+    :param preset: MASK_PRESETS のキー（bits を指定した場合は無視）
+    :param bits: マスクするビット番号の並び
+    :param out: 書き込み先の bool 配列（qa と同じ形状）
+    :return: 晴天なら True の bool 配列
+    """
+    lut = build_qa_lut(tuple(sorted(bits if bits is not None else preset_bits(preset))), mask_fill)
+    return np.take(lut, qa.astype(np.uint16, copy=False), out=out)
+
+
+def _scale(dn, scale, offset, out, nodata):
+    if out is None:
+        out = np.empty(dn.shape, dtype=np.float32)
+    missing = dn == nodata if nodata is not None else None
+    out[...] = dn
+    out *= np.float32(scale)
+    out += np.float32(offset)
+    if missing is not None:
+        out[missing] = np.nan
+    return out
+
+
+def scale_sr(dn, out=None, nodata=L2_NODATA):
+    """SR_B* の DN を反射率（float32）に変換する。out に dn 自身（float32）を渡せば in-place"""
+    return _scale(dn, SR_SCALE, SR_OFFSET, out, nodata)
+
+
+def scale_st(dn, out=None, nodata=L2_NODATA, celsius=True):
+    """ST_B10 の DN を地表面温度（float32, 既定は摂氏）に変換する。out に dn 自身を渡せば in-place"""
+    return _scale(dn, ST_SCALE, ST_OFFSET - (KELVIN_OFFSET if celsius else 0.0), out, nodata)
+
+
+def level2_band_sources(scene):
+    """
+    Level-2 シーンのバンド名 -> (ファイルパス, バンド番号) を求める
+    :param scene: バンド説明付きのマルチバンド GeoTIFF、または USGS 配布形式（*_SR_B4.TIF など）のフォルダ
+    """
+    if os.path.isfile(scene):
+        with rasterio.open(scene) as src:
+            return {d: (scene, i) for i, d in enumerate(src.descriptions, start=1) if d}
+    sources = {}
+    for path in sorted(glob(os.path.join(scene, '*.TIF')) + glob(os.path.join(scene, '*.tif'))):
+        m = re.search(r'_((?:SR_B\d)|(?:ST_B10)|(?:QA_PIXEL))\.tif$', path, re.IGNORECASE)
+        if m:
+            sources[m.group(1).upper()] = (path, 1)
+    return sources
+
+
+def scale_factors(tags, recorded=None):
+    """
+    GeoTIFF のタグ、またはエクスポート時に記録したスケール係数から SR / ST のスケール係数を求める
+    どちらにも無い場合は Collection 2 Level-2 の既定値
+    :param recorded: scene_catalog.load_scale_factors(エクスポート名) の辞書
+    :return: {'SR': (scale, offset), 'ST': (scale, offset)}（ST はケルビン）
+    """
+    factors = dict(recorded or {}, **{k: v for k, v in tags.items() if k in RAW_FACTOR_KEYS})
+    return {
+        'SR': (float(factors.get('SR_SCALE', SR_SCALE)), float(factors.get('SR_OFFSET', SR_OFFSET))),
+        'ST': (float(factors.get('ST_SCALE', ST_SCALE)), float(factors.get('ST_OFFSET', ST_OFFSET))),
+    }
+
+
+def export_name(scene):
+    """シーンのパスからエクスポート名を求める（Drive の分割ファイルの接尾辞 -0000000000-0000000000 は除く）"""
+    name = os.path.splitext(os.path.basename(os.path.normpath(scene)))[0]
+    return re.sub(r'-\d{10}-\d{10}$', '', name)
+
+
+def is_level2_raw(path):
+    """raw DN（uint16）の SR / ST と QA_PIXEL を含むマルチバンド GeoTIFF か"""
+    with rasterio.open(path) as src:
+        return QA_BAND in src.descriptions and src.dtypes[0] == 'uint16'
+
+
+class Level2Scene:
+    """
+    raw DN の Level-2 シーンを、読み込んだブロックだけスケール変換・クラウドマスクして返すリーダー
+    シーン全体の float 配列は作らず、read / read_bands を呼んだウィンドウの DN だけを変換する。
+    QA_PIXEL の判定は直前のウィンドウの結果を再利用する（同じウィンドウで複数バンドを読む場合に1回で済む）。
+    :param scene: level2_band_sources に渡すシーンのパス
+    :param preset: クラウドマスクのプリセット
+    :param mask: False の場合はクラウドマスクをしない（スケール変換のみ）
+    """
+
+    def __init__(self, scene, preset=DEFAULT_PRESET, mask=True):
+        self.scene = scene
+        self.sources = level2_band_sources(scene)
+        if mask and QA_BAND not in self.sources:
+            raise FileNotFoundError(f"バンドが見つかりません: {QA_BAND}（{scene}）")
+        if not self.sources:
+            raise FileNotFoundError(f"Level-2 のバンドが見つかりません: {scene}")
+        self.preset = preset
+        self.mask = mask
+        self._datasets = {}
+        self._clear = (None, None)
+        ref, _ = self._dataset(QA_BAND if QA_BAND in self.sources else next(iter(self.sources)))
+        self.crs, self.transform = ref.crs, ref.transform
+        self.width, self.height = ref.width, ref.height
+        self._profile = dict(ref.profile, dtype='float32', nodata=np.nan)
+        tags = ref.tags()
+        recorded = load_scale_factors(export_name(scene))
+        if not recorded and not any(k in tags for k in RAW_FACTOR_KEYS) and export_name(scene).endswith('_L2raw'):
+            print(f"スケール係数の記録がないため既定値を使います: {scene}")
+        self.factors = scale_factors(tags, recorded)
+
+    @property
+    def profile(self):
+        """スケール変換後（float32, 欠損は NaN）のデータの profile"""
+        return self._profile.copy()
+
+    @property
+    def descriptions(self):
+        return tuple(self.sources)
+
+    @property
+    def count(self):
+        return len(self.sources)
+
+    def _dataset(self, band):
+        path, index = self.sources[band]
+        if path not in self._datasets:
+            self._datasets[path] = rasterio.open(path)
+        return self._datasets[path], index
+
+    def _window(self, window):
+        return window if window is not None else Window(0, 0, self.width, self.height)
+
+    def clear(self, window=None):
+        """ウィンドウの晴天画素のマスク（True = 晴天）"""
+        window = self._window(window)
+        key = window.flatten()
+        if self._clear[0] != key:
+            ds, index = self._dataset(QA_BAND)
+            self._clear = (key, clear_mask(ds.read(index, window=window), self.preset))
+        return self._clear[1]
+
+    def read(self, band, window=None, out=None):
+        """
+        1バンドのウィンドウをスケール変換（・クラウドマスク）して float32 で返す
+        :param band: SR_B1〜SR_B7, ST_B10 / LST_Celsius（摂氏）, QA_PIXEL（DN のまま）
+        """
+        name = ST_BAND if band == LST_BAND_NAME else band
+        if name not in self.sources:
+            raise ValueError(f"バンドが見つかりません: {band}（{self.scene}）")
+        window = self._window(window)
+        ds, index = self._dataset(name)
+        dn = ds.read(index, window=window)
+        if name == QA_BAND:
+            return dn
+        if name == ST_BAND:
+            scale, offset = self.factors['ST']
+            offset -= KELVIN_OFFSET
+        else:
+            scale, offset = self.factors['SR']
+        out = _scale(dn, scale, offset, out, ds.nodata if ds.nodata is not None else L2_NODATA)
+        if self.mask:
+            out[~self.clear(window)] = np.nan
+        return out
+
+    def read_bands(self, bands, window=None, out=None):
+        """複数バンドのウィンドウを (バンド, 行, 列) の float32 で返す（QA_PIXEL の判定は1回）"""
+        window = self._window(window)
+        if out is None:
+            out = np.empty((len(bands), int(window.height), int(window.width)), dtype=np.float32)
+        for i, band in enumerate(bands):
+            self.read(band, window, out=out[i])
+        return out
+
+    def close(self):
+        for ds in self._datasets.values():
+            ds.close()
+        self._datasets = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def mask_and_scale_scene(scene, out_path, bands=None, preset=DEFAULT_PRESET, chunk_rows=CHUNK_ROWS, city=None,
+                         quantize=False):
+    """
+    Level-2 シーンにクラウドマスクとスケール変換を行い、float32 のマルチバンド GeoTIFF に保存する
+    （gee_landsat8_get_data の cloud_mask -> apply_scale_factors と同じ処理）
+    :param scene: level2_band_sources に渡すシーンのパス
+    :param out_path: 出力 GeoTIFF のパス
+    :param bands: 出力するバンド（None の場合は SR_B1〜SR_B7 と ST_B10）。ST_B10 は LST_Celsius として出力する
+    :param preset: クラウドマスクのプリセット
+    :param city: 指定した場合はその都市の ROI ウィンドウだけを処理し、ROI 外を NaN にする
+    :param quantize: True の場合は int16 に量子化して保存する（反射率 0.0001, LST 0.01 °C 刻み, nodata -32768）
+    :return: 晴天画素の割合
+    """
+    with Level2Scene(scene, preset) as l2:
+        bands = bands or [b for b in SR_BANDS + [ST_BAND] if b in l2.sources]
+        missing = [b for b in bands if b not in l2.sources]
+        if missing:
+            raise FileNotFoundError(f"バンドが見つかりません: {missing}（{scene}）")
+
+        roi = roi_for_dataset(l2, city) if city else None
+        window = roi.window if roi is not None else Window(0, 0, l2.width, l2.height)
+        col_off, row_off = int(window.col_off), int(window.row_off)
+        height, width = int(window.height), int(window.width)
+
+        profile = roi_profile(l2.profile, roi) if roi is not None else l2.profile
+        names = [LST_BAND_NAME if band == ST_BAND else band for band in bands]
+        if quantize:
+            profile = quantized_profile(profile, names)
+        else:
+            profile.update(dtype='float32', count=len(bands), nodata=np.nan)
+
+        buf = np.empty((min(chunk_rows, height), width), dtype=np.float32)
+        qbuf = np.empty((min(chunk_rows, height), width), dtype=np.int16) if quantize else None
+        n_clear = 0
+        n_total = 0
+        with open_cog(out_path, profile) as dst:
+            if quantize:
+                set_quantization(dst, names)
+            for i, name in enumerate(names, start=1):
+                dst.set_band_description(i, name)
+            for row in range(0, height, chunk_rows):
+                rows = min(chunk_rows, height - row)
+                win = Window(col_off, row_off + row, width, rows)
+                c = l2.clear(win)
+                if roi is not None:
+                    inside = roi.mask[row:row + rows]
+                    n_total += int(inside.sum())
+                    n_clear += int((c & inside).sum())
+                else:
+                    n_total += c.size
+                    n_clear += int(c.sum())
+                for i, band in enumerate(bands, start=1):
+                    out = l2.read(band, win, out=buf[:rows])
+                    if roi is not None:
+                        out[~inside] = np.nan
+                    if quantize:
+                        out = quantize_int16(out, *quantization(names[i - 1]), out=qbuf[:rows])
+                    dst.write(out, i, window=Window(0, row, width, rows))
+    return n_clear / n_total if n_total else 0.0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Level-2 シーンのクラウドマスクとスケール変換")
+    ap.add_argument("scene", type=str, help="マルチバンド GeoTIFF または USGS 配布形式のシーンフォルダ")
+    ap.add_argument("--out", type=str, required=True, help="出力 GeoTIFF")
+    ap.add_argument("--preset", type=str, default=DEFAULT_PRESET, choices=list(MASK_PRESETS),
+                    help="クラウドマスクのビットの組（スクリプト名）")
+    ap.add_argument("--bands", type=str, nargs='+', default=None, help="出力するバンド（既定: SR_B1〜SR_B7, ST_B10）")
+    ap.add_argument("--city", type=str, default=None, help="ROI ウィンドウだけを処理する都市名")
+    ap.add_argument("--quantize", action="store_true", help="int16 に量子化して保存する")
+    args = ap.parse_args()
+
+    ratio = mask_and_scale_scene(args.scene, args.out, args.bands, args.preset, city=args.city,
+                                 quantize=args.quantize)
+    print(f"保存しました: {args.out}（晴天画素率 {ratio:.3f}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+"""
+シーンごとの LST・指標 GeoTIFF を、チャンク分割した (時間 × 行 × 列) のデータキューブにまとめるモジュール
+
+1画素の時系列を取り出すために全シーンのファイルを開く代わりに、
+キューブのチャンク（既定 32シーン × 256 × 256 画素）だけを読む。
+点の時系列の問い合わせは触れるチャンク数（シーン数 / 32 個）に比例し、ファイル数には依存しない。
+
+- 構成（workspace/data/cube/Landsat8/{slug}/, slug は regions.py の都市名）
+cube.json              グリッド（CRS・変換行列・大きさ）、チャンク形状、変数名、時間軸（観測時刻・シーンID）
+{変数}/{t}_{y}_{x}.npy  チャンク（float32, 欠損は NaN）。np.load(mmap_mode='r') でメモリマップして読む
+                       compress=True で作成した場合は zlib 圧縮の .npz（読み込み時に展開）
+
+- 時間軸
+観測時刻はその都市のシーンカタログ（Region.catalog_path）の time_id -> time_start から取る。
+カタログに無いシーンはファイル名の YYYYMMdd_HHmmss（UTC）を使う。
+シーンは観測時刻順に並べる。キューブの最新時刻より古いシーン（後からダウンロードした再エクスポートなど）は
+時刻順の位置に挿入し、既にあるシーンのまだ取り込んでいない変数（後から計算した指標など）はその変数だけ書き込む。
+書き直すのは変更のあった最初の時間チャンク以降だけ（新しいシーンの追記は最後の時間チャンク以降）。
+取り込み済みの変数はシーンごとに cube.json の present に記録する。
+
+- 対象ファイル（workspace/data/geotiff/Landsat8 以下を再帰的に探す）
+LST : L8_{time_id}_{slug}_LST.tif（gee_landsat8_get_data.py のエクスポート）
+NDVI / NDWI / NDBI : L8_{time_id}_{slug}_Reflectance_{指標}.tif（calc_ref_bands.py の出力）
+                     または L8_{time_id}_{slug}_Reflectance_Indexes.tif（calc_ref_bands.py --quantize の int16 の3バンド）
+量子化した int16 のファイルは raster_io.read_band で float32 に戻して取り込む。
+すべて同じグリッド（同じ region・scale でエクスポートしたもの）であることを前提とする。
+
+- 使い方
+python workspace/src/lst_cube.py --ingest                                 # 新しいシーンを追記
+python workspace/src/lst_cube.py --ingest --region DaNang                 # ダナンのキューブ
+python workspace/src/lst_cube.py --point 105.85 21.03 --var LST           # 点の時系列
+python workspace/src/lst_cube.py --city "Hà Nội" --var LST --stat mean     # 都市内の平均の時系列
+"""
+
+import os
+import re
+import json
+import argparse
+import warnings
+from datetime import datetime, timezone
+from glob import glob
+
+import numpy as np
+import pandas as pd
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.transform import rowcol
+from rasterio.warp import transform as transform_coords
+from rasterio.windows import Window
+
+from roi_window import compute_roi, load_city_geometry
+from regions import get_region, DEFAULT_REGION
+from scene_catalog import SceneCatalog
+from raster_io import read_band
+from instrumentation import instrumented
+
+CUBE_FOLDER = 'workspace/data/cube/Landsat8'
+SOURCE_FOLDER = 'workspace/data/geotiff/Landsat8'
+CHUNKS = (32, 256, 256)  # (時間, 行, 列)
+VARIABLES = ['LST', 'NDVI', 'NDWI', 'NDBI']
+
+# ファイル名 -> (time_id, 変数名)（{slug} は都市名）
+SOURCE_PATTERN = r'^L8_(\d{{8}}_\d{{6}})_{slug}_(?:Reflectance_)?(LST|NDVI|NDWI|NDBI|Indexes)\.tif$'
+# 量子化した1ファイルに含まれる変数（calc_ref_bands.py --quantize）
+PACKED_VARIABLES = {'Indexes': ('NDVI', 'NDWI', 'NDBI')}
+
+
+def cube_folder(slug=DEFAULT_REGION):
+    """都市のキューブのフォルダ"""
+    return os.path.join(CUBE_FOLDER, slug)
+
+
+def find_sources(root=SOURCE_FOLDER, variables=VARIABLES, slug=DEFAULT_REGION):
+    """
+    root 以下の都市 slug のシーンごとの GeoTIFF を探す
+    :return: time_id -> {変数名: パス} の辞書
+    """
+    pattern = re.compile(SOURCE_PATTERN.format(slug=slug))
+    sources = {}
+    for path in glob(os.path.join(root, '**', '*.tif'), recursive=True):
+        m = pattern.match(os.path.basename(path))
+        if not m:
+            continue
+        for var in PACKED_VARIABLES.get(m.group(2), (m.group(2),)):
+            if var in variables:
+                # 変数ごとのファイルがあればそちらを優先する
+                scene = sources.setdefault(m.group(1), {})
+                if var not in scene or m.group(2) == var:
+                    scene[var] = path
+    return sources
+
+
+def catalog_times(catalog_path):
+    """シーンカタログの time_id -> (time_start, scene_id)（カタログが無ければ空）"""
+    if not os.path.exists(catalog_path):
+        return {}
+    with SceneCatalog(catalog_path) as catalog:
+        df = catalog.select()
+    return {row.time_id: (int(row.time_start), row.scene_id) for row in df.itertuples() if row.time_id}
+
+
+def time_id_to_millis(time_id):
+    dt = datetime.strptime(time_id, '%Y%m%d_%H%M%S').replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+class LstCube:
+    """
+    チャンク分割した (時間 × 行 × 列) のデータキューブ
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'cube.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.crs = CRS.from_wkt(self.meta['crs'])
+        self.transform = Affine(*self.meta['transform'])
+        self.height = self.meta['height']
+        self.width = self.meta['width']
+        self.chunks = tuple(self.meta['chunks'])
+        self.variables = self.meta['variables']
+
+    # --- 作成・追記 ---
+    @classmethod
+    def create(cls, path, template, variables=VARIABLES, chunks=CHUNKS, compress=False):
+        """
+        空のキューブを作成する
+        :param template: グリッドの基準にする GeoTIFF のパス
+        :param compress: True の場合はチャンクを圧縮（.npz）して保存する（メモリマップは使えない）
+        """
+        with rasterio.open(template) as src:
+            meta = {
+                'crs': src.crs.to_wkt(),
+                'transform': list(src.transform)[:6],
+                'height': src.height,
+                'width': src.width,
+            }
+        meta.update(chunks=list(chunks), variables=list(variables), compress=compress,
+                    time_start=[], scene_id=[], time_id=[], present={var: [] for var in variables})
+        os.makedirs(path, exist_ok=True)
+        for var in variables:
+            os.makedirs(os.path.join(path, var), exist_ok=True)
+        with open(os.path.join(path, 'cube.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        return cls(path)
+
+    def _save_meta(self):
+        tmp = os.path.join(self.path, 'cube.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.path, 'cube.json'))
+
+    def _chunk_path(self, var, t, y, x):
+        ext = 'npz' if self.meta.get('compress') else 'npy'
+        return os.path.join(self.path, var, f'{t}_{y}_{x}.{ext}')
+
+    def _load_chunk(self, var, t, y, x):
+        path = self._chunk_path(var, t, y, x)
+        if not os.path.exists(path):
+            return None
+        if self.meta.get('compress'):
+            with np.load(path) as z:
+                return z['data']
+        return np.load(path, mmap_mode='r')
+
+    def _save_chunk(self, var, t, y, x, data):
+        path = self._chunk_path(var, t, y, x)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            if self.meta.get('compress'):
+                np.savez_compressed(f, data=data)
+            else:
+                np.save(f, data)
+        os.replace(tmp, path)
+
+    @property
+    def size(self):
+        return len(self.meta['time_start'])
+
+    @property
+    def times(self):
+        return pd.to_datetime(self.meta['time_start'], unit='ms', utc=True)
+
+    def _present(self):
+        """変数 -> シーンごとの取り込み済みかどうか（present の無い従来のキューブは全シーン取り込み済みとみなす）"""
+        present = self.meta.get('present') or {}
+        return {var: list(present.get(var, [True] * self.size)) for var in self.variables}
+
+    def append(self, scenes):
+        """
+        シーンを観測時刻順の位置に追加する
+        キューブに既にあるシーン（time_id が同じ）は、まだ取り込んでいない変数のファイルだけを書き込む
+        :param scenes: (time_start, scene_id, time_id, {変数名: パス}) のリスト
+        :return: 追加したシーン数
+        """
+        present = self._present()
+        index = {time_id: i for i, time_id in enumerate(self.meta['time_id'])}
+        new, updates = [], {}
+        for time_start, scene_id, time_id, paths in scenes:
+            paths = {var: path for var, path in paths.items() if var in self.variables}
+            i = index.get(time_id)
+            if i is None:
+                new.append((time_start, scene_id, time_id, paths))
+                continue
+            missing = {var: path for var, path in paths.items() if not present[var][i]}
+            if missing:
+                updates[i] = missing
+        if not new and not updates:
+            return 0
+
+        # 新しい時間軸の各シーン: (time_start, scene_id, time_id, 旧インデックス（新規は None）, 読み込むファイル)
+        last = self.meta['time_start'][-1] if self.size else None
+        entries = [(t, s, tid, i, updates.get(i, {}))
+                   for i, (t, s, tid) in enumerate(zip(self.meta['time_start'], self.meta['scene_id'],
+                                                       self.meta['time_id']))]
+        entries += [(t, s, tid, None, paths) for t, s, tid, paths in sorted(new, key=lambda s: (s[0], s[2]))]
+        entries.sort(key=lambda e: e[0])  # 安定ソート（同じ時刻では既存のシーンが先）
+        first = min(j for j, e in enumerate(entries) if e[3] != j or e[4])
+        self._rewrite(entries, first)
+
+        updated = [(self.meta['time_id'][i], list(paths)) for i, paths in sorted(updates.items())]
+        for var in self.variables:
+            present[var] = [(e[3] is not None and present[var][e[3]]) or var in e[4] for e in entries]
+        self.meta.update(time_start=[int(e[0]) for e in entries], scene_id=[e[1] for e in entries],
+                         time_id=[e[2] for e in entries], present=present)
+        self._save_meta()
+
+        backfilled = [e[2] for e in new if last is not None and e[0] <= last]
+        if backfilled:
+            print(f"キューブの最新時刻より前のシーンを挿入しました: {', '.join(backfilled)}")
+        for time_id, variables in updated:
+            print(f"既存のシーンに変数を追加しました: {time_id}（{', '.join(variables)}）")
+        return len(new)
+
+    def _rewrite(self, entries, first):
+        """
+        新しい時間軸 entries のうち first 番目を含む時間チャンク以降を書き直す
+        挿入したシーンより後ろの既存のデータは後ろの時間チャンクへずれるため、最後の時間チャンクから順に
+        （ずれた先のチャンクを書く前に元のチャンクを読むように）書き込む
+        """
+        ct, cy, cx = self.chunks
+        n = len(entries)
+        for tc in range((n - 1) // ct, first // ct - 1, -1):
+            batch = entries[tc * ct:min((tc + 1) * ct, n)]
+            # 時間チャンク内の既存のシーンは旧時間軸でも連続している
+            old = [e[3] for e in batch if e[3] is not None]
+            for var in self.variables:
+                sources = [self._open_source(e[4][var]) if var in e[4] else None for e in batch]
+                try:
+                    # チャンク1行分（cy 行）ずつ読み込むため、メモリは 時間チャンク × cy × 幅 で済む
+                    for y in range(0, self.height, cy):
+                        rows = min(cy, self.height - y)
+                        slab = np.full((len(batch), rows, self.width), np.nan, dtype=np.float32)
+                        if old:
+                            prev = self.read(var, slice(old[0], old[-1] + 1), Window(0, y, self.width, rows))
+                            for k, e in enumerate(batch):
+                                if e[3] is not None:
+                                    slab[k] = prev[e[3] - old[0]]
+                        for k, src in enumerate(sources):
+                            if src is not None:
+                                self._read_rows(src, var, y, rows, slab[k])
+                        for x in range(0, self.width, cx):
+                            self._save_chunk(var, tc, y // cy, x // cx, np.ascontiguousarray(slab[:, :, x:x + cx]))
+                finally:
+                    for src in sources:
+                        if src is not None:
+                            src.close()
+
+    def _open_source(self, path):
+        src = rasterio.open(path)
+        if (src.width, src.height) != (self.width, self.height) or \
+                not src.transform.almost_equals(self.transform):
+            src.close()
+            raise ValueError(f"グリッドがキューブと一致しません: {path}")
+        return src
+
+    @staticmethod
+    def _read_rows(src, var, row, rows, out):
+        read_band(src, var, window=Window(0, row, src.width, rows), out=out)
+
+    # --- 読み出し ---
+    def read(self, var, time_slice=slice(None), window=None):
+        """
+        (時間, 行, 列) の範囲を読み出す
+        :param time_slice: 時間インデックスのスライス
+        :param window: rasterio の Window（None の場合は全体）
+        :return: float32 の3次元配列
+        """
+        if var not in self.variables:
+            raise ValueError(f"変数がありません: {var}（{', '.join(self.variables)}）")
+        t_lo, t_hi, _ = time_slice.indices(self.size)
+        if window is None:
+            window = Window(0, 0, self.width, self.height)
+        r0, c0 = int(window.row_off), int(window.col_off)
+        r1, c1 = r0 + int(window.height), c0 + int(window.width)
+        ct, cy, cx = self.chunks
+        out = np.full((max(t_hi - t_lo, 0), r1 - r0, c1 - c0), np.nan, dtype=np.float32)
+        for tc in range(t_lo // ct, (t_hi - 1) // ct + 1 if t_hi > t_lo else t_lo // ct):
+            for yc in range(r0 // cy, (r1 - 1) // cy + 1):
+                for xc in range(c0 // cx, (c1 - 1) // cx + 1):
+                    chunk = self._load_chunk(var, tc, yc, xc)
+                    if chunk is None:
+                        continue
+                    ts, te = max(t_lo, tc * ct), min(t_hi, tc * ct + chunk.shape[0])
+                    ys, ye = max(r0, yc * cy), min(r1, yc * cy + chunk.shape[1])
+                    xs, xe = max(c0, xc * cx), min(c1, xc * cx + chunk.shape[2])
+                    out[ts - t_lo:te - t_lo, ys - r0:ye - r0, xs - c0:xe - c0] = \
+                        chunk[ts - tc * ct:te - tc * ct, ys - yc * cy:ye - yc * cy, xs - xc * cx:xe - xc * cx]
+        return out
+
+    def time_slice(self, start=None, end=None):
+        """日付（YYYY-MM-DD, 両端を含む）の範囲に当たる時間インデックスのスライス"""
+        days = self.times.strftime('%Y-%m-%d')
+        lo = int(np.searchsorted(days, start, side='left')) if start else 0
+        hi = int(np.searchsorted(days, end, side='right')) if end else self.size
+        return slice(lo, hi)
+
+    def pixel_series(self, var, x, y, crs='EPSG:4326', start=None, end=None):
+        """
+        1画素の時系列
+        :param x, y: 座標（crs の座標系。既定は経度・緯度）
+        :return: 観測時刻をインデックスとする pandas.Series
+        """
+        xs, ys = transform_coords(crs, self.crs, [x], [y])
+        row, col = rowcol(self.transform, xs[0], ys[0])
+        if not (0 <= row < self.height and 0 <= col < self.width):
+            raise ValueError(f"座標がキューブの範囲外です: ({x}, {y})")
+        ts = self.time_slice(start, end)
+        values = self.read(var, ts, Window(col, row, 1, 1))[:, 0, 0]
+        return pd.Series(values, index=self.times[ts], name=var)
+
+    def polygon_series(self, var, geometry, crs='EPSG:4326', stat='mean', start=None, end=None):
+        """
+        ポリゴン内の画素を集計した時系列
+        :param geometry: GeoJSON 形式のジオメトリ
+        :param stat: 'mean' / 'median' / 'min' / 'max' / 'count'
+        """
+        roi = compute_roi(geometry, crs, self.crs, self.transform, self.width, self.height)
+        ts = self.time_slice(start, end)
+        values = self.read(var, ts, roi.window)[:, roi.mask]
+        reducers = {
+            'mean': np.nanmean, 'median': np.nanmedian, 'min': np.nanmin, 'max': np.nanmax,
+            'count': lambda v, axis: np.count_nonzero(~np.isnan(v), axis=axis),
+        }
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            series = reducers[stat](values, axis=1)
+        return pd.Series(series, index=self.times[ts], name=f'{var}_{stat}')
+
+    def date_map(self, var, date):
+        """
+        指定日（YYYY-MM-DD）のシーンの画像。同じ日に複数シーンある場合は平均する
+        :return: (2次元配列, 変換行列)
+        """
+        ts = self.time_slice(date, date)
+        if ts.start == ts.stop:
+            raise ValueError(f"この日のシーンがありません: {date}")
+        data = self.read(var, ts)
+        if data.shape[0] > 1:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                return np.nanmean(data, axis=0), self.transform
+        return data[0], self.transform
+
+
+@instrumented('cube')
+def ingest(cube_path=None, source_root=SOURCE_FOLDER, catalog_path=None,
+           variables=VARIABLES, chunks=CHUNKS, compress=False, region=DEFAULT_REGION):
+    """
+    source_root 以下の都市のシーンのうち、キューブに無いシーン・変数を追加する（キューブが無ければ作成）
+    :param cube_path: キューブのフォルダ（None の場合は cube_folder(slug)）
+    :param catalog_path: シーンカタログ（None の場合はその都市のカタログ）
+    :param region: 都市（regions.py の slug または名前）
+    :return: (キューブ, 追加したシーン数)
+    """
+    region = get_region(region)
+    cube_path = cube_path or cube_folder(region.slug)
+    catalog_path = catalog_path or region.catalog_path()
+    sources = find_sources(source_root, variables, region.slug)
+    if not sources:
+        raise FileNotFoundError(f"シーンが見つかりません: {source_root}")
+    times = catalog_times(catalog_path)
+    scenes = []
+    for time_id, paths in sources.items():
+        time_start, scene_id = times.get(time_id, (time_id_to_millis(time_id), time_id))
+        scenes.append((time_start, scene_id, time_id, paths))
+
+    if os.path.exists(os.path.join(cube_path, 'cube.json')):
+        cube = LstCube(cube_path)
+    else:
+        template = next(iter(sorted(scenes)[0][3].values()))
+        cube = LstCube.create(cube_path, template, variables, chunks, compress)
+    return cube, cube.append(scenes)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="LST・指標のデータキューブの作成と問い合わせ")
+    ap.add_argument("--region", type=str, default=DEFAULT_REGION, help="都市（regions.py の slug または名前）")
+    ap.add_argument("--cube", type=str, default=None, help="キューブのフォルダ（既定: workspace/data/cube/Landsat8/{slug}）")
+    ap.add_argument("--ingest", action="store_true", help="新しいシーンを追記する")
+    ap.add_argument("--source", type=str, default=SOURCE_FOLDER, help="シーンごとの GeoTIFF のフォルダ")
+    ap.add_argument("--catalog", type=str, default=None, help="シーンカタログ（既定: その都市のカタログ）")
+    ap.add_argument("--compress", action="store_true", help="チャンクを圧縮して保存する（新規作成時のみ）")
+    ap.add_argument("--var", type=str, default='LST', help="問い合わせる変数")
+    ap.add_argument("--point", type=float, nargs=2, metavar=('LON', 'LAT'), help="点の時系列")
+    ap.add_argument("--city", type=str, default=None, help="都市内を集計した時系列")
+    ap.add_argument("--stat", type=str, default='mean', help="--city の集計方法")
+    ap.add_argument("--start", type=str, default=None, help="開始日 YYYY-MM-DD")
+    ap.add_argument("--end", type=str, default=None, help="終了日 YYYY-MM-DD")
+    args = ap.parse_args()
+
+    cube_path = args.cube or cube_folder(get_region(args.region).slug)
+    if args.ingest:
+        cube, n = ingest(cube_path, args.source, args.catalog, compress=args.compress, region=args.region)
+        print(f"{n}シーンを追記しました（合計 {cube.size}シーン）: {cube_path}")
+    cube = LstCube(cube_path)
+    if args.point:
+        print(cube.pixel_series(args.var, *args.point, start=args.start, end=args.end).to_string())
+    if args.city:
+        geometry, crs = load_city_geometry(args.city)
+        print(cube.polygon_series(args.var, geometry, crs, args.stat, args.start, args.end).to_string())
+
+
+if __name__ == "__main__":
+    main()
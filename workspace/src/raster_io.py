@@ -0,0 +1,227 @@
+"""
+ラスタ（GeoTIFF）の書き出しを共通化するモジュール
+
+各スクリプトの出力を Cloud Optimized GeoTIFF（COG）で保存する。
+・内部タイル（既定 512×512）: ROI ウィンドウの読み込みは必要なタイルだけを展開する
+・圧縮: DEFLATE（既定）または ZSTD。浮動小数点は浮動小数点用の predictor（3）、整数は差分の predictor（2）
+・オーバービュー（1/2, 1/4, ... をタイル1枚の大きさになるまで）: 縮小表示・プレビューは低解像度の段だけを読む
+
+書き込み中はタイル分割した一時ファイル（{出力}.tmp.tif）へ通常の rasterio のデータセットとして書き、
+閉じるときに GDAL の COG ドライバでオーバービューを作って出力へコピーする（ブロック単位の逐次書き込みがそのまま使える）。
+
+- 使用例
+with open_cog(out_path, profile) as dst:        # profile は元データの profile（dtype・count などは update 済み）
+    dst.write(data, 1)
+
+write_cog(out_path, data, profile, descriptions=['NDVI'])
+preview = read_preview(out_path, max_size=1024)  # オーバービューから縮小画像を読む
+
+- int16 の量子化（任意の保存形式）
+指標・LST・反射率を int16 の整数値（値 = DN × scale + offset）で保存し、float32 の半分の容量にする。
+scale / offset はバンドごとに GeoTIFF の標準のメタデータ（GDAL の Scale / Offset）として、
+欠損は nodata = -32768 として記録する。read_band は量子化したファイルも float32（欠損は NaN）で返す。
+量子化の誤差は scale / 2 に float32 の丸め（量子化・復元とも float32 で計算するため、|値| × 2^-22 以下）を加えたもの（QUANTIZATION）:
+  NDVI / NDWI / NDBI : scale 0.0001（±3.2767 まで）、誤差 約 0.00005（|値| ≤ 1 で ≤ 0.00005 + 2.4e-7）
+  LST（°C）          : scale 0.01（±327.67 °C まで）、誤差 約 0.005 °C（|値| ≤ 100 °C で ≤ 0.005 + 2.4e-5 °C）
+  SR_B*（反射率）     : scale 0.0001（±3.2767 まで）、誤差 約 0.00005（|値| ≤ 2 で ≤ 0.00005 + 4.8e-7）
+範囲外の値は表せる最大・最小値に丸める。
+
+data = read_band(src, 'NDVI', window=window)    # バンド名または番号
+"""
+
+import os
+import contextlib
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.shutil import copy as copy_dataset
+
+COG_BLOCKSIZE = 512
+COG_COMPRESS = 'deflate'          # 'deflate' または 'zstd'
+OVERVIEW_RESAMPLING = 'average'
+# 一時ファイルは速度優先の軽い圧縮（出力は COG_COMPRESS で圧縮し直す）
+_TMP_OPTIONS = dict(tiled=True, blockxsize=COG_BLOCKSIZE, blockysize=COG_BLOCKSIZE, compress='deflate', zlevel=1,
+                    bigtiff='if_safer')
+# 元データの profile から引き継がない（COG の設定で置き換える）作成オプション
+_LAYOUT_KEYS = ('tiled', 'blockxsize', 'blockysize', 'compress', 'predictor', 'interleave', 'zlevel', 'zstd_level',
+                'photometric', 'bigtiff')
+
+
+def gtiff_profile(profile, blocksize=COG_BLOCKSIZE, **updates):
+    """元データの profile から、タイル分割した GeoTIFF の profile を作る"""
+    profile = {k: v for k, v in dict(profile, **updates).items() if k.lower() not in _LAYOUT_KEYS}
+    profile.update(_TMP_OPTIONS, driver='GTiff', blockxsize=blocksize, blockysize=blocksize)
+    return profile
+
+
+def cog_options(dtype, compress=COG_COMPRESS, blocksize=COG_BLOCKSIZE, overviews=True,
+                resampling=OVERVIEW_RESAMPLING):
+    """GDAL の COG ドライバの作成オプション"""
+    options = dict(COMPRESS=compress.upper(), BLOCKSIZE=blocksize, BIGTIFF='IF_SAFER',
+                   OVERVIEWS='AUTO' if overviews else 'NONE', OVERVIEW_RESAMPLING=resampling.upper())
+    # 浮動小数点は predictor=3、整数は predictor=2（YES で GDAL が型に応じて選ぶ）
+    if np.dtype(dtype).kind in 'fiu':
+        options['PREDICTOR'] = 'YES'
+    if compress.lower() == 'deflate':
+        options['LEVEL'] = 6
+    return options
+
+
+@contextlib.contextmanager
+def open_cog(path, profile, compress=COG_COMPRESS, blocksize=COG_BLOCKSIZE, overviews=True,
+             resampling=OVERVIEW_RESAMPLING, **updates):
+    """
+    COG を書き出すためのデータセットを開く（with を抜けると COG に変換して path に保存する）
+    :param profile: 出力の profile（driver・タイル・圧縮の設定は置き換える）
+    :param overviews: オーバービューを作るか
+    :param updates: profile への追加の設定（dtype, count, nodata など）
+    """
+    profile = gtiff_profile(profile, blocksize, **updates)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp.tif'
+    try:
+        with rasterio.open(tmp_path, 'w', **profile) as dst:
+            yield dst
+        copy_dataset(tmp_path, path, driver='COG',
+                     **cog_options(profile['dtype'], compress, blocksize, overviews, resampling))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_cog(path, data, profile, descriptions=None, tags=None, **kwargs):
+    """
+    配列（2次元 = 1バンド, 3次元 = (バンド, 行, 列)）を COG で保存する
+    :param descriptions: バンド名のリスト
+    :param tags: データセットのタグ（メタデータ）
+    :param kwargs: open_cog の引数（compress, overviews, nodata など）
+    """
+    data = data[np.newaxis] if data.ndim == 2 else data
+    kwargs.setdefault('dtype', data.dtype.name)
+    with open_cog(path, profile, count=data.shape[0], **kwargs) as dst:
+        dst.write(data)
+        for i, name in enumerate(descriptions or [], start=1):
+            dst.set_band_description(i, name)
+        if tags:
+            dst.update_tags(**tags)
+    return path
+
+
+def read_preview(path, max_size=1024, indexes=None, masked=False):
+    """
+    長辺が max_size 以下になるように縮小して読み込む（COG の場合はオーバービューの段だけを読む）
+    :param indexes: バンド番号（None の場合は全バンド）
+    :return: (配列, 縮小後の transform)
+    """
+    with rasterio.open(path) as src:
+        factor = max(1, int(np.ceil(max(src.width, src.height) / max_size)))
+        height, width = max(1, src.height // factor), max(1, src.width // factor)
+        count = 1 if isinstance(indexes, int) else len(indexes) if indexes else src.count
+        shape = (height, width) if isinstance(indexes, int) else (count, height, width)
+        data = src.read(indexes, out_shape=shape, masked=masked, resampling=Resampling.average)
+        transform = src.transform * src.transform.scale(src.width / width, src.height / height)
+    return data, transform
+
+# --------------------
+# int16 の量子化
+# --------------------
+INT16_NODATA = -32768
+INT16_MAX = 32767
+# 変数 -> (scale, offset)（値 = DN × scale + offset）
+QUANTIZATION = {
+    'NDVI': (0.0001, 0.0),
+    'NDWI': (0.0001, 0.0),
+    'NDBI': (0.0001, 0.0),
+    'LST': (0.01, 0.0),
+    'LST_Celsius': (0.01, 0.0),
+    'SR': (0.0001, 0.0),
+}
+
+
+def quantization(name):
+    """変数名（SR_B1 などは 'SR'）の (scale, offset)"""
+    key = 'SR' if name.startswith('SR_B') else name
+    if key not in QUANTIZATION:
+        raise ValueError(f"量子化の設定がありません: {name}（{', '.join(QUANTIZATION)}）")
+    return QUANTIZATION[key]
+
+
+def quantize(data, scale, offset=0.0, out=None):
+    """float 配列を int16 に量子化する（NaN は INT16_NODATA、範囲外は ±INT16_MAX に丸める）"""
+    q = np.rint((data - offset) / scale)
+    np.clip(q, -INT16_MAX, INT16_MAX, out=q)
+    q[np.isnan(data)] = INT16_NODATA
+    if out is None:
+        return q.astype(np.int16)
+    out[...] = q
+    return out
+
+
+def dequantize(q, scale, offset=0.0, nodata=INT16_NODATA, out=None):
+    """int16 配列を float32 に戻す（nodata は NaN）"""
+    out = np.multiply(q, np.float32(scale), out=out, dtype=np.float32)
+    if offset:
+        out += np.float32(offset)
+    if nodata is not None:
+        out[q == nodata] = np.nan
+    return out
+
+
+def quantized_profile(profile, names, **updates):
+    """量子化した int16 の出力の profile（バンド数は names の数）"""
+    return dict(profile, dtype='int16', count=len(names), nodata=INT16_NODATA, **updates)
+
+
+def set_quantization(dst, names):
+    """出力データセットにバンド名と scale / offset を設定する"""
+    specs = [quantization(name) for name in names]
+    dst.scales = [s for s, _ in specs]
+    dst.offsets = [o for _, o in specs]
+    for i, name in enumerate(names, start=1):
+        dst.set_band_description(i, name)
+
+
+def write_quantized(path, bands, profile, **kwargs):
+    """
+    複数の変数を int16 に量子化して1つのマルチバンド COG に保存する
+    :param bands: 変数名 -> float 配列（2次元）の辞書（バンドはこの順）
+    :param kwargs: open_cog の引数
+    """
+    names = list(bands)
+    with open_cog(path, quantized_profile(profile, names), **kwargs) as dst:
+        set_quantization(dst, names)
+        for i, name in enumerate(names, start=1):
+            dst.write(quantize(bands[name], *quantization(name)), i)
+    return path
+
+
+def band_index(src, band):
+    """バンド番号またはバンド名（description）からバンド番号を返す（1バンドのファイルは名前に関わらず 1）"""
+    if isinstance(band, int):
+        return band
+    if band in src.descriptions:
+        return src.descriptions.index(band) + 1
+    if src.count == 1:
+        return 1
+    raise ValueError(f"バンドが見つかりません: {band}（{src.name}: {src.descriptions}）")
+
+
+def read_band(src, band=1, window=None, out=None):
+    """
+    1バンドを float32（欠損は NaN）で読み込む。int16 に量子化したバンドは scale / offset で値に戻す
+    :param band: バンド番号またはバンド名
+    :param out: 出力先の float32 配列（None の場合は新たに確保）
+    """
+    index = band_index(src, band)
+    scale, offset = src.scales[index - 1], src.offsets[index - 1]
+    nodata = src.nodata
+    if np.dtype(src.dtypes[index - 1]).kind in 'iu' and (scale, offset) != (1.0, 0.0):
+        return dequantize(src.read(index, window=window), scale, offset, nodata, out=out)
+    if out is None:
+        out = src.read(index, window=window, out_dtype=np.float32)
+    else:
+        src.read(index, window=window, out=out)
+    if nodata is not None and not np.isnan(nodata):
+        out[out == nodata] = np.nan
+    return out
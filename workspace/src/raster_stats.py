@@ -0,0 +1,185 @@
+"""
+ラスタの統計量を1パスで逐次計算するためのモジュール
+
+・件数・最小・最大・平均・標準偏差は Chan らの方法でブロックごとに合成する
+・パーセンタイルは固定ビンのヒストグラムから線形補間で近似する
+  （全画素のソートを行わないため、フル解像度のラスタでもメモリはビン数で決まる）
+・同じ値域・ビン数の StreamingStats どうしは merge() で合成できるため、
+  ブロック・シーン・ワーカーごとに計算した結果を後からまとめられる
+
+- 近似精度
+パーセンタイルの誤差はビン幅（(上限 - 下限) / ビン数）以内。
+例: 指標（-1〜1, 4096ビン）で約0.0005、LST（-50〜100 °C, 4096ビン）で約0.04 °C。
+値域外の画素は下限側・上限側のビンにまとめて数え、その範囲のパーセンタイルは最小値・最大値を返す。
+
+- 使用例
+stats = StreamingStats(INDEX_RANGE)
+for block in blocks:
+    stats.update(block)
+print(stats.to_dict(prefix='NDVI_'))
+"""
+
+import numpy as np
+import rasterio
+from rasterio.errors import WindowError
+
+from roi_window import roi_for_dataset
+
+# GEE_landsat8_BT.reduce_stats と同じパーセンタイル
+DEFAULT_PERCENTILES = (2, 5, 25, 50, 75, 95, 98)
+
+# ヒストグラムの値域の既定値
+INDEX_RANGE = (-1.0, 1.0)      # 正規化差分指標
+LST_RANGE = (-50.0, 100.0)     # 地表面温度・輝度温度（°C）
+REFLECTANCE_RANGE = (-0.2, 1.6)  # SR_B* のスケール後反射率（DN 0〜65535 に相当）
+DEFAULT_BINS = 4096
+
+
+class StreamingStats:
+    """
+    件数・最小・最大・平均・標準偏差・近似パーセンタイルを逐次計算するクラス
+    :param value_range: ヒストグラムの値域 (下限, 上限)。上限ちょうどの値は上限側に数える
+    :param bins: ヒストグラムのビン数
+    """
+
+    def __init__(self, value_range=INDEX_RANGE, bins=DEFAULT_BINS):
+        self.lo, self.hi = float(value_range[0]), float(value_range[1])
+        if not self.hi > self.lo:
+            raise ValueError(f"値域が不正です: {value_range}")
+        self.bins = int(bins)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # 偏差平方和
+        self.min = np.inf
+        self.max = -np.inf
+        # [下限未満, ビン0, ..., ビンN-1, 上限以上]
+        self.hist = np.zeros(self.bins + 2, dtype=np.int64)
+
+    def _combine(self, n, mean, m2, vmin, vmax):
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+        self.min = min(self.min, vmin)
+        self.max = max(self.max, vmax)
+
+    def update(self, values):
+        """
+        値の配列（ブロック）を取り込む。NaN・inf は無視する
+        :param values: 任意形状の数値配列
+        :return: self
+        """
+        v = np.asarray(values).ravel()
+        if v.dtype.kind == 'f':
+            v = v[np.isfinite(v)]
+        n = v.size
+        if n == 0:
+            return self
+
+        v = v.astype(np.float64, copy=False)
+        block_mean = float(v.mean())
+        work = v - block_mean
+        block_m2 = float(np.dot(work, work))
+        self._combine(n, block_mean, block_m2, float(v.min()), float(v.max()))
+
+        # ヒストグラム（作業配列を再利用してビン番号を計算）
+        np.subtract(v, self.lo, out=work)
+        work *= self.bins / (self.hi - self.lo)
+        np.floor(work, out=work)
+        np.clip(work, -1, self.bins, out=work)
+        work += 1
+        self.hist += np.bincount(work.astype(np.intp), minlength=self.bins + 2)
+        return self
+
+    def merge(self, other):
+        """
+        他の StreamingStats を合成する（値域・ビン数が同じであること）
+        :return: self
+        """
+        if (self.lo, self.hi, self.bins) != (other.lo, other.hi, other.bins):
+            raise ValueError("値域またはビン数が異なる StreamingStats は合成できません")
+        if other.count == 0:
+            return self
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        self.hist += other.hist
+        return self
+
+    @property
+    def std(self):
+        """母標準偏差（np.std と同じ ddof=0）"""
+        if self.count == 0:
+            return np.nan
+        return float(np.sqrt(self.m2 / self.count))
+
+    def percentile(self, q):
+        """
+        ヒストグラムから q パーセンタイル（0〜100）を近似する
+        """
+        if self.count == 0:
+            return np.nan
+        target = q / 100.0 * self.count
+        cum = np.cumsum(self.hist)
+        b = int(np.searchsorted(cum, target, side='left'))
+        b = min(b, self.bins + 1)
+        if b == 0:
+            return self.min
+        if b == self.bins + 1:
+            return self.max
+        width = (self.hi - self.lo) / self.bins
+        before = cum[b - 1]
+        frac = (target - before) / self.hist[b] if self.hist[b] > 0 else 0.0
+        value = self.lo + (b - 1 + frac) * width
+        return float(min(max(value, self.min), self.max))
+
+    def to_dict(self, prefix='', percentiles=DEFAULT_PERCENTILES):
+        """
+        統計量を辞書で返す（キー: {prefix}count, min, max, mean, std, p2 ...）
+        """
+        empty = self.count == 0
+        result = {
+            f'{prefix}count': self.count,
+            f'{prefix}min': np.nan if empty else self.min,
+            f'{prefix}max': np.nan if empty else self.max,
+            f'{prefix}mean': np.nan if empty else self.mean,
+            f'{prefix}std': self.std,
+        }
+        for q in percentiles:
+            result[f'{prefix}p{q:g}'] = self.percentile(q)
+        return result
+
+
+def stream_raster_stats(path, band=1, value_range=INDEX_RANGE, bins=DEFAULT_BINS, valid=None, city=None):
+    """
+    GeoTIFFを内部ブロック（block_windows）単位で読み込み、StreamingStats を計算する関数
+    :param path: GeoTIFFのパス
+    :param band: バンド番号（1始まり）
+    :param value_range: ヒストグラムの値域
+    :param bins: ヒストグラムのビン数
+    :param valid: ブロックを受け取り有効画素の真偽配列を返す関数（例: lambda b: b > 0）
+    :param city: 指定した場合はその都市の ROI ウィンドウと重なるブロックだけを読み込み、ROI 内の画素だけを集計する
+    :return: StreamingStats
+    """
+    stats = StreamingStats(value_range, bins)
+    with rasterio.open(path) as src:
+        nodata = src.nodata
+        roi = roi_for_dataset(src, city) if city else None
+        for _, window in src.block_windows(band):
+            if roi is not None:
+                try:
+                    window = window.intersection(roi.window)
+                except WindowError:
+                    continue
+            block = src.read(band, window=window)
+            mask = None
+            if nodata is not None and not np.isnan(nodata):
+                mask = block != nodata
+            if roi is not None:
+                r0 = int(window.row_off - roi.window.row_off)
+                c0 = int(window.col_off - roi.window.col_off)
+                inside = roi.mask[r0:r0 + block.shape[0], c0:c0 + block.shape[1]]
+                mask = inside if mask is None else (mask & inside)
+            if valid is not None:
+                mask = valid(block) if mask is None else (mask & valid(block))
+            stats.update(block if mask is None else block[mask])
+    return stats
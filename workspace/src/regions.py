@@ -0,0 +1,77 @@
+"""
+研究対象都市（リージョン）の設定
+
+各 GEE スクリプトの docstring に列挙している5都市を1か所で定義する。
+都市を追加する場合はここに1行追加すればよい（スクリプトを複製しない）。
+
+・name      : 行政区画シェープファイル（研究対象都市_行政区画.shp）の TinhThanh 列の値
+・gaul_name : GEE の FAO/GAUL/2015 での名前（ADM2_NAME / ADM1_NAME）
+・slug      : ファイル名・エクスポート名に使う英字名（例: L8_{time}_Hanoi_LST）
+・bbox      : 概略の範囲 [西, 南, 東, 北]（docstring の ROI と同じ）
+・label     : 表示用の名前
+"""
+
+import os
+import unicodedata
+from collections import OrderedDict
+
+from scene_catalog import CATALOG_PATH
+
+
+class Region:
+    """研究対象都市1つ分の設定"""
+
+    def __init__(self, name, gaul_name, slug, bbox, label):
+        self.name = name
+        self.gaul_name = gaul_name
+        self.slug = slug
+        self.bbox = bbox
+        self.label = label
+
+    def catalog_path(self, base=CATALOG_PATH):
+        """シーンカタログのパス（ハノイは従来のカタログをそのまま使い、他の都市は _{slug} を付ける）"""
+        if self.slug == DEFAULT_REGION:
+            return base
+        root, ext = os.path.splitext(base)
+        return f'{root}_{self.slug}{ext}'
+
+    def __repr__(self):
+        return f"Region({self.slug})"
+
+
+REGIONS = OrderedDict((r.slug, r) for r in [
+    Region('Hà Nội', 'Ha Noi', 'Hanoi', [105.27, 20.55, 106.03, 21.40], 'ハノイ'),
+    Region('TP. Hồ Chí Minh', 'Ho Chi Minh city', 'HoChiMinh', [106.60, 10.75, 106.85, 10.95], 'ホーチミン'),
+    Region('Đà Nẵng', 'Da Nang City', 'DaNang', [108.20, 16.00, 108.40, 16.20], 'ダナン'),
+    Region('Hải Phòng', 'Hai Phong', 'HaiPhong', [106.70, 20.80, 106.90, 21.00], 'ハイフォン'),
+    Region('Cần Thơ', 'Can Tho', 'CanTho', [105.80, 10.00, 106.00, 10.20], 'カントー'),
+])
+DEFAULT_REGION = 'Hanoi'
+
+
+def _fold(text):
+    """比較用にダイアクリティカルマーク・空白・記号を除いて小文字にする（'Hà Nội' -> 'hanoi'）"""
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    text = ''.join(c for c in unicodedata.normalize('NFD', text) if not unicodedata.combining(c))
+    return ''.join(c for c in text.lower() if c.isalnum())
+
+
+def get_region(key=DEFAULT_REGION):
+    """
+    slug・シェープファイルの名前・GAUL の名前・表示名のいずれかから Region を返す
+    例: 'Hanoi', 'Hà Nội', 'Ha Noi', 'ハノイ'
+    """
+    if isinstance(key, Region):
+        return key
+    folded = _fold(key)
+    for region in REGIONS.values():
+        if folded in (_fold(region.slug), _fold(region.name), _fold(region.gaul_name), _fold(region.label)):
+            return region
+    raise ValueError(f"不明な都市: {key}（{', '.join(REGIONS)}）")
+
+
+def select_regions(keys=None):
+    """都市の指定（None または 'all' で全都市）を Region のリストにする"""
+    if not keys or list(keys) == ['all']:
+        return list(REGIONS.values())
+    return [get_region(k) for k in keys]
@@ -0,0 +1,155 @@
+"""
+研究対象領域（ROI）でラスタを切り出すための共通モジュール
+
+研究対象都市の行政区画シェープファイルから都市（TinhThanh 列）のジオメトリを取り出し、
+任意のラスタグリッドに対して
+・ROI の外接矩形に相当するピクセルウィンドウ
+・ウィンドウ内の ROI マスク（True = ROI 内）
+を求める。各ステージはこのウィンドウだけを読み込めばよい。
+
+ラスタストライプ（CRS・変換行列・サイズ）ごとの結果はプロセス内と
+ディスク（workspace/data/cache/roi/*.npz）にキャッシュし、同じグリッドの2シーン目以降は再計算しない。
+
+- 使用例
+with rasterio.open(path) as src:
+    roi = roi_for_dataset(src, 'Hà Nội')
+    data = src.read(1, window=roi.window)
+    data[~roi.mask] = np.nan
+"""
+
+import os
+import hashlib
+from functools import lru_cache
+
+import numpy as np
+import rasterio
+from rasterio.features import geometry_mask
+from rasterio.warp import transform_geom
+from rasterio.windows import Window, from_bounds
+
+ROI_SHP_PATH = 'workspace/data/SHP/研究対象領域/研究対象都市_行政区画.shp'
+CITY_FIELD = 'TinhThanh'
+DEFAULT_CITY = 'Hà Nội'
+ROI_CACHE_DIR = 'workspace/data/cache/roi'
+
+
+class Roi:
+    """
+    あるラスタグリッド上の ROI
+    :param window: ROI の外接矩形に相当するピクセルウィンドウ
+    :param mask: ウィンドウと同じ形状の真偽配列（True = ROI 内）
+    :param transform: ウィンドウの変換行列
+    """
+
+    def __init__(self, window, mask, transform):
+        self.window = window
+        self.mask = mask
+        self.transform = transform
+
+    @property
+    def fraction(self):
+        """ウィンドウ内で ROI に含まれる画素の割合"""
+        return float(self.mask.mean()) if self.mask.size else 0.0
+
+
+@lru_cache(maxsize=None)
+def load_city_geometry(city=DEFAULT_CITY, shp_path=ROI_SHP_PATH, field=CITY_FIELD):
+    """
+    シェープファイルから都市のジオメトリを取り出す関数
+    :return: (GeoJSON 形式のジオメトリ, CRS の文字列)
+    """
+    import geopandas as gpd
+
+    boundary_df = gpd.read_file(shp_path)
+    selected = boundary_df[boundary_df[field] == city]
+    if selected.empty:
+        raise ValueError(f"シェープファイルに {field}={city} がありません: {shp_path}")
+    geom = selected.geometry.union_all() if hasattr(selected.geometry, 'union_all') else selected.unary_union
+    return geom.__geo_interface__, boundary_df.crs.to_string()
+
+
+def grid_key(crs, transform, width, height):
+    """ラスタグリッド（CRS・変換行列・サイズ）を表すハッシュ文字列"""
+    crs_text = crs.to_wkt() if hasattr(crs, 'to_wkt') else str(crs)
+    text = f"{crs_text}|{tuple(transform)[:6]}|{width}x{height}"
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def compute_roi(geometry, geometry_crs, crs, transform, width, height, all_touched=True):
+    """
+    ジオメトリをラスタグリッドに投影し、Roi を計算する関数
+    ROI がラスタ範囲と重ならない場合は ValueError
+    """
+    geom = transform_geom(geometry_crs, crs, geometry) if geometry_crs != crs else geometry
+    xs, ys = _coords(geom)
+    window = from_bounds(min(xs), min(ys), max(xs), max(ys), transform)
+    window = window.round_offsets(op='floor').round_lengths(op='ceil')
+    try:
+        window = window.intersection(Window(0, 0, width, height))
+    except rasterio.errors.WindowError:
+        raise ValueError("ROI がラスタの範囲と重なりません")
+
+    win_transform = rasterio.windows.transform(window, transform)
+    mask = geometry_mask([geom], out_shape=(int(window.height), int(window.width)),
+                         transform=win_transform, invert=True, all_touched=all_touched)
+    return Roi(window, mask, win_transform)
+
+
+def _coords(geom):
+    """GeoJSON ジオメトリの全頂点の x, y 座標"""
+    coords = np.asarray(_flatten(geom['coordinates']), dtype=np.float64).reshape(-1, 2)
+    return coords[:, 0], coords[:, 1]
+
+
+def _flatten(coords):
+    if isinstance(coords[0], (int, float)):
+        return [coords[0], coords[1]]
+    out = []
+    for c in coords:
+        out.extend(_flatten(c))
+    return out
+
+
+_ROI_CACHE = {}
+
+
+def roi_for_grid(crs, transform, width, height, city=DEFAULT_CITY, cache_dir=ROI_CACHE_DIR):
+    """
+    ラスタグリッドに対する都市の Roi を返す関数（プロセス内・ディスクにキャッシュ）
+    :param cache_dir: ディスクキャッシュのフォルダ（None の場合はディスクに保存しない）
+    """
+    key = f"{grid_key(crs, transform, width, height)}_{hashlib.sha1(city.encode('utf-8')).hexdigest()[:8]}"
+    if key in _ROI_CACHE:
+        return _ROI_CACHE[key]
+
+    cache_path = os.path.join(cache_dir, f"{key}.npz") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        with np.load(cache_path) as z:
+            col_off, row_off, w, h = (int(v) for v in z['window'])
+            mask = np.unpackbits(z['mask'], count=w * h).reshape(h, w).astype(bool)
+        window = Window(col_off, row_off, w, h)
+        roi = Roi(window, mask, rasterio.windows.transform(window, transform))
+    else:
+        geometry, geometry_crs = load_city_geometry(city)
+        roi = compute_roi(geometry, geometry_crs, crs, transform, width, height)
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            w = roi.window
+            np.savez_compressed(cache_path,
+                                window=np.array([w.col_off, w.row_off, w.width, w.height], dtype=np.int64),
+                                mask=np.packbits(roi.mask.ravel()))
+
+    _ROI_CACHE[key] = roi
+    return roi
+
+
+def roi_for_dataset(src, city=DEFAULT_CITY, cache_dir=ROI_CACHE_DIR):
+    """開いている rasterio データセットに対する都市の Roi を返す関数"""
+    return roi_for_grid(src.crs, src.transform, src.width, src.height, city, cache_dir)
+
+
+def roi_profile(profile, roi):
+    """元のプロファイルをウィンドウのサイズ・変換行列に合わせて更新したコピーを返す関数"""
+    out = profile.copy()
+    out.update(width=int(roi.window.width), height=int(roi.window.height), transform=roi.transform)
+    return out
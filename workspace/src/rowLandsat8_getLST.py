@@ -6,19 +6,38 @@ Landsat 8 (Collection 2, Tier 1, Level-1) の Band10 と MTL.txt から
 輝度温度（BT, °C）の GeoTIFF を作る最小構成スクリプト。
 
 【使い方】
+python workspace/src/rowLandsat8_getLST.py --dir <シーンフォルダ> --out L8_B10_BT_C.tif
+  --method lut    : DN(uint16) 65536 通りの BT(°C) 表を一度だけ作り、画素は表引きで変換（既定）
+  --method direct : 従来通り float64 で Radiance → BT を画素ごとに計算
 
+python workspace/src/rowLandsat8_getLST.py --batch-root workspace/data/geotiff/Landsat8/level1_Landsat8 --workers 4
+  フォルダ以下の全シーン（*_MTL.txt と *_B10.TIF の組）を並列に変換する（バッチモード）
+  - MTL の定数は <batch-root>/mtl_cache.json にシーンID・更新時刻つきでキャッシュする
+  - 出力が入力（B10/MTL）より新しく、同じ --method / --city で作ったもの（出力のタグ BT_METHOD / BT_CITY）
+    であればスキップする（--force で再計算）
+
+--city 'Hà Nội' を付けると研究対象都市の ROI ウィンドウだけを読み込み、ROI 外は NaN として出力する
 
 【出力】
-- L8_B10_BT_C.tif（輝度温度, °C, float32, NaN=nodata）
+- L8_B10_BT_C.tif（輝度温度, °C, float32, NaN=nodata, Cloud Optimized GeoTIFF）
+- バッチモード: {シーンID}_BT_C.tif（--out-dir 未指定時はシーンフォルダ内）
 """
 
 import os
 import re
+import json
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import rasterio
 
+from roi_window import roi_for_dataset, roi_profile
+from instrumentation import stage
+from raster_io import write_cog
+
 DIR = "workspace/data/geotiff/Landsat8/level1_Landsat8"
+MTL_CACHE_NAME = "mtl_cache.json"
+BT_KEYS = ("RADIANCE_MULT_BAND_10", "RADIANCE_ADD_BAND_10", "K1_CONSTANT_BAND_10", "K2_CONSTANT_BAND_10")
 
 # --------------------
 # MTL パーサ（KEY = VALUE をざっくり辞書化）
@@ -44,6 +63,48 @@ def parse_mtl(filepath: str) -> dict:
             kv[k] = v
     return kv
 
+def read_bt_constants(mtl_path: str) -> tuple:
+    """MTL から BT 計算に必要な定数 (MULT, ADD, K1, K2) を読み取る"""
+    mtl = parse_mtl(mtl_path)
+    try:
+        return tuple(float(mtl[k]) for k in BT_KEYS)
+    except KeyError as e:
+        raise KeyError(f"MTL に必要なキーが見つかりません: {e}")
+
+class MtlCache:
+    """
+    MTL の定数を JSON ファイルにキャッシュするクラス
+    キーはシーンID（*_MTL.txt のファイル名部分）、MTL の更新時刻が変わっていれば再パースする
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+
+    def get(self, mtl_path: str) -> tuple:
+        scene_id = scene_id_from_mtl(mtl_path)
+        mtime = os.path.getmtime(mtl_path)
+        entry = self.entries.get(scene_id)
+        if entry is None or entry["mtime"] != mtime:
+            MULT, ADD, K1, K2 = read_bt_constants(mtl_path)
+            entry = {"mtime": mtime, "MULT": MULT, "ADD": ADD, "K1": K1, "K2": K2}
+            self.entries[scene_id] = entry
+            self.dirty = True
+        return entry["MULT"], entry["ADD"], entry["K1"], entry["K2"]
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
 # --------------------
 # 計算ユーティリティ
 # --------------------
@@ -58,6 +119,49 @@ def radiance_to_btK(TOA: np.ndarray, K1: float, K2: float) -> np.ndarray:
     out[valid] = K2 / np.log((K1 / TOA[valid]) + 1.0)
     return out
 
+def build_bt_lut(MULT: float, AL: float, K1: float, K2: float, nodata=None) -> np.ndarray:
+    """
+    DN(uint16) の全 65536 値に対する BT(°C) の変換表（float32）を作る。
+    係数はシーンごとに一定なので、画素ごとの対数計算を表引き1回に置き換えられる。
+    Radiance <= 0 となる DN と NoData の DN は NaN。
+    """
+    dn = np.arange(65536, dtype="float64")
+    btK = radiance_to_btK(calc_TOA(dn, MULT, AL), K1, K2)
+    lut = (btK - 273.15).astype("float32")
+    if nodata is not None and float(nodata).is_integer() and 0 <= nodata < lut.size:
+        lut[int(nodata)] = np.nan
+    return lut
+
+def dn_to_btC_direct(dn: np.ndarray, nodata, MULT: float, ADD: float, K1: float, K2: float) -> np.ndarray:
+    """DN から BT(°C, float32) を画素ごとに計算する（従来方式）"""
+    dn = dn.astype("float64")
+
+    # マスク（NoData）
+    mask = np.zeros_like(dn, dtype=bool)
+    if nodata is not None:
+        mask |= (dn == nodata)
+
+    # DN -> Radiance
+    L10 = calc_TOA(dn, MULT, ADD)
+    mask |= (L10 <= 0)  # 物理的に不正な画素も除外
+
+    # Radiance -> BT (K) -> BT (°C)
+    btK = radiance_to_btK(L10, K1, K2)
+    btK[mask] = np.nan
+    btC = btK - 273.15
+    return btC.astype("float32")
+
+def dn_to_btC(dn: np.ndarray, nodata, MULT: float, ADD: float, K1: float, K2: float, method: str = "lut") -> np.ndarray:
+    """
+    DN から BT(°C, float32) を求める。
+    method="lut" かつ DN が uint16/uint8 の場合は変換表の gather 1回で変換し、
+    それ以外は dn_to_btC_direct にフォールバックする。
+    """
+    if method == "lut" and dn.dtype in (np.uint16, np.uint8):
+        lut = build_bt_lut(MULT, ADD, K1, K2, nodata)
+        return lut[dn]
+    return dn_to_btC_direct(dn, nodata, MULT, ADD, K1, K2)
+
 # --------------------
 # パス推定（ディレクトリから自動検出）
 # --------------------
@@ -72,6 +176,124 @@ def guess_paths_from_dir(d: str):
             b10 = os.path.join(d, fn)
     return mtl, b10
 
+def scene_id_from_mtl(mtl_path: str) -> str:
+    """MTL のファイル名からシーンID（例: LC08_L1TP_127045_20230707_20230718_02_T1）を返す"""
+    return re.sub(r"_MTL\.TXT$", "", os.path.basename(mtl_path), flags=re.IGNORECASE)
+
+def find_scenes(root: str) -> list:
+    """
+    フォルダ以下を再帰的に探索し、(シーンID, MTL パス, B10 パス) のリストを返す
+    B10 が見つからないシーンは除外する
+    """
+    scenes = []
+    for d, _, files in os.walk(root):
+        upper = {fn.upper(): fn for fn in files}
+        for fn in files:
+            if not fn.upper().endswith("_MTL.TXT"):
+                continue
+            scene_id = scene_id_from_mtl(fn)
+            b10 = upper.get(f"{scene_id}_B10.TIF".upper())
+            if b10 is None:
+                print(f"[SKIP] Band10 が見つかりません: {scene_id}")
+                continue
+            scenes.append((scene_id, os.path.join(d, fn), os.path.join(d, b10)))
+    return sorted(scenes)
+
+# --------------------
+# 変換（1シーン）
+# --------------------
+def convert_scene(b10_path: str, out_path: str, constants: tuple, method: str = "lut", city: str = None) -> str:
+    """Band10 を BT(°C) に変換して GeoTIFF に保存する（city 指定時は ROI ウィンドウのみ）"""
+    MULT, ADD, K1, K2 = constants
+
+    with stage('bt_scene', scene=os.path.basename(b10_path), method=method) as st:
+        # --- Band10 読み込み ---
+        with rasterio.open(b10_path) as src10:
+            profile = src10.profile
+            nodata10 = src10.nodata
+            roi = roi_for_dataset(src10, city) if city else None
+            if roi is not None:
+                profile = roi_profile(profile, roi)
+                dn10 = src10.read(1, window=roi.window)
+            else:
+                dn10 = src10.read(1)
+        st.add(pixels=dn10.size)
+
+        # DN -> Radiance -> BT (°C)
+        with stage('bt_scene.compute'):
+            btC = dn_to_btC(dn10, nodata10, MULT, ADD, K1, K2, method=method)
+            if roi is not None:
+                btC[~roi.mask] = np.nan
+
+        # 出力（float32 / NaN を nodata 扱い / COG）
+        write_cog(out_path, btC.astype(np.float32, copy=False), profile, nodata=np.nan,
+                  tags=output_tags(method, city))
+    return out_path
+
+# --------------------
+# バッチ（フォルダ以下の全シーン）
+# --------------------
+def output_tags(method: str, city: str = None) -> dict:
+    """出力に記録する変換条件（is_up_to_date で比較する）"""
+    return {"BT_METHOD": method, "BT_CITY": city or ""}
+
+def is_up_to_date(out_path: str, *inputs: str, tags: dict = None) -> bool:
+    """
+    出力が存在し、全ての入力より新しければ True
+    tags を指定した場合は、出力のタグが一致しない（別の --method / --city で作った, タグが無い）場合も False
+    """
+    if not os.path.exists(out_path):
+        return False
+    out_mtime = os.path.getmtime(out_path)
+    if not all(os.path.getmtime(p) <= out_mtime for p in inputs):
+        return False
+    if tags:
+        with rasterio.open(out_path) as src:
+            recorded = src.tags()
+        # 空文字のタグは GeoTIFF に残らないため、無いタグは空文字として比較する
+        return all(recorded.get(k, "") == v for k, v in tags.items())
+    return True
+
+def run_batch(root: str, out_dir: str = None, workers: int = None, method: str = "lut",
+              cache_path: str = None, force: bool = False, city: str = None) -> list:
+    """
+    フォルダ以下の全シーンを並列に BT(°C) へ変換する
+    :return: 変換した出力パスのリスト
+    """
+    cache = MtlCache(cache_path or os.path.join(root, MTL_CACHE_NAME))
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+
+    jobs = []
+    for scene_id, mtl_path, b10_path in find_scenes(root):
+        out_path = os.path.join(out_dir or os.path.dirname(b10_path), f"{scene_id}_BT_C.tif")
+        if not force and is_up_to_date(out_path, mtl_path, b10_path, tags=output_tags(method, city)):
+            print(f"[SKIP] 最新の出力があります: {out_path}")
+            continue
+        try:
+            consts = cache.get(mtl_path)
+        except Exception as e:
+            # MTL の定数が読めないシーンだけを除き、残りのシーンは変換する
+            print(f"[NG] {mtl_path}: {e}")
+            continue
+        jobs.append((b10_path, out_path, consts))
+    cache.save()
+
+    done = []
+    if not jobs:
+        return done
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(convert_scene, b10, out, consts, method, city): b10 for b10, out, consts in jobs}
+        for future in as_completed(futures):
+            try:
+                out_path = future.result()
+            except Exception as e:
+                print(f"[NG] {futures[future]}: {e}")
+                continue
+            print(f"[OK] BT saved (°C): {out_path}")
+            done.append(out_path)
+    return done
+
 # --------------------
 # メイン
 # --------------------
@@ -84,8 +306,22 @@ def main():
     ap.add_argument("--mtl", type=str, default=None, help="MTL.txt パス（--dir未使用時）")
     ap.add_argument("--b10", type=str, default=None, help="Band10 TIF パス（--dir未使用時）")
     ap.add_argument("--out", type=str, default="L8_B10_BT_C.tif", help="出力 GeoTIFF（BT, °C）")
+    ap.add_argument("--method", choices=["lut", "direct"], default="lut",
+                    help="lut: 65536 値の変換表で表引き（既定） / direct: 画素ごとに float64 で計算")
+    ap.add_argument("--batch-root", type=str, default=None, help="バッチモード: このフォルダ以下の全シーンを変換")
+    ap.add_argument("--out-dir", type=str, default=None, help="バッチモードの出力フォルダ（既定: 各シーンフォルダ）")
+    ap.add_argument("--workers", type=int, default=None, help="バッチモードのワーカー数（既定: CPU コア数）")
+    ap.add_argument("--cache", type=str, default=None, help=f"MTL キャッシュのパス（既定: <batch-root>/{MTL_CACHE_NAME}）")
+    ap.add_argument("--force", action="store_true", help="バッチモードで最新の出力があっても再計算する")
+    ap.add_argument("--city", type=str, default=None, help="ROI で切り出す都市（シェープファイルの TinhThanh, 例: 'Hà Nội'）")
     args = ap.parse_args()
 
+    if args.batch_root:
+        done = run_batch(args.batch_root, out_dir=args.out_dir, workers=args.workers,
+                         method=args.method, cache_path=args.cache, force=args.force, city=args.city)
+        print(f"[OK] {len(done)} scene(s) converted")
+        return
+
     # 引数優先 → 個別指定（--mtl/--b10） → デフォルトDIRを参照
     if args.dir:
         mtl_path, b10_path = guess_paths_from_dir(args.dir)
@@ -100,41 +336,8 @@ def main():
         raise FileNotFoundError(f"Band10 が見つかりません。--dir または --b10 を確認してください。検索パス: {args.dir or DIR}")
 
     # ...existing code...MTL 読み取り（必要な定数） ---
-    mtl = parse_mtl(mtl_path)
-    try:
-        MULT = float(mtl["RADIANCE_MULT_BAND_10"])
-        ADD = float(mtl["RADIANCE_ADD_BAND_10"])
-        K1 = float(mtl["K1_CONSTANT_BAND_10"])
-        K2 = float(mtl["K2_CONSTANT_BAND_10"])
-    except KeyError as e:
-        raise KeyError(f"MTL に必要なキーが見つかりません: {e}")
-
-    # --- Band10 読み込み ---
-    with rasterio.open(b10_path) as src10:
-        profile = src10.profile
-        dn10 = src10.read(1).astype("float64")
-        nodata10 = src10.nodata
-
-    # マスク（NoData）
-    mask = np.zeros_like(dn10, dtype=bool)
-    if nodata10 is not None:
-        mask |= (dn10 == nodata10)
-
-    # DN -> Radiance
-    L10 = calc_TOA(dn10, MULT, ADD)
-    mask |= (L10 <= 0)  # 物理的に不正な画素も除外
-
-    # Radiance -> BT (K) -> BT (°C)
-    btK = radiance_to_btK(L10, K1, K2)
-    btK[mask] = np.nan
-    btC = btK - 273.15
-
-
-    # 出力（float32 / NaN を nodata 扱い）
-    out_profile = profile.copy()
-    out_profile.update(dtype="float32", nodata=np.nan)
-    with rasterio.open(args.out, "w", **out_profile) as dst:
-        dst.write(btC.astype("float32"), 1)
+    MULT, ADD, K1, K2 = read_bt_constants(mtl_path)
+    convert_scene(b10_path, args.out, (MULT, ADD, K1, K2), method=args.method, city=args.city)
 
     print(f"[OK] BT saved (°C): {args.out}")
     print(f"  MTL: MULT={MULT}, ADD={ADD}, K1={K1}, K2={K2}")
@@ -0,0 +1,190 @@
+"""
+研究対象都市（regions.py の REGIONS）のパイプラインをまとめて実行するスクリプト
+
+都市ごとにスクリプトを複製・再実行する代わりに、共有できる処理は1回だけ行い、
+都市ごとの処理は1つのプロセスプールで並列に実行する。
+
+- ステージ
+harvest   : gee_landsat8_get_data.run_regions
+            全都市の ROI の和集合に対するコレクションの問い合わせ・メタデータの getInfo は1回、
+            エクスポートは1つのキュー（同時実行数の上限は全都市で共有）
+index     : calc_ref_bands.process_scene
+            全都市の反射バンドGeoTIFFを1つのプロセスプールで処理し、都市ごとの統計CSVに書き出す
+composite : temporal_composite（都市ごとの年間合成）
+cube      : lst_cube.ingest（都市ごとのデータキューブに追記）
+zonal     : zonal_stats.run（都市ごとのゾーン統計）
+composite / cube / zonal は都市を単位としてプロセスプールで並列に実行する。
+ROI マスク・ゾーンのラベル配列はグリッドごとにディスクへキャッシュされるため、都市・シーン間で再利用される。
+
+- ローカルのフォルダ（Google Drive からダウンロードしたエクスポートを置く）
+workspace/data/geotiff/Landsat8/reflectance/{YEAR}/L8_{time}_{slug}_Reflectance.tif
+workspace/data/geotiff/Landsat8/LST/{YEAR}/L8_{time}_{slug}_LST.tif
+raw DN でエクスポートした場合（gee_landsat8_get_data の EXPORT_MODE = 'raw'）は L8_{time}_{slug}_L2raw.tif を
+reflectance/{YEAR} に置けば index ステージの入力になる（スケール変換・クラウドマスクは読み込み時にブロックごとに行う）。
+index ステージは同じシーンから LST/{YEAR}/L8_{time}_{slug}_LST.tif も作るため、composite / cube / zonal は
+index ステージの後に実行する。
+
+- 使い方
+python workspace/src/run_regions.py --year 2023                                 # 全都市・全ステージ
+python workspace/src/run_regions.py --year 2023 --cities Hanoi DaNang --stages index zonal
+python workspace/src/run_regions.py --year 2023 --profile   # ステージ・シーンごとの時間・I/O・メモリを記録（instrumentation.py）
+"""
+
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import calc_ref_bands
+import lst_cube
+import temporal_composite
+import zonal_stats
+import instrumentation
+from instrumentation import stage
+from regions import select_regions, REGIONS
+
+STAGES = ['harvest', 'index', 'composite', 'cube', 'zonal']
+LOCAL_STAGES = ['composite', 'cube', 'zonal']
+
+REFLECTANCE_FOLDER = 'workspace/data/geotiff/Landsat8/reflectance/{year}'
+INDEX_FOLDER = 'workspace/data/geotiff/Landsat8/indexes/{year}'
+LST_FOLDER = 'workspace/data/geotiff/Landsat8/LST/{year}'
+INDEX_CSV = 'workspace/data/csv/index_statistics_{year}_{slug}.csv'
+
+
+def run_harvest(regions, year):
+    """全都市の収集・エクスポート（Earth Engine の問い合わせは全都市で1回）"""
+    import gee_landsat8_get_data as harvest
+
+    harvest.CONFIG['YEAR'] = year
+    harvest.CONFIG['EXPORT_JOURNAL'] = f"workspace/data/cache/export_journal_{year}.json"
+    harvest.setup()
+    added = harvest.run_regions(regions, f'{year}-01-01', f'{year}-12-31')
+    return {slug: len(rows) for slug, rows in added.items()}
+
+
+def run_index(regions, year, max_workers=None, quantize=False):
+    """
+    全都市の反射バンドGeoTIFFから指標を計算する（1つのプロセスプールを共有）
+    :param quantize: True の場合は指標を int16 の1ファイル（_Indexes.tif）に保存する
+    :return: slug -> 処理したシーン数
+    """
+    input_folder = REFLECTANCE_FOLDER.format(year=year)
+    output_folder = INDEX_FOLDER.format(year=year)
+    lst_folder = LST_FOLDER.format(year=year)
+    os.makedirs(output_folder, exist_ok=True)
+
+    jobs = [(path, region) for region in regions for path in calc_ref_bands.scene_paths(input_folder, region.slug)]
+    if not jobs:
+        print(f"反射バンドGeoTIFFがありません: {input_folder}")
+        return {r.slug: 0 for r in regions}
+    if max_workers is None:
+        max_workers = calc_ref_bands.decide_workers([path for path, _ in jobs])
+    print(f"{len(regions)}都市・{len(jobs)}シーンを{max_workers}プロセスで処理します。")
+
+    records = {r.slug: [] for r in regions}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(calc_ref_bands.process_scene, path, output_folder, region.name, quantize,
+                                   lst_folder=lst_folder):
+                   (path, region)
+                   for path, region in jobs}
+        for future in as_completed(futures):
+            path, region = futures[future]
+            try:
+                stats = future.result()
+            except Exception as e:
+                print(f"{path}の処理でエラーが発生しました: {e}")
+                continue
+            if stats is not None:
+                records[region.slug].append(stats)
+
+    for slug, rows in records.items():
+        rows.sort(key=lambda r: r['filename'])
+        csv_output = INDEX_CSV.format(year=year, slug=slug)
+        os.makedirs(os.path.dirname(csv_output), exist_ok=True)
+        pd.DataFrame(rows, columns=calc_ref_bands.stats_fieldnames()).to_csv(csv_output, index=False)
+    return {slug: len(rows) for slug, rows in records.items()}
+
+
+def run_local(slug, year, stages):
+    """
+    1都市分の composite / cube / zonal を実行する（プロセスプールのワーカーで実行）
+    :return: ステージ名 -> 結果の概要
+    """
+    summary = {}
+    if 'composite' in stages:
+        scenes = temporal_composite.find_scenes(temporal_composite.LST_FOLDER, f'{year}-01-01', f'{year}-12-31', slug)
+        if scenes:
+            out_path = temporal_composite.default_output_path(scenes, slug)
+            temporal_composite.composite([p for _, p in scenes], out_path)
+            summary['composite'] = out_path
+        else:
+            summary['composite'] = 'シーンなし'
+    if 'cube' in stages:
+        try:
+            cube, n = lst_cube.ingest(region=slug)
+            summary['cube'] = f'{n}シーン追記（合計 {cube.size}）'
+        except FileNotFoundError:
+            summary['cube'] = 'シーンなし'
+    if 'zonal' in stages:
+        result = zonal_stats.run(region=slug)
+        summary['zonal'] = f"{result['time_id'].nunique()}シーン"
+    return summary
+
+
+def run_locals(regions, year, stages, max_workers=None):
+    """都市ごとのローカル処理をプロセスプールで並列に実行する"""
+    stages = [s for s in stages if s in LOCAL_STAGES]
+    if not stages:
+        return {}
+    max_workers = max_workers or min(len(regions), os.cpu_count() or 1)
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_local, r.slug, year, stages): r for r in regions}
+        for future in as_completed(futures):
+            region = futures[future]
+            try:
+                results[region.slug] = future.result()
+            except Exception as e:
+                print(f"{region.label}の処理でエラーが発生しました: {e}")
+                results[region.slug] = {'error': str(e)}
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description="研究対象都市のパイプラインをまとめて実行する")
+    ap.add_argument("--cities", type=str, nargs='+', default=['all'],
+                    help=f"対象都市（slug または名前, 既定: all = {', '.join(REGIONS)}）")
+    ap.add_argument("--year", type=int, default=calc_ref_bands.YEAR, help="対象年")
+    ap.add_argument("--stages", type=str, nargs='+', default=STAGES, choices=STAGES, help="実行するステージ")
+    ap.add_argument("--workers", type=int, default=None, help="ワーカー数（既定: 自動決定）")
+    ap.add_argument("--quantize", action="store_true", help="指標を int16 に量子化して保存する（calc_ref_bands --quantize）")
+    ap.add_argument("--profile", type=str, nargs='?', const='', default=None,
+                    help="ステージごとの計測を JSON Lines で記録する（パス省略時は workspace/data/logs/profile_*.jsonl）")
+    args = ap.parse_args()
+    if args.profile is not None:
+        instrumentation.enable(args.profile or None)
+
+    regions = select_regions(args.cities)
+    print(f"対象都市: {', '.join(r.label for r in regions)} / {args.year}年 / {', '.join(args.stages)}")
+
+    if 'harvest' in args.stages:
+        with stage('run.harvest', year=args.year):
+            harvested = run_harvest(regions, args.year)
+        for slug, n in harvested.items():
+            print(f"[harvest] {REGIONS[slug].label}: {n}シーン")
+    if 'index' in args.stages:
+        with stage('run.index', year=args.year):
+            indexed = run_index(regions, args.year, args.workers, args.quantize)
+        for slug, n in indexed.items():
+            print(f"[index] {REGIONS[slug].label}: {n}シーン")
+    with stage('run.local', year=args.year):
+        results = run_locals(regions, args.year, args.stages, args.workers)
+    for slug, summary in results.items():
+        for name, result in summary.items():
+            print(f"[{name}] {REGIONS[slug].label}: {result}")
+
+
+if __name__ == "__main__":
+    main()
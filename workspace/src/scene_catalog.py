@@ -0,0 +1,278 @@
+"""
+Landsat シーンのメタデータを SQLite に保存するシーンカタログ
+
+これまで年ごとに作り直していた image_metadata_{YEAR}.csv の代わりに、
+1つのデータベース（workspace/data/catalog/scene_catalog.sqlite）へシーン単位で追記・更新する。
+
+・主キー: シーンID（GEE の system:index, 例: LC08_127045_20230707）
+・インデックス: 観測時刻（time_start）, 日付, 有効ピクセル率, エクスポート状態
+・high_water_mark() で期間内の最新の観測時刻を返すため、収集側はそれより新しいシーンだけを問い合わせればよい
+  シーンが1件もない都市でも、問い合わせで確認済みの観測時刻を set_harvested_until() で期間ごとに記録するため
+  （harvests テーブル）、その都市のために毎回全期間を問い合わせ直すことはない
+  （エクスポートが完了していないシーンは pending_exports() で取り出して再投入する）
+・複数年のシーン選択は select() の1回のクエリで行う
+・raw DN エクスポートのスケール係数は、Drive へのエクスポートでは GeoTIFF のタグに残らないため、
+  エクスポート名ごとに raw_scale_factors.json（カタログと同じフォルダ）へ記録する（record_scale_factors）
+
+- 使い方
+python workspace/src/scene_catalog.py --import image_metadata_2019.csv image_metadata_2020.csv   # 既存CSVの取り込み
+python workspace/src/scene_catalog.py --start 2019-01-01 --end 2024-12-31 --min-valid 0.5        # シーンの選択
+"""
+
+import os
+import json
+import sqlite3
+import argparse
+from datetime import datetime, timezone
+
+import pandas as pd
+
+CATALOG_PATH = 'workspace/data/catalog/scene_catalog.sqlite'
+# raw DN エクスポートのスケール係数（エクスポート名 -> {SR_SCALE, SR_OFFSET, ST_SCALE, ST_OFFSET}）
+SCALE_FACTORS_PATH = 'workspace/data/catalog/raw_scale_factors.json'
+
+COLUMNS = ['scene_id', 'time_start', 'date', 'time', 'time_id', 'total_pixels',
+           'valid_ratio', 'exported', 'export_status']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    scene_id      TEXT PRIMARY KEY,
+    time_start    INTEGER NOT NULL,  -- 観測時刻（UTC, エポックミリ秒）
+    date          TEXT NOT NULL,     -- YYYY-MM-DD（UTC）
+    time          TEXT,              -- HH:MM:SS（UTC）
+    time_id       TEXT,              -- YYYYMMdd_HHmmss（エクスポート名に使用）
+    total_pixels  INTEGER,
+    valid_ratio   REAL,
+    exported      INTEGER NOT NULL DEFAULT 0,
+    export_status TEXT,
+    updated_at    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_scenes_time_start ON scenes (time_start);
+CREATE INDEX IF NOT EXISTS idx_scenes_date ON scenes (date);
+CREATE INDEX IF NOT EXISTS idx_scenes_valid_ratio ON scenes (valid_ratio);
+CREATE INDEX IF NOT EXISTS idx_scenes_export_status ON scenes (export_status);
+CREATE TABLE IF NOT EXISTS harvests (
+    range_start     TEXT NOT NULL,   -- 問い合わせ期間（YYYY-MM-DD, 指定なしは空文字）
+    range_end       TEXT NOT NULL,
+    harvested_until INTEGER NOT NULL, -- この期間で問い合わせ済みの最新の観測時刻（エポックミリ秒）
+    updated_at      TEXT,
+    PRIMARY KEY (range_start, range_end)
+);
+"""
+
+# 旧 image_metadata_{YEAR}.csv の列名
+LEGACY_COLUMNS = {
+    '日時': 'date',
+    '全体ピクセル数': 'total_pixels',
+    '有効ピクセル率': 'valid_ratio',
+    '出力有無': 'exported',
+    '観測時刻': 'time',
+}
+
+
+def to_time_start(date, time='00:00:00'):
+    """UTC の日付・時刻文字列をエポックミリ秒に変換する"""
+    dt = datetime.strptime(f"{date} {time or '00:00:00'}", '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def load_scale_factors(name=None, path=SCALE_FACTORS_PATH):
+    """
+    記録したスケール係数を返す
+    :param name: エクスポート名（L8_{time}_{slug}_L2raw）。None の場合は全エクスポート分の辞書
+    :return: 係数の辞書（記録がなければ空の辞書）
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        factors = json.load(f)
+    return factors if name is None else factors.get(name, {})
+
+
+def record_scale_factors(name, factors, path=SCALE_FACTORS_PATH):
+    """エクスポート名のスケール係数を記録する（同じ名前は上書き）"""
+    records = load_scale_factors(path=path)
+    records[name] = dict(factors)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+class SceneCatalog:
+    """
+    シーンカタログ（SQLite）
+    :param path: データベースのパス
+    """
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def upsert(self, rows):
+        """
+        シーンを追加・更新する
+        :param rows: COLUMNS をキーとする辞書のリスト（scene_id, time_start, date は必須）
+        :return: 書き込んだ件数
+        """
+        now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        records = []
+        for row in rows:
+            record = [row.get(c) for c in COLUMNS]
+            record[COLUMNS.index('exported')] = int(bool(row.get('exported')))
+            records.append(record + [now])
+        placeholders = ', '.join('?' * (len(COLUMNS) + 1))
+        updates = ', '.join(f'{c} = excluded.{c}' for c in COLUMNS[1:] + ['updated_at'])
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO scenes ({', '.join(COLUMNS)}, updated_at) VALUES ({placeholders}) "
+                f"ON CONFLICT(scene_id) DO UPDATE SET {updates}",
+                records
+            )
+        return len(records)
+
+    def set_export_status(self, scene_id, status):
+        """シーンのエクスポート状態を更新する"""
+        with self.conn:
+            self.conn.execute("UPDATE scenes SET export_status = ? WHERE scene_id = ?", (status, scene_id))
+
+    def high_water_mark(self, start=None, end=None):
+        """
+        期間内（日付, 両端を含む）で最も新しい観測時刻（エポックミリ秒）を返す。
+        同じ期間の問い合わせ済みの観測時刻（set_harvested_until）の方が新しければそちらを返す。どちらもなければ None
+        """
+        where, params = self._date_filter(start, end)
+        marks = [self.conn.execute(f"SELECT MAX(time_start) FROM scenes {where}", params).fetchone()[0],
+                 self.harvested_until(start, end)]
+        marks = [m for m in marks if m is not None]
+        return max(marks) if marks else None
+
+    def harvested_until(self, start=None, end=None):
+        """期間の問い合わせ済みの最新の観測時刻（記録がなければ None）"""
+        row = self.conn.execute("SELECT harvested_until FROM harvests WHERE range_start = ? AND range_end = ?",
+                                (start or '', end or '')).fetchone()
+        return row[0] if row else None
+
+    def set_harvested_until(self, start, end, time_start):
+        """
+        期間の問い合わせ済みの最新の観測時刻を記録する（シーンを追加しなかった場合も記録する。値は戻さない）
+        """
+        now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO harvests (range_start, range_end, harvested_until, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(range_start, range_end) DO UPDATE SET "
+                "harvested_until = MAX(harvested_until, excluded.harvested_until), updated_at = excluded.updated_at",
+                (start or '', end or '', int(time_start), now)
+            )
+
+    def pending_exports(self, start=None, end=None, done_states=('COMPLETED', 'SUCCEEDED')):
+        """
+        エクスポート対象のうちエクスポートが完了していないシーン（中断・失敗したもの）を返す
+        旧 CSV から取り込んだシーン（legacy_*）は GEE のシーンIDがないため除く
+        """
+        df = self.select(start, end, exported=True)
+        pending = ~df['export_status'].isin(done_states) & ~df['scene_id'].str.startswith('legacy_')
+        return df[pending]
+
+    def select(self, start=None, end=None, min_valid_ratio=None, min_total_pixels=None,
+               exported=None, export_status=None):
+        """
+        条件に合うシーンを観測時刻順の DataFrame で返す
+        :param start, end: 日付の範囲（YYYY-MM-DD, 両端を含む）
+        :param min_valid_ratio: 有効ピクセル率の下限
+        :param min_total_pixels: 全体ピクセル数の下限
+        :param exported: True/False でエクスポート対象かどうかを絞り込む
+        :param export_status: エクスポート状態（例: 'COMPLETED'）
+        """
+        where, params = self._date_filter(start, end)
+        conditions = [where[len('WHERE '):]] if where else []
+        if min_valid_ratio is not None:
+            conditions.append('valid_ratio >= ?')
+            params.append(min_valid_ratio)
+        if min_total_pixels is not None:
+            conditions.append('total_pixels >= ?')
+            params.append(min_total_pixels)
+        if exported is not None:
+            conditions.append('exported = ?')
+            params.append(int(bool(exported)))
+        if export_status is not None:
+            conditions.append('export_status = ?')
+            params.append(export_status)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        df = pd.read_sql_query(f"SELECT {', '.join(COLUMNS)} FROM scenes {where} ORDER BY time_start",
+                               self.conn, params=params)
+        df['exported'] = df['exported'].astype(bool)
+        return df
+
+    @staticmethod
+    def _date_filter(start, end):
+        conditions, params = [], []
+        if start is not None:
+            conditions.append('date >= ?')
+            params.append(start)
+        if end is not None:
+            conditions.append('date <= ?')
+            params.append(end)
+        return (f"WHERE {' AND '.join(conditions)}" if conditions else ''), params
+
+    def import_legacy_csv(self, path):
+        """
+        旧形式の image_metadata_{YEAR}.csv を取り込む
+        シーンIDがないため legacy_{YYYYMMdd}_{HHmmss} をIDとする（同じ日時の重複は1件にまとめる）
+        :return: 取り込んだ件数
+        """
+        df = pd.read_csv(path, dtype={'観測時刻': str}).rename(columns=LEGACY_COLUMNS)
+        df = df.drop_duplicates(subset=['date', 'time'])
+        rows = []
+        for rec in df.to_dict('records'):
+            time = rec.get('time') if isinstance(rec.get('time'), str) else '00:00:00'
+            time_id = f"{rec['date'].replace('-', '')}_{time.replace(':', '')}"
+            rows.append({
+                'scene_id': f'legacy_{time_id}',
+                'time_start': to_time_start(rec['date'], time),
+                'date': rec['date'],
+                'time': time,
+                'time_id': time_id,
+                'total_pixels': int(rec['total_pixels']),
+                'valid_ratio': float(rec['valid_ratio']),
+                'exported': str(rec['exported']).lower() == 'true',
+                'export_status': None,
+            })
+        return self.upsert(rows)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="シーンカタログの取り込み・検索")
+    ap.add_argument("--catalog", type=str, default=CATALOG_PATH, help="カタログのパス")
+    ap.add_argument("--import", dest="import_csv", nargs="+", default=None, help="取り込む image_metadata_{YEAR}.csv")
+    ap.add_argument("--start", type=str, default=None, help="開始日（YYYY-MM-DD）")
+    ap.add_argument("--end", type=str, default=None, help="終了日（YYYY-MM-DD）")
+    ap.add_argument("--min-valid", type=float, default=None, help="有効ピクセル率の下限")
+    ap.add_argument("--exported", action="store_true", help="エクスポート対象のシーンのみ")
+    args = ap.parse_args()
+
+    with SceneCatalog(args.catalog) as catalog:
+        if args.import_csv:
+            for path in args.import_csv:
+                print(f"{path}: {catalog.import_legacy_csv(path)}件取り込みました")
+            return
+        df = catalog.select(args.start, args.end, min_valid_ratio=args.min_valid,
+                            exported=True if args.exported else None)
+        print(df.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+シーンごとの LST GeoTIFF から、期間内の画素ごとの合成画像（平均・中央値・パーセンタイル・有効シーン数など）を作るスクリプト
+
+gee_landsat8_get_data.py がエクスポートした L8_{YYYYMMdd_HHmmss}_{slug}_LST.tif（slug は regions.py の都市名）を対象に、
+OldGEE_Landsat8_LST.py / GEE.MOD11A2_LST.py の lst_images.mean() に相当する合成をローカルで行う。
+
+・空間タイルごとに全シーンの同じ範囲を読み込み、時間方向に NaN を除いて集計する
+・mean / min / max / std / count はシーンを1枚ずつ読むたびに足し込む（RunningStats）。
+  メモリはタイルの大きさだけで決まり、シーン数にもアーカイブ全体の大きさにも依存しない
+・median とパーセンタイルは時間方向のスタック（シーン数 × 行 × 列）が必要なため、
+  スタックが STACK_MEMORY_MB 以下になるようにタイルの行数を減らす
+・同時に開くファイルは max_open 個まで。シーン数がそれを超える場合はタイルごとに max_open 個ずつ開いて閉じる
+・欠損（nodata・NaN）の画素は集計から除く。有効なシーンが1つも無い画素は NaN（count は 0）
+・全シーンが同じグリッド（CRS・解像度・範囲）であることを前提とする（同じ region・scale でエクスポートしたもの）
+
+- 出力
+1ファイルのマルチバンド GeoTIFF（float32）。バンド説明に統計量名（mean, median, p10, count など）を入れる。
+
+- 使い方
+python workspace/src/temporal_composite.py --start 2023-06-01 --end 2023-08-31
+python workspace/src/temporal_composite.py --year 2023 --stats mean median max count --percentiles 10 90
+python workspace/src/temporal_composite.py --year 2023 --region DaNang
+"""
+
+import os
+import re
+import argparse
+import warnings
+from contextlib import ExitStack
+from datetime import datetime
+from glob import glob
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from regions import get_region, DEFAULT_REGION
+from instrumentation import instrumented
+from raster_io import open_cog, read_band
+
+LST_FOLDER = 'workspace/data/geotiff/Landsat8/LST'
+OUTPUT_FOLDER = 'workspace/data/geotiff/Landsat8/LST_composite'
+
+# gee_landsat8_get_data.export_lst_to_drive のファイル名（{slug} は都市名）
+SCENE_PATTERN = r'L8_(\d{{8}}_\d{{6}})_{slug}_LST'
+
+DEFAULT_STATS = ('mean', 'median', 'count')
+TILE_SIZE = 512
+# 同時に開くシーンのファイル数の上限
+MAX_OPEN_FILES = 64
+# median・パーセンタイル用の時間方向のスタックの上限（MB）
+STACK_MEMORY_MB = 256
+
+# シーンを1枚ずつ足し込んで求める統計量（RunningStats）
+STREAMING_STATS = ('mean', 'min', 'max', 'std', 'count')
+# 時間方向のスタック（シーン, 行, 列）が必要な統計量 -> 集計する関数
+STACK_REDUCERS = {
+    'median': lambda stack: np.nanmedian(stack, axis=0),
+}
+STATS = STREAMING_STATS + tuple(STACK_REDUCERS)
+
+
+class RunningStats:
+    """
+    タイルをシーンごとに足し込み、画素ごとの mean / min / max / std（母標準偏差）/ count を求める
+    NaN の画素は集計から除き、有効なシーンが1つも無い画素は NaN（count は 0）
+    """
+
+    def __init__(self, shape):
+        self.count = np.zeros(shape, dtype=np.int32)
+        self.total = np.zeros(shape, dtype=np.float64)
+        self.total_sq = np.zeros(shape, dtype=np.float64)
+        self.min = np.full(shape, np.nan, dtype=np.float32)
+        self.max = np.full(shape, np.nan, dtype=np.float32)
+
+    def add(self, tile):
+        valid = ~np.isnan(tile)
+        values = np.where(valid, tile, 0).astype(np.float64)
+        self.count += valid
+        self.total += values
+        self.total_sq += values * values
+        # fmin / fmax は片方が NaN ならもう片方を返す
+        np.fmin(self.min, tile, out=self.min)
+        np.fmax(self.max, tile, out=self.max)
+
+    def result(self, name):
+        if name == 'count':
+            return self.count.astype(np.float32)
+        if name == 'min':
+            return self.min
+        if name == 'max':
+            return self.max
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = self.total / self.count
+            if name == 'mean':
+                return mean
+            return np.sqrt(np.maximum(self.total_sq / self.count - mean * mean, 0))
+
+
+def scene_time(path, slug=DEFAULT_REGION):
+    """ファイル名から観測日時を求める（形式・都市が違う場合は None）"""
+    m = re.search(SCENE_PATTERN.format(slug=slug), os.path.basename(path))
+    return datetime.strptime(m.group(1), '%Y%m%d_%H%M%S') if m else None
+
+
+def find_scenes(folder=LST_FOLDER, start=None, end=None, slug=DEFAULT_REGION):
+    """
+    フォルダ以下（サブフォルダを含む）の都市 slug の LST GeoTIFF のうち、観測日が start〜end（両端を含む）のものを返す
+    :param start, end: 'YYYY-MM-DD' の文字列（None の場合は制限なし）
+    :return: (観測日時, パス) のリスト（観測日時順）
+    """
+    start = datetime.strptime(start, '%Y-%m-%d') if start else None
+    end = datetime.strptime(end, '%Y-%m-%d') if end else None
+    scenes = []
+    for path in glob(os.path.join(folder, '**', '*.tif'), recursive=True):
+        t = scene_time(path, slug)
+        if t is None:
+            continue
+        if (start is None or t.date() >= start.date()) and (end is None or t.date() <= end.date()):
+            scenes.append((t, path))
+    return sorted(scenes)
+
+
+def default_output_path(scenes, slug=DEFAULT_REGION):
+    """find_scenes の結果に対する既定の出力パス"""
+    return os.path.join(OUTPUT_FOLDER,
+                        f"LST_composite_{slug}_{scenes[0][0]:%Y%m%d}_{scenes[-1][0]:%Y%m%d}.tif")
+
+
+def output_names(stats, percentiles):
+    return list(stats) + [f'p{p:g}' for p in percentiles]
+
+
+def read_tile(src, window, out):
+    """タイルを float32 で out に読み込み、nodata を NaN にする（int16 に量子化したファイルは値に戻す）"""
+    return read_band(src, 1, window=window, out=out)
+
+
+def open_batches(paths, max_open):
+    """パスを max_open 個ずつ開いたリストを順に返す（次のバッチを開く前に閉じる）"""
+    for i in range(0, len(paths), max_open):
+        with ExitStack() as opened:
+            yield [opened.enter_context(rasterio.open(p)) for p in paths[i:i + max_open]]
+
+
+def check_grids(paths):
+    """全シーンのグリッドが1つ目と一致することを確かめ、1つ目のプロファイルを返す"""
+    ref = None
+    for path in paths:
+        with rasterio.open(path) as src:
+            grid = (src.crs, src.transform, src.width, src.height)
+            if ref is None:
+                ref, profile, ref_name = grid, src.profile.copy(), src.name
+            elif grid != ref:
+                raise ValueError(f"グリッドが一致しません: {src.name} と {ref_name}")
+    return profile
+
+
+@instrumented('composite')
+def composite(paths, out_path, stats=DEFAULT_STATS, percentiles=(), tile_size=TILE_SIZE, max_open=MAX_OPEN_FILES):
+    """
+    複数シーンの画素ごとの合成画像を作る
+    :param paths: シーンの GeoTIFF パスのリスト（すべて同じグリッド）
+    :param out_path: 出力 GeoTIFF のパス
+    :param stats: STATS の要素の並び
+    :param percentiles: 求めるパーセンタイル（0〜100）の並び
+    :param tile_size: 空間タイルの一辺の画素数
+    :param max_open: 同時に開くファイル数の上限
+    :return: 出力したバンド名のリスト
+    """
+    if not paths:
+        raise ValueError("合成するシーンがありません")
+    unknown = [s for s in stats if s not in STATS]
+    if unknown:
+        raise ValueError(f"不明な統計量: {unknown}（{', '.join(STATS)}）")
+
+    profile = check_grids(paths)
+    height, width = profile['height'], profile['width']
+    names = output_names(stats, percentiles)
+    profile.update(dtype='float32', count=len(names), nodata=np.nan)
+
+    tile_cols = min(tile_size, width)
+    tile_rows = min(tile_size, height)
+    stacked = bool(percentiles) or any(s in STACK_REDUCERS for s in stats)
+    if stacked:
+        # スタック（シーン数 × 行 × 列 の float32）が STACK_MEMORY_MB に収まる行数にする
+        tile_rows = max(1, min(tile_rows, STACK_MEMORY_MB * 2 ** 20 // (len(paths) * tile_cols * 4)))
+        stack = np.empty((len(paths), tile_rows, tile_cols), dtype=np.float32)
+    buffer = np.empty((tile_rows, tile_cols), dtype=np.float32)
+
+    with ExitStack() as resident:
+        # 全シーンを一度に開ける場合は開いたまま全タイルで使う
+        sources = None
+        if len(paths) <= max_open:
+            sources = [resident.enter_context(rasterio.open(p)) for p in paths]
+
+        with open_cog(out_path, profile) as dst:
+            for i, name in enumerate(names, start=1):
+                dst.set_band_description(i, name)
+            for row in range(0, height, tile_rows):
+                for col in range(0, width, tile_cols):
+                    window = Window(col, row, min(tile_cols, width - col), min(tile_rows, height - row))
+                    shape = (int(window.height), int(window.width))
+                    running = RunningStats(shape)
+                    batches = [sources] if sources is not None else open_batches(paths, max_open)
+                    k = 0
+                    for batch in batches:
+                        for src in batch:
+                            tile = stack[k, :shape[0], :shape[1]] if stacked else buffer[:shape[0], :shape[1]]
+                            read_tile(src, window, tile)
+                            running.add(tile)
+                            k += 1
+                    results = []
+                    with warnings.catch_warnings():
+                        # 有効なシーンが無い画素（All-NaN slice）は NaN のままでよい
+                        warnings.simplefilter('ignore', RuntimeWarning)
+                        for s in stats:
+                            if s in STACK_REDUCERS:
+                                results.append(STACK_REDUCERS[s](stack[:, :shape[0], :shape[1]]))
+                            else:
+                                results.append(running.result(s))
+                        if percentiles:
+                            results.extend(np.nanpercentile(stack[:, :shape[0], :shape[1]], percentiles, axis=0))
+                    for i, result in enumerate(results, start=1):
+                        dst.write(np.asarray(result, dtype=np.float32), i, window=window)
+    return names
+
+
+def main():
+    ap = argparse.ArgumentParser(description="シーンごとの LST から期間の合成画像を作る")
+    ap.add_argument("--folder", type=str, default=LST_FOLDER, help="シーンごとの LST GeoTIFF のフォルダ")
+    ap.add_argument("--region", type=str, default=DEFAULT_REGION, help="都市（regions.py の slug または名前）")
+    ap.add_argument("--year", type=int, default=None, help="対象年（--start/--end の代わり）")
+    ap.add_argument("--start", type=str, default=None, help="開始日 YYYY-MM-DD")
+    ap.add_argument("--end", type=str, default=None, help="終了日 YYYY-MM-DD（この日を含む）")
+    ap.add_argument("--stats", type=str, nargs='+', default=list(DEFAULT_STATS), choices=list(STATS))
+    ap.add_argument("--percentiles", type=float, nargs='*', default=[], help="求めるパーセンタイル（例: 10 90）")
+    ap.add_argument("--tile", type=int, default=TILE_SIZE, help="空間タイルの一辺の画素数")
+    ap.add_argument("--max-open", type=int, default=MAX_OPEN_FILES, help="同時に開くファイル数の上限")
+    ap.add_argument("--out", type=str, default=None, help="出力 GeoTIFF（既定: LST_composite_{slug}_{開始}_{終了}.tif）")
+    args = ap.parse_args()
+
+    start, end = args.start, args.end
+    if args.year is not None:
+        start, end = f'{args.year}-01-01', f'{args.year}-12-31'
+
+    slug = get_region(args.region).slug
+    scenes = find_scenes(args.folder, start, end, slug)
+    print(f"{len(scenes)}シーンを合成します: {start or '-'} 〜 {end or '-'}")
+    if not scenes:
+        return
+    out_path = args.out or default_output_path(scenes, slug)
+    names = composite([p for _, p in scenes], out_path, args.stats, args.percentiles, args.tile, args.max_open)
+    print(f"保存しました: {out_path}（{', '.join(names)}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ import rasterio
 import numpy as np
 import pandas as pd
 from glob import glob
+from raster_stats import StreamingStats, REFLECTANCE_RANGE
 
 # -------------------------------
 # ファイルの読み込み
@@ -26,5 +27,6 @@ with rasterio.open(FILE_PATH) as src:
     print("変換情報:", src.transform)
     print("各バンドの統計情報:")
     for i in range(data.shape[0]):
-        band = data[i]
-        print(f" バンド {i+1}: min={np.min(band)}, max={np.max(band)}, mean={np.mean(band)}, std={np.std(band)}")   
\ No newline at end of file
+        # 1パスで最小・最大・平均・標準偏差・中央値（近似）を計算
+        stats = StreamingStats(REFLECTANCE_RANGE).update(data[i])
+        print(f" バンド {i+1}: min={stats.min}, max={stats.max}, mean={stats.mean}, std={stats.std}, median≈{stats.percentile(50)}")   
\ No newline at end of file
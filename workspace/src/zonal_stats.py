@@ -0,0 +1,199 @@
+"""
+行政区画ごとの LST・指標の統計量（ゾーン統計）をシーンごとに求めるスクリプト
+
+研究対象都市_行政区画.shp の各行（ゾーン）を、ラスタグリッドごとに1回だけ整数のラベル配列に
+ラスタライズしてキャッシュし（0 = どのゾーンにも入らない, i = i 行目のゾーン）、
+シーンごとの集計は全ゾーンまとめて1パスで行う。ポリゴンごとにマスクを作って繰り返す方法と違い、
+シーンあたりの計算量はゾーン数に依存しない。
+
+・件数・合計・二乗和: np.bincount（weights 指定）で全ゾーンを一度に集計し、平均・標準偏差を求める
+・最小・最大: ラベル順に並べ替える添字（グリッドごとに1回だけ計算）で値を並べ、
+  ゾーンの境界で np.minimum.reduceat / np.maximum.reduceat を取る
+・欠損（nodata・NaN）の画素は集計から除く
+
+ラベル配列はプロセス内と workspace/data/cache/zones/*.npz にキャッシュする。
+
+- 出力
+workspace/data/csv/zonal_stats_{slug}.csv（time_id, 変数, ゾーン, count, mean, std, min, max の縦長の表）
+都市（slug）ごとに、その都市のシーンについてグリッド内にあるゾーンだけを集計する
+（グリッド外のゾーン（他の都市）の行は出力しない。グリッド内で全画素が欠損のゾーンは count = 0 の行になる）。
+
+- 使い方
+python workspace/src/zonal_stats.py                          # LST, NDVI, NDBI の全シーン
+python workspace/src/zonal_stats.py --vars LST --source workspace/data/geotiff/Landsat8/LST/2023
+python workspace/src/zonal_stats.py --region HaiPhong
+"""
+
+import os
+import argparse
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.features import rasterize
+
+from lst_cube import find_sources, SOURCE_FOLDER
+from regions import get_region, DEFAULT_REGION
+from roi_window import ROI_SHP_PATH, CITY_FIELD, grid_key
+from instrumentation import stage
+from raster_io import read_band
+
+ZONE_CACHE_DIR = 'workspace/data/cache/zones'
+CSV_OUTPUT = 'workspace/data/csv/zonal_stats_{slug}.csv'
+DEFAULT_VARIABLES = ['LST', 'NDVI', 'NDBI']
+STAT_COLUMNS = ['count', 'mean', 'std', 'min', 'max']
+
+
+@lru_cache(maxsize=None)
+def load_zones(shp_path=ROI_SHP_PATH, field=CITY_FIELD):
+    """
+    シェープファイルのゾーン名と GeoDataFrame を読み込む
+    :return: (ゾーン名のリスト（ラベル 1, 2, ... の順）, GeoDataFrame)
+    """
+    import geopandas as gpd
+    df = gpd.read_file(shp_path)
+    return list(df[field]), df
+
+
+class ZoneGrid:
+    """
+    あるラスタグリッド上のゾーンのラベル配列と、ラベル順の並べ替え添字
+    :param labels: グリッドと同じ形状の int32 配列（0 = ゾーン外）
+    :param names: ゾーン名のリスト（ラベル i のゾーン名は names[i - 1]）
+    """
+
+    def __init__(self, labels, names):
+        self.labels = labels
+        self.names = names
+        flat = labels.ravel()
+        inside = np.flatnonzero(flat)
+        # ゾーン内の画素をラベル順に並べる添字と、各ゾーンの開始位置
+        self.order = inside[np.argsort(flat[inside], kind='stable')]
+        sorted_labels = flat[self.order]
+        self.present = np.unique(sorted_labels)
+        self.starts = np.searchsorted(sorted_labels, self.present)
+
+    @property
+    def n_zones(self):
+        return len(self.names)
+
+    def reduce(self, data, nodata=None, all_zones=False):
+        """
+        1バンド分の配列をゾーンごとに集計する
+        :param all_zones: True の場合はグリッド内に画素が無いゾーンも（count = 0 の行として）含める
+        :return: ゾーン名をインデックス、STAT_COLUMNS を列とする DataFrame
+        """
+        values = data.ravel()[self.order].astype(np.float64)
+        valid = ~np.isnan(values)
+        if nodata is not None and not np.isnan(nodata):
+            valid &= values != nodata
+        labels = self.labels.ravel()[self.order]
+        n = self.n_zones + 1
+
+        v = np.where(valid, values, 0.0)
+        count = np.bincount(labels, weights=valid, minlength=n)
+        total = np.bincount(labels, weights=v, minlength=n)
+        sumsq = np.bincount(labels, weights=v * v, minlength=n)
+
+        vmin = np.full(n, np.nan)
+        vmax = np.full(n, np.nan)
+        if len(self.starts):
+            vmin[self.present] = np.minimum.reduceat(np.where(valid, values, np.inf), self.starts)
+            vmax[self.present] = np.maximum.reduceat(np.where(valid, values, -np.inf), self.starts)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = total / count
+            std = np.sqrt(np.maximum(sumsq / count - mean * mean, 0.0))
+        empty = count == 0
+        vmin[empty] = vmax[empty] = np.nan
+        zones = np.arange(1, n) if all_zones else self.present
+        return pd.DataFrame({
+            'count': count[zones].astype(np.int64),
+            'mean': mean[zones],
+            'std': std[zones],
+            'min': vmin[zones],
+            'max': vmax[zones],
+        }, index=pd.Index([self.names[i - 1] for i in zones], name='zone'))
+
+
+_ZONE_CACHE = {}
+
+
+def zones_for_grid(crs, transform, width, height, shp_path=ROI_SHP_PATH, field=CITY_FIELD,
+                   cache_dir=ZONE_CACHE_DIR):
+    """
+    ラスタグリッドに対する ZoneGrid を返す関数（プロセス内・ディスクにキャッシュ）
+    :param cache_dir: ディスクキャッシュのフォルダ（None の場合はディスクに保存しない）
+    """
+    key = grid_key(crs, transform, width, height)
+    if key in _ZONE_CACHE:
+        return _ZONE_CACHE[key]
+
+    names, df = load_zones(shp_path, field)
+    cache_path = os.path.join(cache_dir, f"{key}.npz") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        with np.load(cache_path) as z:
+            labels = z['labels']
+    else:
+        shapes = [(geom, i) for i, geom in enumerate(df.to_crs(crs).geometry, start=1) if geom is not None]
+        dtype = np.uint8 if len(names) < 256 else np.int32
+        labels = rasterize(shapes, out_shape=(height, width), transform=transform, fill=0, dtype=dtype)
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez_compressed(cache_path, labels=labels)
+
+    zones = ZoneGrid(labels, names)
+    _ZONE_CACHE[key] = zones
+    return zones
+
+
+def zonal_stats(path, band=1):
+    """GeoTIFF 1バンド（番号またはバンド名）のゾーン統計（ゾーン名をインデックスとする DataFrame）"""
+    with stage('zonal', scene=os.path.basename(path)) as st, rasterio.open(path) as src:
+        zones = zones_for_grid(src.crs, src.transform, src.width, src.height)
+        st.add(pixels=src.width * src.height)
+        return zones.reduce(read_band(src, band))
+
+
+def run(source_root=SOURCE_FOLDER, variables=DEFAULT_VARIABLES, csv_output=None, region=DEFAULT_REGION):
+    """
+    source_root 以下の都市の全シーン・全変数のゾーン統計を縦長の CSV に書き出す
+    :param csv_output: 出力 CSV（None の場合は CSV_OUTPUT）
+    :param region: 都市（regions.py の slug または名前）
+    :return: 書き出した DataFrame
+    """
+    slug = get_region(region).slug
+    csv_output = csv_output or CSV_OUTPUT.format(slug=slug)
+    sources = find_sources(source_root, variables, slug)
+    frames = []
+    for time_id in sorted(sources):
+        for var in variables:
+            path = sources[time_id].get(var)
+            if path is None:
+                continue
+            df = zonal_stats(path, var).reset_index()
+            df.insert(0, 'variable', var)
+            df.insert(0, 'time_id', time_id)
+            frames.append(df)
+    result = pd.concat(frames, ignore_index=True) if frames else \
+        pd.DataFrame(columns=['time_id', 'variable', 'zone'] + STAT_COLUMNS)
+    os.makedirs(os.path.dirname(csv_output), exist_ok=True)
+    result.to_csv(csv_output, index=False)
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="行政区画ごとのゾーン統計")
+    ap.add_argument("--source", type=str, default=SOURCE_FOLDER, help="シーンごとの GeoTIFF のフォルダ")
+    ap.add_argument("--vars", type=str, nargs='+', default=DEFAULT_VARIABLES, help="集計する変数")
+    ap.add_argument("--region", type=str, default=DEFAULT_REGION, help="都市（regions.py の slug または名前）")
+    ap.add_argument("--out", type=str, default=None, help="出力 CSV（既定: zonal_stats_{slug}.csv）")
+    args = ap.parse_args()
+
+    result = run(args.source, args.vars, args.out, args.region)
+    print(f"{result['time_id'].nunique()}シーン・{len(result)}行を保存しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+テスト共通の設定
+・workspace/src を import パスに追加する
+・ee を使うモジュールはオフラインバックエンド（ee_local）を ee として登録してから読み込む
+・ee_local 用の小さな合成 Landsat 8 Level-2 シーン（landsat_scenes）
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
+
+import ee_local  # noqa: E402
+
+ee_local.install()
+
+L2_COLLECTION = 'LANDSAT/LC08/C02/T1_L2'
+L2_BANDS = ['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7', 'ST_B10', 'QA_PIXEL']
+
+# 合成シーンのグリッド（EPSG:4326, 10×10 画素, 0.001 度）
+SCENE_SIZE = 10
+SCENE_ORIGIN = (105.80, 21.01)
+SCENE_RES = 0.001
+# 2019年の3シーン（i 番目のシーンは上から i+1 行が雲）と、期間外の2020年の1シーン
+SCENE_DATES = ['20190110', '20190215', '20190320', '20200105']
+QA_CLEAR = 1 << 6
+QA_CLOUD = 1 << 3
+
+
+def rectangle(col0, row0, col1, row1):
+    """合成シーンの画素 [col0, col1) × [row0, row1) を覆う矩形（経緯度。画素の境界から少し内側）"""
+    x0, y0 = SCENE_ORIGIN
+    eps = SCENE_RES / 10
+    return ee_local.Geometry.Rectangle([x0 + col0 * SCENE_RES + eps, y0 - row1 * SCENE_RES + eps,
+                                        x0 + col1 * SCENE_RES - eps, y0 - row0 * SCENE_RES - eps])
+
+
+def write_scene(path, bands, props=None):
+    """バンド名 -> 2次元配列 の辞書を合成シーンのグリッドの GeoTIFF として書き出す"""
+    first = next(iter(bands.values()))
+    profile = dict(driver='GTiff', width=first.shape[1], height=first.shape[0], count=len(bands),
+                   dtype=first.dtype.name, crs='EPSG:4326', nodata=0,
+                   transform=from_origin(SCENE_ORIGIN[0], SCENE_ORIGIN[1], SCENE_RES, SCENE_RES))
+    with rasterio.open(path, 'w', **profile) as dst:
+        for i, (name, data) in enumerate(bands.items(), start=1):
+            dst.write(data, i)
+            dst.set_band_description(i, name)
+        dst.update_tags(**(props or {}))
+
+
+def scene_bands(index):
+    """i 番目の合成シーンのバンド（SR_Bn = 10000 + 100n + i, ST_B10 = 40000 + 10×列, QA_PIXEL は上から i+1 行が雲）"""
+    shape = (SCENE_SIZE, SCENE_SIZE)
+    bands = {f'SR_B{n}': np.full(shape, 10000 + 100 * n + index, dtype=np.uint16) for n in range(1, 8)}
+    bands['ST_B10'] = np.tile(40000 + 10 * np.arange(SCENE_SIZE, dtype=np.uint16), (SCENE_SIZE, 1))
+    qa = np.full(shape, QA_CLEAR, dtype=np.uint16)
+    qa[:index + 1] = QA_CLOUD
+    bands['QA_PIXEL'] = qa
+    return bands
+
+
+@pytest.fixture
+def landsat_scenes(tmp_path, monkeypatch):
+    """
+    ee_local のデータフォルダに合成シーンを書き出し、ee_local をそのフォルダ・一時エクスポート先に向ける
+    :return: データフォルダのパス
+    """
+    folder = tmp_path / 'ee' / L2_COLLECTION
+    folder.mkdir(parents=True)
+    for i, date in enumerate(SCENE_DATES):
+        write_scene(str(folder / f'LC08_127045_{date}.tif'), scene_bands(i),
+                    {'CLOUD_COVER': 10.0 * (i + 1), 'SPACECRAFT_ID': 'LANDSAT_8'})
+    monkeypatch.setattr(ee_local, 'DATA_ROOT', str(tmp_path / 'ee'))
+    monkeypatch.setattr(ee_local, 'EXPORT_ROOT', str(tmp_path / 'exports'))
+    return str(tmp_path / 'ee')
+
+
+@pytest.fixture
+def getinfo_calls(monkeypatch):
+    """ee_local の各オブジェクトの getInfo（サーバーとの往復に相当）の呼び出し回数を数える"""
+    calls = []
+    for obj in list(vars(ee_local).values()):
+        if isinstance(obj, type) and 'getInfo' in vars(obj):
+            def counted(self, _original=vars(obj)['getInfo']):
+                calls.append(type(self).__name__)
+                return _original(self)
+            monkeypatch.setattr(obj, 'getInfo', counted)
+    return calls
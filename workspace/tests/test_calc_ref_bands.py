@@ -0,0 +1,60 @@
+"""calc_ref_bands.compute_indices_fused のテスト（各指標が正規化差分の式と一致すること）"""
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from calc_ref_bands import compute_indices_fused, INDEX_DEFINITIONS, BAND_NUMBERS
+
+HEIGHT, WIDTH = 9, 7
+
+
+@pytest.fixture
+def reflectance(tmp_path):
+    """SR_B1〜SR_B7 の反射バンド GeoTIFF（一部の画素は 0 以下＝無効）と、その (バンド, 行, 列) の配列"""
+    rng = np.random.default_rng(1)
+    bands = rng.uniform(0.01, 0.6, (7, HEIGHT, WIDTH)).astype(np.float32)
+    bands[3, 0, :3] = 0        # SR_B4 が 0
+    bands[4, 2, 2] = -0.1      # SR_B5 が負
+    path = str(tmp_path / 'L8_20230707_032305_Hanoi_Reflectance.tif')
+    with rasterio.open(path, 'w', driver='GTiff', width=WIDTH, height=HEIGHT, count=7, dtype='float32',
+                       crs='EPSG:32648', transform=from_origin(580000, 2330000, 30, 30)) as dst:
+        dst.write(bands)
+    return path, bands
+
+
+def expected(bands, name):
+    a, b = (bands[BAND_NUMBERS[n] - 1].astype(np.float64) for n in INDEX_DEFINITIONS[name])
+    return (a - b) / (a + b + 1e-10)
+
+
+@pytest.mark.parametrize('compact', [True, False])
+def test_indices_match_normalized_difference(reflectance, compact):
+    path, bands = reflectance
+    with rasterio.open(path) as src:
+        outputs = compute_indices_fused(src, chunk_rows=4, compact=compact)
+
+    assert list(outputs) == list(INDEX_DEFINITIONS)
+    # 全バンドが正の画素（compact の場合は計算対象の画素）
+    used = sorted({BAND_NUMBERS[b] - 1 for pair in INDEX_DEFINITIONS.values() for b in pair})
+    valid = (bands[used] > 0).all(axis=0)
+    for name, out in outputs.items():
+        assert out.dtype == np.float32
+        np.testing.assert_allclose(out[valid], expected(bands, name)[valid], rtol=1e-5, err_msg=name)
+        if compact:
+            assert np.isnan(out[~valid]).all()
+
+
+def test_window_and_mask(reflectance):
+    path, bands = reflectance
+    mask = np.ones((4, 5), dtype=bool)
+    mask[0, 0] = False
+    with rasterio.open(path) as src:
+        outputs = compute_indices_fused(src, ['NDVI'], window=Window(1, 3, 5, 4), mask=mask, compact=False)
+
+    ndvi = outputs['NDVI']
+    assert list(outputs) == ['NDVI'] and ndvi.shape == (4, 5)
+    assert np.isnan(ndvi[0, 0])
+    np.testing.assert_allclose(ndvi[1:], expected(bands, 'NDVI')[4:7, 1:6], rtol=1e-5)
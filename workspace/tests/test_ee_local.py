@@ -0,0 +1,176 @@
+"""ee_local（Earth Engine API のオフラインバックエンド）のテスト"""
+
+import numpy as np
+import pytest
+import rasterio
+
+import ee_local as ee
+from conftest import L2_COLLECTION, L2_BANDS, SCENE_SIZE, QA_CLOUD, rectangle
+
+WHOLE = rectangle(0, 0, SCENE_SIZE, SCENE_SIZE)
+
+
+@pytest.fixture
+def scenes(landsat_scenes):
+    return ee.ImageCollection(L2_COLLECTION)
+
+
+def cloud_mask(image):
+    qa = image.select('QA_PIXEL')
+    return image.updateMask(qa.bitwiseAnd(1 << 3).eq(0))
+
+
+# --------------------
+# コレクション
+# --------------------
+def test_collection_reads_bands_and_properties(scenes):
+    assert scenes.size().getInfo() == 4
+    image = scenes.first()
+    assert image.band_names == L2_BANDS
+    assert image.get('system:index').getInfo() == 'LC08_127045_20190110'
+    assert image.get('CLOUD_COVER').getInfo() == 10.0
+    assert ee.Date(image.get('system:time_start')).format('YYYY-MM-dd').getInfo() == '2019-01-10'
+
+
+def test_filter_date_is_half_open(scenes):
+    dates = scenes.filterDate('2019-01-10', '2019-03-20').aggregate_array('system:index').getInfo()
+    assert dates == ['LC08_127045_20190110', 'LC08_127045_20190215']
+    assert scenes.filterDate('2020-01-01').size().getInfo() == 1
+
+
+def test_filter_bounds(scenes):
+    assert scenes.filterBounds(rectangle(2, 2, 4, 4)).size().getInfo() == 4
+    assert scenes.filterBounds(rectangle(20, 20, 25, 25)).size().getInfo() == 0
+
+
+def test_filter_predicates(scenes):
+    assert scenes.filter(ee.Filter.eq('system:index', 'LC08_127045_20190215')).size().getInfo() == 1
+    assert scenes.filter(ee.Filter.lt('CLOUD_COVER', 25)).size().getInfo() == 2
+    assert scenes.filter(ee.Filter.And(ee.Filter.gte('CLOUD_COVER', 20),
+                                       ee.Filter.lte('CLOUD_COVER', 30))).size().getInfo() == 2
+    assert scenes.filter(ee.Filter.Or(ee.Filter.eq('CLOUD_COVER', 10.0),
+                                      ee.Filter.eq('CLOUD_COVER', 40.0))).size().getInfo() == 2
+    assert scenes.filter(ee.Filter.neq('SPACECRAFT_ID', 'LANDSAT_8')).size().getInfo() == 0
+    # ダイアクリティカルマークを無視して比較する
+    assert ee.Filter.eq('name', 'Ha Noi')({'name': 'Hà Nội'})
+
+
+def test_sort_limit_and_reduce_columns(scenes):
+    latest = scenes.sort('system:time_start', False).limit(2)
+    assert latest.aggregate_array('system:index').getInfo() == ['LC08_127045_20200105', 'LC08_127045_20190320']
+    rows = scenes.limit(2).reduceColumns(ee.Reducer.toList(2), ['system:index', 'CLOUD_COVER']).get('list').getInfo()
+    assert rows == [['LC08_127045_20190110', 10.0], ['LC08_127045_20190215', 20.0]]
+
+
+def test_collection_composite_ignores_masked_pixels(scenes):
+    composite = scenes.filterDate('2019-01-01', '2020-01-01').map(cloud_mask).select('SR_B1').mean()
+    stats = composite.reduceRegion(ee.Reducer.minMax(), WHOLE).getInfo()
+    # SR_B1 = 10100 + シーン番号。1行目は全シーンで雲、2行目はシーン0だけ、3行目はシーン0・1だけ晴れ
+    assert stats == {'SR_B1_min': 10100.0, 'SR_B1_max': 10101.0}
+    rows = composite._bands()['SR_B1'][1].any(axis=1)
+    assert rows.tolist() == [False] + [True] * (SCENE_SIZE - 1)
+
+
+# --------------------
+# 集計（reduceRegion / Reducer）
+# --------------------
+def test_reduce_region_count_mean_percentile(scenes):
+    st = scenes.first().select('ST_B10')
+    # ST_B10 = 40000 + 10×列
+    assert st.reduceRegion(ee.Reducer.count(), WHOLE).getInfo() == {'ST_B10': 100}
+    assert st.reduceRegion(ee.Reducer.mean(), rectangle(0, 0, 5, 5)).getInfo() == {'ST_B10': 40020.0}
+    assert st.reduceRegion(ee.Reducer.percentile([0, 50, 100]), WHOLE).getInfo() == \
+        {'ST_B10_p0': 40000.0, 'ST_B10_p50': 40045.0, 'ST_B10_p100': 40090.0}
+    assert st.reduceRegion(ee.Reducer.percentile([90], ['high']), WHOLE).getInfo() == {'ST_B10': 40081.0}
+
+
+def test_reduce_region_respects_mask(scenes):
+    masked = cloud_mask(scenes.first()).select(['ST_B10', 'SR_B4'])
+    counts = masked.reduceRegion(ee.Reducer.count(), WHOLE).getInfo()
+    assert counts == {'ST_B10': 90, 'SR_B4': 90}
+    # 全画素がマスクされた領域の平均は None
+    assert masked.select('ST_B10').reduceRegion(ee.Reducer.mean(), rectangle(0, 0, 10, 1)).getInfo() == \
+        {'ST_B10': None}
+
+
+def test_reducer_combine(scenes):
+    reducer = ee.Reducer.mean().combine(ee.Reducer.count(), '', True).combine(ee.Reducer.stdDev(), '', True)
+    stats = scenes.first().select('ST_B10').reduceRegion(reducer, rectangle(0, 0, 2, 1)).getInfo()
+    assert stats == {'ST_B10_mean': 40005.0, 'ST_B10_count': 2, 'ST_B10_stdDev': 5.0}
+
+
+# --------------------
+# 画素演算・マスク
+# --------------------
+def test_bitwise_and_update_mask_and_unmask(scenes):
+    image = scenes.filterDate('2019-02-01', '2019-03-01').first()
+    cloud = image.select('QA_PIXEL').bitwiseAnd(QA_CLOUD)
+    values, valid = cloud._bands()['QA_PIXEL']
+    assert values[:2].tolist() == [[QA_CLOUD] * SCENE_SIZE] * 2
+    assert not values[2:].any()
+    assert valid.all()
+
+    masked = image.select('ST_B10').updateMask(cloud.eq(0))
+    assert masked.reduceRegion(ee.Reducer.count(), WHOLE).getInfo() == {'ST_B10': 80}
+    # unmask は値を埋めてマスクを外す（有効ピクセル率の分母）
+    filled = masked.unmask(1)
+    assert filled.reduceRegion(ee.Reducer.count(), WHOLE).getInfo() == {'ST_B10': 100}
+    assert filled.reduceRegion(ee.Reducer.minMax(), rectangle(0, 0, 1, 2)).getInfo() == \
+        {'ST_B10_min': 1.0, 'ST_B10_max': 1.0}
+    assert masked.mask().reduceRegion(ee.Reducer.sum(), WHOLE).getInfo() == {'ST_B10': 80.0}
+
+
+def test_band_math_and_properties(scenes):
+    image = scenes.first()
+    lst = image.select('ST_B10').multiply(0.00341802).add(149.0).subtract(273.15).rename('LST_Celsius')
+    scaled = image.addBands(lst).set('kind', 'LST')
+    assert scaled.band_names == L2_BANDS + ['LST_Celsius']
+    assert scaled.get('kind').getInfo() == 'LST'
+    value = scaled.select('LST_Celsius').reduceRegion(ee.Reducer.mean(), rectangle(0, 0, 1, 1)).getInfo()
+    assert value['LST_Celsius'] == pytest.approx(40000 * 0.00341802 + 149.0 - 273.15)
+    ratio = image.select('SR_B5').subtract(image.select('SR_B4')).divide(image.select('SR_B5').add(image.select('SR_B4')))
+    assert ratio.band_names == ['SR_B5']
+    assert ee.Image.cat([image.select('SR_B4'), image.select('SR_B5')]).band_names == ['SR_B4', 'SR_B5']
+    assert ee.Algorithms.If(ee.Number(1).gt(0), 'yes', 'no').getInfo() == 'yes'
+
+
+def test_clip_masks_outside(scenes):
+    clipped = scenes.first().select('ST_B10').clip(rectangle(0, 0, 3, 3))
+    assert clipped.reduceRegion(ee.Reducer.count()).getInfo() == {'ST_B10': 9}
+
+
+# --------------------
+# エクスポート
+# --------------------
+def test_export_writes_region_window(scenes, landsat_scenes):
+    image = cloud_mask(scenes.first()).select(['ST_B10', 'SR_B4'])
+    task = ee.batch.Export.image.toDrive(image=image, description='L8_test', folder='out',
+                                         fileNamePrefix='L8_test', region=rectangle(0, 0, 4, 3), scale=30)
+    assert task.status()['state'] == 'UNSUBMITTED'
+    task.start()
+
+    assert task.status()['state'] == 'COMPLETED'
+    assert ee.data.getTaskStatus([task.id]) == [{'id': task.id, 'state': 'COMPLETED', 'description': 'L8_test'}]
+    path = f"{ee.EXPORT_ROOT}/out/L8_test.tif"
+    with rasterio.open(path) as src:
+        assert (src.width, src.height, src.count) == (4, 3, 2)
+        assert src.descriptions == ('ST_B10', 'SR_B4')
+        tags = src.tags()
+        assert tags['SPACECRAFT_ID'] == 'LANDSAT_8'
+        assert not any(k.startswith('system') for k in tags)
+        st = src.read(1)
+        nodata = src.nodata
+    # 1行目は雲（nodata）、それ以外は元の値
+    assert (st[0] == nodata).all()
+    assert st[1:].tolist() == [[40000, 40010, 40020, 40030]] * 2
+
+
+def test_export_failure_is_reported(scenes):
+    image = ee.Image(1)
+    task = ee.batch.Export.image.toDrive(image=image, description='no_grid')
+    task.start()
+
+    status = ee.data.getTaskStatus(task.id)[0]
+    assert status['state'] == 'FAILED'
+    assert 'error_message' in status
+    assert ee.data.getTaskStatus(['missing'])[0]['state'] == 'UNKNOWN'
@@ -0,0 +1,125 @@
+"""gee_export_queue.ExportQueue の再試行・取り消し・開始エラー時の待ち時間のテスト"""
+
+import json
+
+import pytest
+
+import gee_export_queue
+from gee_export_queue import ExportQueue
+
+
+class FakeTask:
+    def __init__(self, task_id, error=None):
+        self.id = task_id
+        self.error = error
+
+    def start(self):
+        if self.error:
+            raise RuntimeError(self.error)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.time / time.sleep を仮想時計に置き換え、sleep した秒数を記録する"""
+    state = {'now': 1000.0, 'sleeps': []}
+
+    def sleep(seconds):
+        state['sleeps'].append(seconds)
+        state['now'] += seconds
+
+    monkeypatch.setattr(gee_export_queue.time, 'time', lambda: state['now'])
+    monkeypatch.setattr(gee_export_queue.time, 'sleep', sleep)
+    return state
+
+
+@pytest.fixture
+def statuses(monkeypatch):
+    """task_id -> 状態の列（ポーリングごとに先頭から取り出す。最後の状態は保持する）"""
+    table = {}
+
+    def get_task_status(task_ids):
+        result = []
+        for t in task_ids:
+            seq = table[t]
+            result.append({'id': t, 'state': seq.pop(0) if len(seq) > 1 else seq[0]})
+        return result
+
+    monkeypatch.setattr(gee_export_queue.ee.data, 'getTaskStatus', get_task_status)
+    return table
+
+
+def test_cancelled_task_is_not_resubmitted(clock, statuses):
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return FakeTask(f'T{len(calls)}')
+
+    statuses['T1'] = ['RUNNING', 'CANCELLED']
+    queue = ExportQueue(poll_interval=1, max_poll_interval=4)
+    queue.submit('a', factory)
+    result = queue.run()
+
+    assert len(calls) == 1
+    assert result['a']['state'] == 'CANCELLED'
+    assert queue.failed() == ['a']
+
+
+def test_cancelled_journal_entry_is_skipped(tmp_path):
+    path = tmp_path / 'journal.json'
+    path.write_text(json.dumps({'a': {'state': 'CANCEL_REQUESTED', 'task_id': 'T1', 'attempts': 1, 'error': None}}))
+    queue = ExportQueue(str(path))
+
+    assert queue.submit('a', lambda: FakeTask('T2')) is False
+    assert queue.pending == []
+
+
+def test_failed_task_is_resubmitted(clock, statuses):
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return FakeTask(f'T{len(calls)}')
+
+    statuses['T1'] = ['FAILED']
+    statuses['T2'] = ['COMPLETED']
+    queue = ExportQueue(poll_interval=1)
+    queue.submit('a', factory)
+    result = queue.run()
+
+    assert len(calls) == 2
+    assert result['a']['state'] == 'COMPLETED'
+    assert result['a']['attempts'] == 2
+
+
+def test_start_errors_back_off_exponentially(clock, statuses):
+    calls = []
+
+    def factory():
+        calls.append(clock['now'])
+        return FakeTask('T1', error='quota exceeded' if len(calls) < 3 else None)
+
+    statuses['T1'] = ['COMPLETED']
+    queue = ExportQueue(poll_interval=5, max_poll_interval=60, max_retries=2)
+    queue.submit('a', factory)
+    result = queue.run()
+
+    assert result['a']['state'] == 'COMPLETED'
+    # 1回目の失敗後は 5 秒、2回目の失敗後は 10 秒待ってから開始する
+    assert [b - a for a, b in zip(calls, calls[1:])] == [5, 10]
+
+
+def test_start_errors_give_up_after_max_retries(clock, statuses):
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return FakeTask('T1', error='quota exceeded')
+
+    queue = ExportQueue(poll_interval=5, max_poll_interval=60, max_retries=2)
+    queue.submit('a', factory)
+    result = queue.run()
+
+    assert len(calls) == 3
+    assert result['a']['state'] == 'FAILED'
+    assert sum(clock['sleeps']) == 15
@@ -0,0 +1,53 @@
+"""
+gee_landsat8_get_data のメタデータ一括取得のテスト
+ee_local を ee として使い、getInfo（サーバーとの往復）が年・都市の組ごとに1回であることを確かめる
+"""
+
+import pytest
+
+import gee_landsat8_get_data as getdata
+from conftest import SCENE_SIZE, rectangle
+
+
+@pytest.fixture
+def collection(landsat_scenes):
+    return getdata.build_collection('2019-01-01', '2019-12-31', rectangle(0, 0, SCENE_SIZE, SCENE_SIZE))
+
+
+def test_fetch_collection_metadata_uses_one_getinfo(collection, getinfo_calls):
+    rows = getdata.fetch_collection_metadata(collection, rectangle(0, 0, SCENE_SIZE, SCENE_SIZE), 30)
+
+    assert len(getinfo_calls) == 1
+    assert [row['date_str'] for row in rows] == ['2019-01-10', '2019-02-15', '2019-03-20']
+    assert [row['total_pixels'] for row in rows] == [100, 100, 100]
+    # i 番目のシーンは上から i+1 行が雲
+    assert [row['valid_ratio'] for row in rows] == pytest.approx([0.9, 0.8, 0.7])
+    assert all(set(row) == set(getdata.METADATA_COLUMNS) for row in rows)
+
+
+def test_fetch_regions_metadata_uses_one_getinfo_for_all_regions(collection, getinfo_calls):
+    rois = {
+        'West': rectangle(0, 0, 5, SCENE_SIZE),
+        'South': rectangle(0, 5, SCENE_SIZE, SCENE_SIZE),
+        'Outside': rectangle(20, 20, 25, 25),
+    }
+    metadata = getdata.fetch_regions_metadata(collection, rois, 30)
+
+    assert len(getinfo_calls) == 1
+    assert [row['total_pixels'] for row in metadata['West']] == [50, 50, 50]
+    assert [row['valid_ratio'] for row in metadata['West']] == pytest.approx([0.9, 0.8, 0.7])
+    # 南半分には雲がかからない
+    assert [row['valid_ratio'] for row in metadata['South']] == pytest.approx([1.0, 1.0, 1.0])
+    # 画素のない都市の行は返さない
+    assert metadata['Outside'] == []
+    assert metadata['West'][0]['time_id'] == '20190110_000000'
+
+
+def test_add_pixel_counts_sets_properties_without_getinfo(collection, getinfo_calls):
+    roi = rectangle(0, 0, SCENE_SIZE, SCENE_SIZE)
+    annotated = collection.map(lambda image: getdata.add_pixel_counts(image, roi, 30, suffix='__Hanoi'))
+
+    assert getinfo_calls == []
+    first = annotated.first()
+    assert first.get('total_pixels__Hanoi').getInfo() == 100
+    assert first.get('valid_ratio__Hanoi').getInfo() == pytest.approx(0.9)
@@ -0,0 +1,49 @@
+"""raster_io の int16 量子化のテスト（往復の誤差が scale / 2 + float32 の丸め（|値| × 2^-22）以内であること）"""
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from raster_io import quantize, dequantize, quantization, write_quantized, read_band, INT16_NODATA
+
+
+@pytest.mark.parametrize('name, low, high', [
+    ('NDVI', -1, 1),
+    ('SR_B4', -0.2, 1.6),
+    ('LST', -50, 80),
+])
+def test_round_trip_error_bound(name, low, high):
+    scale, offset = quantization(name)
+    values = np.random.default_rng(0).uniform(low, high, 200_000).astype(np.float32)
+    restored = dequantize(quantize(values, scale, offset), scale, offset)
+
+    error = np.abs(restored.astype(np.float64) - values)
+    assert restored.dtype == np.float32
+    assert (error <= scale / 2 + np.abs(values) * 2.0 ** -22).all()
+    # float32 の丸めがあるため scale / 2 をわずかに超えることがある
+    assert error.max() == pytest.approx(scale / 2, rel=1e-2)
+
+
+def test_nan_and_out_of_range():
+    scale, offset = quantization('NDVI')
+    q = quantize(np.array([np.nan, 10.0, -10.0], dtype=np.float32), scale, offset)
+    assert q.tolist() == [INT16_NODATA, 32767, -32767]
+    restored = dequantize(q, scale, offset)
+    assert np.isnan(restored[0])
+    assert restored[1:] == pytest.approx([3.2767, -3.2767])
+
+
+def test_write_quantized_reads_back(tmp_path):
+    data = {'NDVI': np.array([[0.25, np.nan], [-0.5, 0.12345]], dtype=np.float32),
+            'LST': np.array([[31.234, 28.0], [np.nan, 45.678]], dtype=np.float32)}
+    profile = dict(driver='GTiff', width=2, height=2, count=1, dtype='float32', crs='EPSG:32648',
+                   transform=from_origin(580000, 2330000, 30, 30))
+    path = write_quantized(str(tmp_path / 'q.tif'), data, profile)
+
+    with rasterio.open(path) as src:
+        assert src.dtypes[0] == 'int16'
+        for name, values in data.items():
+            restored = read_band(src, name)
+            scale, _ = quantization(name)
+            np.testing.assert_allclose(restored, values, atol=scale / 2 + 1e-5, equal_nan=True)
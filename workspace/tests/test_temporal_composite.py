@@ -0,0 +1,94 @@
+"""temporal_composite.composite のテスト（時間方向のスタックで計算した値と一致すること）"""
+
+import warnings
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import temporal_composite
+from temporal_composite import composite, RunningStats
+
+HEIGHT, WIDTH = 37, 23
+
+
+@pytest.fixture
+def scenes(tmp_path):
+    """NaN（雲）を含む同じグリッドの LST シーン7枚と、その (シーン, 行, 列) の配列"""
+    rng = np.random.default_rng(0)
+    stack = rng.normal(30, 5, (7, HEIGHT, WIDTH)).astype(np.float32)
+    stack[rng.random(stack.shape) < 0.3] = np.nan
+    stack[:, 0, 0] = np.nan  # 有効なシーンが無い画素
+    paths = []
+    for k, data in enumerate(stack):
+        path = str(tmp_path / f'L8_2023010{k}_000000_Hanoi_LST.tif')
+        with rasterio.open(path, 'w', driver='GTiff', width=WIDTH, height=HEIGHT, count=1, dtype='float32',
+                           crs='EPSG:32648', transform=from_origin(580000, 2330000, 30, 30), nodata=np.nan) as dst:
+            dst.write(data, 1)
+        paths.append(path)
+    return paths, stack
+
+
+def expected(stack, stats, percentiles=()):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        reference = {
+            'mean': np.nanmean(stack, axis=0),
+            'median': np.nanmedian(stack, axis=0),
+            'min': np.nanmin(stack, axis=0),
+            'max': np.nanmax(stack, axis=0),
+            'std': np.nanstd(stack, axis=0),
+            'count': np.count_nonzero(~np.isnan(stack), axis=0).astype(np.float32),
+        }
+        return [reference[s] for s in stats] + list(np.nanpercentile(stack, percentiles, axis=0))
+
+
+def read_all(path):
+    with rasterio.open(path) as src:
+        return list(src.read()), src.descriptions
+
+
+@pytest.mark.parametrize('max_open', [64, 3, 1])
+def test_composite_matches_stacked_reduction(scenes, tmp_path, max_open):
+    paths, stack = scenes
+    stats = ('mean', 'median', 'min', 'max', 'std', 'count')
+    out = str(tmp_path / 'composite.tif')
+    names = composite(paths, out, stats, percentiles=(10, 90), tile_size=16, max_open=max_open)
+
+    bands, descriptions = read_all(out)
+    assert names == list(stats) + ['p10', 'p90'] == list(descriptions)
+    for name, band, ref in zip(names, bands, expected(stack, stats, (10, 90))):
+        np.testing.assert_allclose(band, ref, rtol=1e-5, atol=1e-4, equal_nan=True, err_msg=name)
+    assert np.isnan(bands[0][0, 0]) and bands[-3][0, 0] == 0
+
+
+def test_stack_is_limited_by_memory_budget(scenes, tmp_path, monkeypatch):
+    paths, stack = scenes
+    # 上限が 0MB でもタイルは1行ずつ読んで合成する
+    monkeypatch.setattr(temporal_composite, 'STACK_MEMORY_MB', 0)
+    out = str(tmp_path / 'composite.tif')
+    composite(paths, out, ('median',), tile_size=16)
+
+    bands, _ = read_all(out)
+    np.testing.assert_allclose(bands[0], expected(stack, ('median',))[0], rtol=1e-6, equal_nan=True)
+
+
+def test_running_stats_ignores_nan():
+    running = RunningStats((1, 3))
+    for tile in ([[1, np.nan, np.nan]], [[3, 5, np.nan]]):
+        running.add(np.asarray(tile, dtype=np.float32))
+    np.testing.assert_array_equal(running.result('count'), [[2, 1, 0]])
+    np.testing.assert_array_equal(running.result('mean'), [[2, 5, np.nan]])
+    np.testing.assert_array_equal(running.result('min'), [[1, 5, np.nan]])
+    np.testing.assert_array_equal(running.result('std'), [[1, 0, np.nan]])
+
+
+def test_mismatched_grid_is_rejected(scenes, tmp_path):
+    paths, _ = scenes
+    other = str(tmp_path / 'other.tif')
+    with rasterio.open(other, 'w', driver='GTiff', width=WIDTH, height=HEIGHT, count=1, dtype='float32',
+                       crs='EPSG:32648', transform=from_origin(580030, 2330000, 30, 30)) as dst:
+        dst.write(np.zeros((HEIGHT, WIDTH), dtype=np.float32), 1)
+    with pytest.raises(ValueError):
+        composite(paths + [other], str(tmp_path / 'composite.tif'))